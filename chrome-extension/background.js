@@ -1,5 +1,5 @@
 import { initializeApp } from './firebase-app.js';
-import { getFirestore, collection, doc, setDoc, getDoc } from './firebase-firestore.js';
+import { getFirestore, collection, doc, setDoc } from './firebase-firestore.js';
 import { getAuth, signInWithEmailAndPassword, createUserWithEmailAndPassword, signOut } from './firebase-auth.js';
 
 let firebaseApp = null;
@@ -63,8 +63,21 @@ function isSystemPage(url) {
            url === 'chrome://newtab/';
 }
 
+// Firebase ID token of the signed-in user: the server takes the user's email
+// from it instead of trusting the request body
+async function getIdToken() {
+    if (!auth) {
+        await initializeFirebase();
+    }
+    await auth.authStateReady();
+    if (!auth.currentUser) {
+        throw new Error('Not signed in');
+    }
+    return auth.currentUser.getIdToken();
+}
+
 async function trackTabVisit(url) {
-    if (!currentUser || !db) return;
+    if (!currentUser) return;
 
     try {
         const urlObj = new URL(url);
@@ -73,17 +86,18 @@ async function trackTabVisit(url) {
         
         const timestamp = `${now.getFullYear()}-${String(now.getMonth() + 1).padStart(2, '0')}-${String(now.getDate()).padStart(2, '0')} ${String(now.getHours()).padStart(2, '0')}:${String(now.getMinutes()).padStart(2, '0')}:${String(now.getSeconds()).padStart(2, '0')}`;
         
-        const userDocRef = doc(db, 'Data', currentUser.email);
-        const userDoc = await getDoc(userDocRef);
-        
-        let userData = {};
-        if (userDoc.exists()) {
-            userData = userDoc.data();
+        // The server writes the day bucket and updates the /stats aggregate together
+        const response = await fetch(`${FLASK_API_URL}/visits`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Authorization': `Bearer ${await getIdToken()}`
+            },
+            body: JSON.stringify({ visits: { [timestamp]: hostname } })
+        });
+        if (!response.ok) {
+            throw new Error(`Server responded with ${response.status}`);
         }
-        
-        userData[timestamp] = hostname;
-        
-        await setDoc(userDocRef, userData);
         console.log('Tab visit tracked:', hostname, timestamp);
     } catch (error) {
         console.error('Error tracking tab visit:', error);
@@ -185,17 +199,12 @@ async function handleLogout() {
 }
 
 async function getStats(email) {
-    if (!db) return { totalUrls: 0, accuracy: null };
-
     try {
-        const userDocRef = doc(db, 'Data', email);
-        const userDoc = await getDoc(userDocRef);
-        
-        if (userDoc.exists()) {
-            const data = userDoc.data();
-            const totalUrls = Object.keys(data).length;
-            
-            return { totalUrls, accuracy: null };
+        // History is sharded into day documents, so let the server aggregate it
+        const response = await fetch(`${FLASK_API_URL}/stats/${encodeURIComponent(email)}/`);
+        if (response.ok) {
+            const stats = await response.json();
+            return { totalUrls: stats.totalUrls || 0, accuracy: null };
         }
         
         return { totalUrls: 0, accuracy: null };
@@ -1,5 +1,5 @@
 import { initializeApp } from './firebase-app.js';
-import { getFirestore, collection, doc, setDoc, getDoc, updateDoc } from './firebase-firestore.js';
+import { getFirestore, collection, doc, setDoc } from './firebase-firestore.js';
 import { getAuth, signInWithEmailAndPassword, createUserWithEmailAndPassword, signOut } from './firebase-auth.js';
 
 let firebaseApp = null;
@@ -32,7 +32,10 @@ chrome.runtime.onStartup.addListener(async () => {
 
 // Initialize when service worker starts
 chrome.runtime.onSuspend.addListener(() => {
+    // Best effort: the worker may be gone before the request completes, but
+    // the buffer is persisted and sent by the next worker
     console.log('Service worker suspending');
+    flushTabEvents();
 });
 
 // Initialize immediately when service worker loads
@@ -203,6 +206,48 @@ function extractDomain(url) {
     }
 }
 
+// Query parameters that only track where a click came from
+// (keep in sync with flask-server/duplicate_index.py)
+const TRACKING_PARAMS = new Set([
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', 'ref', 'ref_src', 'ref_url', 'si', 'spm'
+]);
+
+// Canonical URL for duplicate detection: same page regardless of http/https,
+// www., default ports, trailing slashes, fragments or tracking parameters
+// (mirrors canonical_url in flask-server/duplicate_index.py)
+function canonicalUrl(url) {
+    const schemeEnd = url.indexOf('://');
+    const scheme = schemeEnd === -1 ? '' : url.slice(0, schemeEnd).toLowerCase();
+    if (scheme !== 'http' && scheme !== 'https') return url;
+    
+    let rest = url.slice(schemeEnd + 3).split('#')[0];
+    const queryStart = rest.indexOf('?');
+    const query = queryStart === -1 ? '' : rest.slice(queryStart + 1);
+    if (queryStart !== -1) rest = rest.slice(0, queryStart);
+    const pathStart = rest.indexOf('/');
+    let host = pathStart === -1 ? rest : rest.slice(0, pathStart);
+    let path = pathStart === -1 ? '' : rest.slice(pathStart + 1);
+    
+    host = host.slice(host.lastIndexOf('@') + 1).toLowerCase().replace(/\.+$/, '');
+    if (host.endsWith(':80') || host.endsWith(':443')) {
+        host = host.slice(0, host.lastIndexOf(':')).replace(/\.+$/, '');
+    }
+    if (host.startsWith('www.')) host = host.slice(4);
+    
+    path = path.replace(/\/{2,}/g, '/').replace(/^\/+|\/+$/g, '');
+    
+    let canonical = path ? `https://${host}/${path}` : `https://${host}`;
+    const params = query.split('&')
+        .filter(param => {
+            const key = param.split('=')[0].toLowerCase();
+            return param && !TRACKING_PARAMS.has(key) && !key.startsWith('utm_');
+        })
+        .sort((a, b) => (a < b ? -1 : a > b ? 1 : 0));
+    if (params.length) canonical += '?' + params.join('&');
+    return canonical;
+}
+
 // Periodically reclassify tabs based on their activity
 function startPeriodicClassification() {
     // Run every 5 minutes
@@ -218,6 +263,7 @@ function startPeriodicClassification() {
                 }
             }
         });
+        syncTabAnalysis();
     }, 5 * 60 * 1000); // 5 minutes
 }
 
@@ -327,35 +373,253 @@ function createTabData(tab) {
     };
 }
 
-// Track tab activity to Firebase
-async function trackTabActivity(tabId, action, data) {
-    if (!currentUser || !db) return;
+// Tab events are buffered, coalesced per tab and sent to the server's
+// /ingest endpoint in batches instead of one Firestore read + write per event.
+// The buffer is mirrored to chrome.storage.session because Chrome stops an
+// idle service worker after 30 seconds, and an alarm wakes a stopped worker
+// to send what the previous one left behind.
+const INGEST_FLUSH_INTERVAL = 20 * 1000; // send buffered events within 20 seconds while awake
+const INGEST_ALARM = 'ingest-flush';
+const INGEST_ALARM_MINUTES = 0.5;        // ...and on this alarm, which also wakes the worker
+const INGEST_MAX_TABS = 50;              // ...or as soon as this many tabs have changes
+const INGEST_BATCH_SIZE = 200;           // tabs per /ingest request
+const INGEST_MAX_BUFFERED_TABS = 1000;   // oldest changes are dropped beyond this while offline
+const INGEST_STORAGE_KEY = 'pendingTabEvents';
+const pendingEvents = new Map();
+let inFlightEvents = [];
+let flushTimer = null;
+let flushInFlight = null;
+
+chrome.alarms.create(INGEST_ALARM, { periodInMinutes: INGEST_ALARM_MINUTES });
+chrome.alarms.onAlarm.addListener(alarm => {
+    if (alarm.name === INGEST_ALARM) flushTabEvents();
+});
+
+// Events buffered by a previous worker; the batch it was sending is resent,
+// since it can't be told whether that request reached the server
+const restoredTabEvents = chrome.storage.session.get(INGEST_STORAGE_KEY).then(result => {
+    const saved = result[INGEST_STORAGE_KEY];
+    if (!saved) return;
+    requeueTabEvents(saved.pending || []);
+    requeueTabEvents(saved.inFlight || []);
+    persistTabEvents();
+}).catch(error => {
+    console.error('Error restoring tab activity:', error);
+});
+
+function persistTabEvents() {
+    chrome.storage.session.set({
+        [INGEST_STORAGE_KEY]: { pending: [...pendingEvents.values()], inFlight: inFlightEvents }
+    }).catch(error => {
+        console.error('Error persisting tab activity:', error);
+    });
+}
+
+// Record a tab event in the buffer
+function trackTabActivity(tabId, action, data) {
+    if (!currentUser) return;
     
-    try {
-        const timestamp = new Date().toISOString();
-        const userDocRef = doc(db, 'TabActivity', currentUser.email);
-        const activity = {
+    const timestamp = new Date().toISOString();
+    const pending = pendingEvents.get(tabId);
+    if (pending) {
+        pending.actions[action] = (pending.actions[action] || 0) + 1;
+        pending.action = action;
+        pending.timestamp = timestamp;
+        pending.tab = { ...data };
+    } else {
+        pendingEvents.set(tabId, {
             tabId,
             action,
             timestamp,
-            ...data
-        };
-        
-        // Check if document exists, create if it doesn't
-        const docSnap = await getDoc(userDocRef);
-        if (!docSnap.exists()) {
-            await setDoc(userDocRef, {
-                tabs: { [tabId]: data },
-                activity: { [timestamp]: activity }
+            first: timestamp,
+            actions: { [action]: 1 },
+            tab: { ...data }
+        });
+    }
+    persistTabEvents();
+    
+    if (pendingEvents.size >= INGEST_MAX_TABS) {
+        flushTabEvents();
+    } else if (!flushTimer) {
+        flushTimer = setTimeout(flushTabEvents, INGEST_FLUSH_INTERVAL);
+    }
+}
+
+// Firebase ID token of the signed-in user: the server takes the user's email
+// from it instead of trusting the request body
+async function getIdToken() {
+    if (!auth) {
+        await initializeFirebase();
+    }
+    await auth.authStateReady();
+    if (!auth.currentUser) {
+        throw new Error('Not signed in');
+    }
+    return auth.currentUser.getIdToken();
+}
+
+// Send buffered events to the server
+async function flushTabEvents() {
+    clearTimeout(flushTimer);
+    flushTimer = null;
+    await restoredTabEvents;
+    if (flushInFlight) return flushInFlight;
+    if (!currentUser || pendingEvents.size === 0) return;
+    
+    const events = [];
+    for (const [tabId, event] of pendingEvents) {
+        if (events.length >= INGEST_BATCH_SIZE) break;
+        events.push(event);
+        pendingEvents.delete(tabId);
+    }
+    inFlightEvents = events;
+    persistTabEvents();
+    
+    flushInFlight = (async () => {
+        try {
+            const response = await fetch(`${FLASK_API_URL}/ingest`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Authorization': `Bearer ${await getIdToken()}`
+                },
+                body: JSON.stringify({ events })
             });
+            if (!response.ok) {
+                throw new Error(`Server responded with ${response.status}`);
+            }
+        } catch (error) {
+            console.error('Error sending tab activity:', error);
+            requeueTabEvents(events);
+        } finally {
+            inFlightEvents = [];
+            persistTabEvents();
+            flushInFlight = null;
+            if (pendingEvents.size > 0 && !flushTimer) {
+                flushTimer = setTimeout(flushTabEvents, INGEST_FLUSH_INTERVAL);
+            }
+        }
+    })();
+    return flushInFlight;
+}
+
+// Put events from a failed request back, merging with newer changes to the same tab
+function requeueTabEvents(events) {
+    events.forEach(event => {
+        const newer = pendingEvents.get(event.tabId);
+        if (newer) {
+            Object.entries(event.actions).forEach(([action, count]) => {
+                newer.actions[action] = (newer.actions[action] || 0) + count;
+            });
+            newer.first = event.first;
         } else {
-            await updateDoc(userDocRef, {
-                [`tabs.${tabId}`]: data,
-                [`activity.${timestamp}`]: activity
+            pendingEvents.set(event.tabId, event);
+        }
+    });
+    
+    while (pendingEvents.size > INGEST_MAX_BUFFERED_TABS) {
+        pendingEvents.delete(pendingEvents.keys().next().value);
+    }
+}
+
+// Server-side analysis is kept in sync with /analyze/delta: after the first
+// call only tabs that changed since the last acknowledged version are sent
+const ANALYSIS_FIELDS = ['id', 'url', 'title', 'domain', 'createdAt', 'lastActivated', 'activationCount',
+                         'totalActiveTime', 'isPinned', 'groupId', 'domainFrequency'];
+let analysisSession = null; // { id, version, sent: Map(tab id -> fingerprint), state }
+let analysisInFlight = null;
+let lastAnalysis = null; // totals of the last successful sync, shown by the popup
+
+function analysisTab(data) {
+    const tab = {};
+    ANALYSIS_FIELDS.forEach(field => {
+        if (data[field] !== undefined) tab[field] = data[field];
+    });
+    return tab;
+}
+
+// Fold the changed classifications / suggestions of a response into the full analysis
+function applyAnalysisDelta(state, delta) {
+    [['classifications', 'id'], ['duplicates', 'key'], ['group_suggestions', 'key']].forEach(([field, key]) => {
+        const entries = state[field];
+        delta[field].removed.forEach(removed => entries.delete(removed));
+        delta[field].changed.forEach(entry => entries.set(entry[key], entry));
+    });
+    state.healthScore = delta.health_score;
+    state.totalTabs = delta.total_tabs;
+    state.summary = delta.summary;
+    return state;
+}
+
+async function postAnalysis(body) {
+    const response = await fetch(`${FLASK_API_URL}/analyze/delta`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ email: currentUser.email, ...body })
+    });
+    if (response.status === 409) return null;
+    if (!response.ok) {
+        throw new Error(`Server responded with ${response.status}`);
+    }
+    return response.json();
+}
+
+// Send the tabs that changed since the last sync (all of them for a new session)
+async function syncTabAnalysis() {
+    if (!currentUser) return null;
+    if (analysisInFlight) return analysisInFlight.catch(() => null);
+
+    analysisInFlight = (async () => {
+        const current = new Map();
+        tabData.forEach(data => {
+            const tab = analysisTab(data);
+            current.set(tab.id, { tab, fingerprint: JSON.stringify(tab) });
+        });
+
+        let delta = null;
+        if (analysisSession) {
+            const upserts = [];
+            const removed = [];
+            current.forEach(({ tab, fingerprint }, id) => {
+                if (analysisSession.sent.get(id) !== fingerprint) upserts.push(tab);
+            });
+            analysisSession.sent.forEach((_, id) => {
+                if (!current.has(id)) removed.push(id);
             });
+            // Unknown or stale session (server restart, another worker): resend everything
+            delta = await postAnalysis({
+                session: analysisSession.id,
+                version: analysisSession.version,
+                upserts,
+                removed
+            });
+        }
+        if (!delta) {
+            analysisSession = null;
+            delta = await postAnalysis({ tabs: Array.from(current.values(), ({ tab }) => tab) });
+            if (!delta) return null;
+            analysisSession = {
+                id: delta.session,
+                state: { classifications: new Map(), duplicates: new Map(), group_suggestions: new Map() }
+            };
         }
+
+        analysisSession.version = delta.version;
+        analysisSession.sent = new Map(Array.from(current, ([id, { fingerprint }]) => [id, fingerprint]));
+        const state = applyAnalysisDelta(analysisSession.state, delta);
+        lastAnalysis = { healthScore: state.healthScore, totalTabs: state.totalTabs, summary: state.summary };
+        return state;
+    })();
+
+    try {
+        return await analysisInFlight;
     } catch (error) {
-        console.error('Error tracking tab activity:', error);
+        // The session may or may not have advanced: start over on the next sync
+        console.error('Error syncing tab analysis:', error);
+        analysisSession = null;
+        return null;
+    } finally {
+        analysisInFlight = null;
     }
 }
 
@@ -426,17 +690,18 @@ async function getTabSuggestions() {
         }
     });
     
-    // Find duplicate tabs (show which one to keep)
+    // Find duplicate tabs (show which one to keep), matching canonical URLs
     const urlMap = new Map();
     tabs.forEach(tab => {
         if (!tab.url || tab.url === 'chrome://newtab/') return;
-        if (!urlMap.has(tab.url)) {
-            urlMap.set(tab.url, []);
+        const key = canonicalUrl(tab.url);
+        if (!urlMap.has(key)) {
+            urlMap.set(key, []);
         }
-        urlMap.get(tab.url).push(tab);
+        urlMap.get(key).push(tab);
     });
     
-    urlMap.forEach((tabs, url) => {
+    urlMap.forEach((tabs) => {
         if (tabs.length > 1) {
             // Sort by activity to keep the most active one
             const sortedTabs = tabs.sort((a, b) => {
@@ -452,7 +717,7 @@ async function getTabSuggestions() {
             });
             
             suggestions.duplicates.push({
-                url,
+                url: sortedTabs[0].url,
                 count: tabs.length,
                 keepTab: { id: sortedTabs[0].id, title: sortedTabs[0].title },
                 closeTabs: sortedTabs.slice(1).map(t => ({ id: t.id, title: t.title }))
@@ -460,6 +725,12 @@ async function getTabSuggestions() {
         }
     });
     
+    // Server analysis from the last sync; the popup doesn't wait for a new one
+    syncTabAnalysis();
+    if (lastAnalysis) {
+        suggestions.analysis = lastAnalysis;
+    }
+    
     return suggestions;
 }
 
@@ -611,7 +882,7 @@ async function handleSignup(email, password) {
         chrome.storage.local.set({ user: { email: currentUser.email } });
         
         const userDocRef = doc(db, 'TabActivity', email);
-        await setDoc(userDocRef, { tabs: {}, activity: {} });
+        await setDoc(userDocRef, { tabs: {} });
         
         return { success: true };
     } catch (error) {
@@ -234,15 +234,15 @@ async function loadTabSuggestions() {
         // Get tab stats
         chrome.runtime.sendMessage({ action: 'getTabStats' }, function(statsResponse) {
             if (statsResponse && statsResponse.success) {
-                updateStats(statsResponse.stats);
+                updateStats(withServerAnalysis(statsResponse.stats, response.suggestions));
             } else {
                 // Fallback stats
-                updateStats({
+                updateStats(withServerAnalysis({
                     totalTabs: tabs.length,
                     unusedTabs: 0,
                     forgottenTabs: 0,
                     healthScore: 100
-                });
+                }, response.suggestions));
             }
         });
     } else {
@@ -261,6 +261,13 @@ async function loadTabSuggestions() {
     hideLoading();
 }
 
+// The server's health score (it uses the trained tab classifier) replaces the local estimate once synced
+function withServerAnalysis(stats, suggestions) {
+    const analysis = suggestions && suggestions.analysis;
+    if (!analysis) return stats;
+    return { ...stats, healthScore: Math.round(analysis.healthScore) };
+}
+
 function updateStats(stats) {
     document.getElementById('total-tabs').textContent = stats.totalTabs || 0;
     document.getElementById('can-close').textContent = 
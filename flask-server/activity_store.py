@@ -0,0 +1,309 @@
+import os
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+from firebase_admin import firestore
+
+from tab_classifier import legacy_activity_entries
+
+# Keeps each event document far below Firestore's 1 MiB limit
+MAX_EVENTS_PER_DOC = 200
+# Largest coalesced batch accepted by one ingest call (one transaction)
+MAX_INGEST_TABS = 1000
+
+# Retention: raw events are rolled into daily summaries after RAW_DAYS and
+# the summaries are deleted after SUMMARY_DAYS (see compact_activity.py)
+DEFAULT_RAW_DAYS = int(os.environ.get('TABSENSE_ACTIVITY_RAW_DAYS', 30))
+DEFAULT_SUMMARY_DAYS = int(os.environ.get('TABSENSE_ACTIVITY_SUMMARY_DAYS', 365))
+# Sources compacted per transaction: event documents (up to
+# MAX_EVENTS_PER_DOC events each) and legacy activity entries
+COMPACTION_DOCS = 10
+COMPACTION_FIELDS = 500
+# Tab fields kept in daily summaries: enough to featurize and label the tab
+SUMMARY_TAB_FIELDS = ('id', 'tabId', 'action', 'timestamp', 'createdAt', 'lastActivated', 'activationCount',
+                      'totalActiveTime', 'isPinned', 'groupId', 'domain', 'domainFrequency', 'status')
+
+
+def coalesce_events(events):
+    """
+    Merge tab events into one record per tab: the latest tab snapshot, the
+    last action, per-action counts and the time range they cover
+    Accepts raw events {'tabId', 'action', 'timestamp', 'tab'} as well as
+    records already coalesced by the extension (with 'actions' / 'first').
+    """
+    by_tab = {}
+    for event in sorted(events, key=lambda e: e['timestamp']):
+        tab_id = str(event['tabId'])
+        record = by_tab.get(tab_id)
+        if record is None:
+            record = by_tab[tab_id] = {
+                'tabId': event['tabId'],
+                'first': event.get('first', event['timestamp']),
+                'actions': {},
+                'tab': None
+            }
+        for action, count in (event.get('actions') or {event['action']: 1}).items():
+            record['actions'][action] = record['actions'].get(action, 0) + count
+        record['action'] = event['action']
+        record['timestamp'] = event['timestamp']
+        if event.get('tab'):
+            record['tab'] = event['tab']
+    return list(by_tab.values())
+
+
+def summarize_events(daily, events):
+    """
+    Fold raw events into a daily summary document (updated in place):
+        {'day', 'events': n, 'actions': {action: n},
+         'tabs': {tab_id: {'first', 'last', 'actions', 'event': last event, trimmed}}}
+    """
+    daily['events'] = daily.get('events', 0) + len(events)
+    actions = daily.setdefault('actions', {})
+    tabs = daily.setdefault('tabs', {})
+    for event in events:
+        counts = event.get('actions') or {event.get('action', 'updated'): 1}
+        first = event.get('first', event['timestamp'])
+        summary = tabs.setdefault(str(event.get('tabId', event.get('id'))),
+                                  {'first': first, 'last': '', 'actions': {}})
+        for action, count in counts.items():
+            actions[action] = actions.get(action, 0) + count
+            summary['actions'][action] = summary['actions'].get(action, 0) + count
+        summary['first'] = min(summary['first'], first)
+        if event['timestamp'] >= summary['last']:
+            summary['last'] = event['timestamp']
+            summary['event'] = {key: event[key] for key in SUMMARY_TAB_FIELDS if key in event}
+    return daily
+
+
+def event_record(record):
+    """
+    Stored form of a coalesced event, shaped like the legacy activity
+    entries ({tabId, action, timestamp, ...tab fields}) read by training
+    """
+    return {
+        **(record['tab'] or {}),
+        'tabId': record['tabId'],
+        'action': record['action'],
+        'actions': record['actions'],
+        'first': record['first'],
+        'timestamp': record['timestamp']
+    }
+
+
+class ActivityStore:
+    """
+    Tab activity written by the /ingest endpoint:
+        TabActivity/<email>                     {'tabs': {tab_id: latest tab}}  (open tabs)
+        TabActivity/<email>/events/<start>-<id> {'day', 'start', 'end', 'count', 'events': [...]}
+        TabActivity/<email>/daily/<day>         summarize_events() of compacted events
+    Event documents are append-only and partitioned by time: each ingest call
+    adds one document per MAX_EVENTS_PER_DOC coalesced events instead of
+    growing the user document. Open-tab state, events and the StatsStore
+    tab counters are written in one transaction, so concurrent ingests of
+    the same user cannot double-count a change.
+    Old events are rolled into daily summaries by apply_retention().
+    """
+    def __init__(self, db, stats_store=None, collection='TabActivity'):
+        self.db = db
+        self.stats_store = stats_store
+        self.collection = collection
+
+    def user_ref(self, email):
+        return self.db.collection(self.collection).document(email)
+
+    def events_ref(self, email):
+        return self.user_ref(email).collection('events')
+
+    def ingest(self, email, events):
+        """
+        Coalesce and store a batch of events
+        Returns {'events': coalesced records, 'documents': event documents written}
+        """
+        records = coalesce_events(events)
+        if not records:
+            return {'events': 0, 'documents': 0}
+        if len(records) > MAX_INGEST_TABS:
+            raise ValueError(f"At most {MAX_INGEST_TABS} tabs per ingest call")
+
+        chunks = [records[start:start + MAX_EVENTS_PER_DOC]
+                  for start in range(0, len(records), MAX_EVENTS_PER_DOC)]
+        # Ids fixed outside the transaction so a retry rewrites the same documents
+        doc_ids = [f"{chunk[0]['timestamp']}-{uuid.uuid4().hex[:8]}" for chunk in chunks]
+
+        @firestore.transactional
+        def write(transaction):
+            user_ref = self.user_ref(email)
+            snapshot = user_ref.get(field_paths=['tabs'], transaction=transaction)
+            old_tabs = ((snapshot.to_dict() or {}).get('tabs') or {}) if snapshot.exists else {}
+
+            changes = []
+            if self.stats_store is not None:
+                counters = self.stats_store.tabs_ref(email).get(transaction=transaction)
+                if not counters.exists:
+                    # First ingest for this user: count the tabs already stored
+                    changes.extend((None, tab) for tab in old_tabs.values())
+
+            tab_updates = {}
+            for record in records:
+                tab_id = str(record['tabId'])
+                closed = record['action'] == 'closed'
+                new_tab = None if closed else (record['tab'] or old_tabs.get(tab_id))
+                changes.append((old_tabs.get(tab_id), new_tab))
+                tab_updates[tab_id] = firestore.DELETE_FIELD if new_tab is None else new_tab
+                old_tabs[tab_id] = new_tab
+
+            transaction.set(user_ref, {'tabs': tab_updates}, merge=True)
+            for doc_id, chunk in zip(doc_ids, chunks):
+                transaction.set(self.events_ref(email).document(doc_id), {
+                    'day': chunk[0]['timestamp'][:10],
+                    'start': chunk[0]['timestamp'],
+                    'end': chunk[-1]['timestamp'],
+                    'count': len(chunk),
+                    'events': [event_record(record) for record in chunk]
+                })
+            if self.stats_store is not None:
+                self.stats_store.record_tab_changes(email, changes, batch=transaction)
+
+        write(self.db.transaction())
+        return {'events': len(records), 'documents': len(chunks)}
+
+    def iter_events(self, email, since=None, until=None):
+        """
+        Yield stored event records in time order
+        since / until: inclusive 'YYYY-MM-DD' bounds
+        """
+        # ISO 'start' strings sort by time, so one field serves both the
+        # range and the ordering without a composite index
+        query = self.events_ref(email)
+        if since:
+            query = query.where(filter=firestore.FieldFilter('start', '>=', since))
+        if until:
+            query = query.where(filter=firestore.FieldFilter('start', '<=', f"{until}~"))
+
+        for snapshot in query.order_by('start').stream():
+            yield from (snapshot.to_dict() or {}).get('events', [])
+
+    def daily_ref(self, email):
+        return self.user_ref(email).collection('daily')
+
+    def iter_summarized_events(self, email, since=None):
+        """Last event of each tab per day from the compacted daily summaries"""
+        query = self.daily_ref(email)
+        if since:
+            query = query.where(filter=firestore.FieldFilter('day', '>=', since))
+        for snapshot in query.order_by('day').stream():
+            for summary in ((snapshot.to_dict() or {}).get('tabs') or {}).values():
+                if summary.get('event'):
+                    yield summary['event']
+
+    def compact(self, email, before):
+        """
+        Roll raw events from before `before` ('YYYY-MM-DD') into daily
+        summaries: event documents from /ingest and entries of the legacy
+        activity map
+        Each chunk is summarized and its sources deleted in one transaction
+        that re-reads the sources first, so events are counted exactly once
+        even with ingest or another compaction running. Only old, immutable
+        sources are touched; ingest only appends new documents.
+        Returns the number of events compacted.
+        """
+        compacted = 0
+
+        query = (self.events_ref(email)
+                 .where(filter=firestore.FieldFilter('start', '<', before))
+                 .order_by('start'))
+        refs = [snapshot.reference for snapshot in query.select([]).stream()]
+        for start in range(0, len(refs), COMPACTION_DOCS):
+            compacted += self._compact_documents(email, refs[start:start + COMPACTION_DOCS])
+
+        # Top-level keys of the legacy map: full timestamps or, for nested
+        # entries, timestamps cut at the seconds (see legacy_activity_entries)
+        keys = sorted(key for key in self.legacy_activity(email) if key[:10] < before)
+        for start in range(0, len(keys), COMPACTION_FIELDS):
+            compacted += self._compact_legacy(email, keys[start:start + COMPACTION_FIELDS])
+
+        return compacted
+
+    def _merge_days(self, transaction, email, events):
+        by_day = {}
+        for event in events:
+            by_day.setdefault(event['timestamp'][:10], []).append(event)
+        day_refs = {day: self.daily_ref(email).document(day) for day in by_day}
+        current = {snapshot.id: snapshot.to_dict() or {}
+                   for snapshot in transaction.get_all(list(day_refs.values())) if snapshot.exists}
+        for day, day_events in by_day.items():
+            daily = summarize_events(current.get(day, {'day': day}), day_events)
+            transaction.set(day_refs[day], daily)
+
+    def _compact_documents(self, email, refs):
+        @firestore.transactional
+        def compact(transaction):
+            events = []
+            existing = []
+            for snapshot in transaction.get_all(refs):
+                # Another compaction may already have taken it
+                if snapshot.exists:
+                    existing.append(snapshot.reference)
+                    events.extend((snapshot.to_dict() or {}).get('events', []))
+            # A batch that straddles the cutoff is compacted whole
+            self._merge_days(transaction, email, events)
+            for ref in existing:
+                transaction.delete(ref)
+            return len(events)
+
+        return compact(self.db.transaction())
+
+    def _compact_legacy(self, email, keys):
+        paths = [self.db.field_path('activity', key) for key in keys]
+
+        @firestore.transactional
+        def compact(transaction):
+            snapshot = self.user_ref(email).get(field_paths=paths, transaction=transaction)
+            activity = ((snapshot.to_dict() or {}).get('activity') or {}) if snapshot.exists else {}
+            activity = {key: activity[key] for key in keys if key in activity}
+            entries = legacy_activity_entries(activity)
+            if not entries:
+                return 0
+            self._merge_days(transaction, email, [event for _, event in entries])
+
+            # Only entries summarized as tab events are deleted; a nested map
+            # goes whole once all of its entries are
+            per_key = Counter(entry_keys[0] for entry_keys, _ in entries)
+            deleted = set()
+            for entry_keys, _ in entries:
+                value = activity[entry_keys[0]]
+                whole = len(entry_keys) == 1 or per_key[entry_keys[0]] == len(value)
+                deleted.add(entry_keys[:1] if whole else entry_keys)
+            transaction.update(self.user_ref(email), {
+                self.db.field_path('activity', *path): firestore.DELETE_FIELD for path in deleted
+            })
+            return len(entries)
+
+        return compact(self.db.transaction())
+
+    def expire_summaries(self, email, before):
+        """Delete daily summaries from before `before`; returns how many"""
+        refs = [snapshot.reference for snapshot in
+                self.daily_ref(email).where(filter=firestore.FieldFilter('day', '<', before)).select([]).stream()]
+        for start in range(0, len(refs), 500):
+            batch = self.db.batch()
+            for ref in refs[start:start + 500]:
+                batch.delete(ref)
+            batch.commit()
+        return len(refs)
+
+    def apply_retention(self, email, raw_days=DEFAULT_RAW_DAYS, summary_days=DEFAULT_SUMMARY_DAYS, now=None):
+        """Compact events older than raw_days and drop summaries older than summary_days"""
+        now = now or datetime.now()
+        raw_cutoff = (now - timedelta(days=raw_days)).strftime('%Y-%m-%d')
+        summary_cutoff = (now - timedelta(days=summary_days)).strftime('%Y-%m-%d')
+        return {
+            'compacted': self.compact(email, raw_cutoff),
+            'expired': self.expire_summaries(email, summary_cutoff)
+        }
+
+    def legacy_activity(self, email):
+        """Events in the unbounded activity map the extension used to write"""
+        snapshot = self.user_ref(email).get(field_paths=['activity'])
+        return ((snapshot.to_dict() or {}).get('activity') or {}) if snapshot.exists else {}
@@ -0,0 +1,488 @@
+import fcntl
+import json
+import os
+import re
+import stat
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+from duplicate_index import DEFAULT_DUPLICATE_MODE, DEFAULT_SIMILARITY, canonical_url, duplicate_buckets
+from tab_classifier import TabClassifier, TabFrame
+from tab_grouping import DEFAULT_GROUP_SIMILARITY, DEFAULT_GROUPING_MODE
+
+MAX_ANALYSIS_SESSIONS = int(os.environ.get('TABSENSE_MAX_ANALYSIS_SESSIONS', 1000))
+ANALYSIS_SESSION_TTL = int(os.environ.get('TABSENSE_ANALYSIS_SESSION_TTL', 3600))
+# Every worker on the host appends its sessions' updates here, so a delta can
+# reach any gunicorn worker; '' keeps sessions in the worker's memory only.
+# The directory must belong to the server's user and is made private to it.
+# With several hosts, pin each client to one host or share the directory.
+ANALYSIS_SESSION_DIR = os.environ.get('TABSENSE_ANALYSIS_SESSION_DIR', os.path.join(
+    tempfile.gettempdir(), f'tabsense-analysis-sessions-{os.getuid()}'))
+# Day counts of unchanged tabs keep aging, so every tab is reclassified this often
+RECLASSIFY_SECONDS = 600
+# A session log gets a snapshot this often, so loading it replays at most this many updates
+SNAPSHOT_EVERY = 100
+# Attributes that are not part of a snapshot
+_PROCESS_ATTRIBUTES = ('classifier', 'lock', 'log', 'used_at')
+# One-key objects standing for the values JSON has no type for (see _to_json)
+_JSON_TAGS = ('__items__', '__counter__', '__ndarray__', '__datetime__')
+
+
+class SessionConflict(Exception):
+    """The client must resend all of its tabs to start a new session"""
+
+
+def _diff(old, new):
+    """{'changed': entries new or different in `new`, 'removed': keys missing from it}"""
+    return {
+        'changed': [entry for key, entry in new.items() if old.get(key) != entry],
+        'removed': [key for key in old if key not in new]
+    }
+
+
+class AnalysisSession:
+    """
+    Incremental analyze_tabs for one client
+    The session keeps the client's tabs with the indexes analyze_tabs would
+    rebuild on every call: duplicate buckets (exact or canonical URL), domain
+    buckets of ungrouped tabs, per-tab classifications and the action and
+    health counters derived from them. apply() updates only what the changed
+    tabs touch and returns only the suggestions that changed, so the work
+    and the response scale with churn instead of with the number of tabs.
+    Near-duplicate and content grouping are global, so they are recomputed
+    when any tab changes (the response is still a diff).
+    Every tab is reclassified at least every RECLASSIFY_SECONDS because
+    classifications depend on how long ago a tab was created and used.
+    """
+    def __init__(self, email, model=None, duplicate_mode=DEFAULT_DUPLICATE_MODE, similarity=DEFAULT_SIMILARITY,
+                 grouping_mode=DEFAULT_GROUPING_MODE, group_similarity=DEFAULT_GROUP_SIMILARITY):
+        self.id = uuid.uuid4().hex
+        self.email = email
+        self.version = 0
+        self.duplicate_mode = duplicate_mode
+        self.similarity = similarity
+        self.grouping_mode = grouping_mode
+        self.group_similarity = group_similarity
+        self.classifier = TabClassifier(model)
+        self.lock = threading.Lock()
+        self.log = None  # SessionLog shared with the other workers
+        self.used_at = time.time()
+        self.classified_at = 0
+        self.next_position = 0
+
+        self.tabs = {}            # tab id -> tab
+        self.positions = {}       # tab id -> order in which the client first sent it
+        self.url_keys = {}        # tab id -> duplicate bucket key
+        self.url_buckets = {}     # key -> {tab id: None}, insertion ordered
+        self.domains = {}         # ungrouped tab id -> domain
+        self.domain_buckets = {}  # domain -> {tab id: None}
+        self.classifications = {} # tab id -> classification record
+        self.health_flags = {}    # tab id -> (never used, old, inactive)
+        self.action_counts = Counter()
+        self.health_counts = np.zeros(3, dtype=np.int64)
+        self.duplicates = {}      # bucket key -> duplicate suggestion
+        self.groups = {}          # domain or first tab id -> group suggestion
+
+    def update(self, version, upserts=(), removed=(), now=None):
+        """apply() for a client that last saw `version`; raises SessionConflict if it is stale"""
+        now = now or datetime.now()
+        with self.lock:
+            if self.log is None:
+                self._check_version(version)
+                return self.apply(upserts, removed, now)
+
+            with self.log.locked() as f:
+                # Another worker may have served the previous deltas
+                for record in self.log.read(f):
+                    self.replay(record)
+                self._check_version(version)
+                results = self.apply(upserts, removed, now)
+                self.log.append(f, ('apply', self.version, now, list(upserts), list(removed)))
+                if self.version % SNAPSHOT_EVERY == 0:
+                    self.log.append(f, ('snapshot', self.snapshot()))
+                return results
+
+    def _check_version(self, version):
+        if version != self.version:
+            raise SessionConflict(f"Session is at version {self.version}, not {version}")
+
+    def replay(self, record):
+        """Apply a SessionLog record written by this or another worker"""
+        if record[0] == 'snapshot':
+            self.restore(record[1])
+        elif record[0] == 'apply':
+            _, version, now, upserts, removed = record
+            self.apply(upserts, removed, now)
+            if self.version != version:
+                raise SessionConflict('Analysis session log is inconsistent')
+
+    def snapshot(self):
+        """The session's analysis state, without the tab model"""
+        return {name: value for name, value in self.__dict__.items() if name not in _PROCESS_ATTRIBUTES}
+
+    def restore(self, state):
+        self.__dict__.update(state)
+
+    def apply(self, upserts=(), removed=(), now=None):
+        """
+        Add or replace `upserts` (tab dicts) and drop the `removed` tab ids
+        Returns the changed parts of the analysis and bumps the version
+        """
+        now = now or datetime.now()
+        touched_keys = set()
+        touched_domains = set()
+        removed_ids = []
+
+        for tab_id in removed:
+            if tab_id in self.tabs:
+                self._unindex(tab_id, touched_keys, touched_domains)
+                self._forget(tab_id)
+                del self.tabs[tab_id], self.positions[tab_id]
+                removed_ids.append(tab_id)
+        upserted = []
+        for tab in upserts:
+            if tab['id'] in self.tabs:
+                self._unindex(tab['id'], touched_keys, touched_domains)
+            else:
+                self.positions[tab['id']] = self.next_position
+                self.next_position += 1
+            self.tabs[tab['id']] = tab
+            self._index(tab['id'], touched_keys, touched_domains)
+            upserted.append(tab['id'])
+
+        # Measured on `now` rather than the wall clock, so replaying a log reproduces it
+        refresh = now.timestamp() - self.classified_at >= RECLASSIFY_SECONDS
+        classifications = self._classify(list(self.tabs) if refresh else upserted, now)
+        if refresh:
+            self.classified_at = now.timestamp()
+
+        changed = bool(upserted or removed_ids)
+        duplicates = self._update_duplicates(touched_keys, changed)
+        groups = self._update_groups(touched_domains, changed)
+        self.version += 1
+
+        return {
+            'session': self.id,
+            'version': self.version,
+            'health_score': self.classifier._health_score(len(self.tabs), *self.health_counts.tolist()),
+            'total_tabs': len(self.tabs),
+            'classifications': {'changed': classifications, 'removed': removed_ids},
+            'duplicates': duplicates,
+            'group_suggestions': groups,
+            'summary': {
+                'to_close': self.action_counts['close'],
+                'to_archive': self.action_counts['archive'],
+                'to_keep': self.action_counts['keep'],
+                'to_review': self.action_counts['review'],
+                'duplicate_tabs': sum(len(entry['close']) for entry in self.duplicates.values()),
+                'grouping_opportunities': len(self.groups)
+            }
+        }
+
+    def _index(self, tab_id, touched_keys, touched_domains):
+        tab = self.tabs[tab_id]
+        url = tab.get('url', '')
+        if url:
+            key = url if self.duplicate_mode == 'exact' else canonical_url(url)
+            self.url_keys[tab_id] = key
+            self.url_buckets.setdefault(key, {})[tab_id] = None
+            touched_keys.add(key)
+        if tab.get('groupId', -1) == -1 and tab.get('domain', ''):
+            self.domains[tab_id] = tab['domain']
+            self.domain_buckets.setdefault(tab['domain'], {})[tab_id] = None
+            touched_domains.add(tab['domain'])
+
+    def _unindex(self, tab_id, touched_keys, touched_domains):
+        for owner, buckets, touched in ((self.url_keys, self.url_buckets, touched_keys),
+                                        (self.domains, self.domain_buckets, touched_domains)):
+            key = owner.pop(tab_id, None)
+            if key is not None:
+                del buckets[key][tab_id]
+                if not buckets[key]:
+                    del buckets[key]
+                touched.add(key)
+
+    def _forget(self, tab_id):
+        record = self.classifications.pop(tab_id, None)
+        if record is not None:
+            self.action_counts[record['action']] -= 1
+            self.health_counts -= self.health_flags.pop(tab_id)
+
+    def _members(self, tab_ids):
+        # Suggestions list tabs in the order the client first sent them, like analyze_tabs
+        return [self.tabs[tab_id] for tab_id in sorted(tab_ids, key=self.positions.__getitem__)]
+
+    def _classify(self, tab_ids, now):
+        """Classify the given tabs; returns the records that changed"""
+        if not tab_ids:
+            return []
+        frame = TabFrame([self.tabs[tab_id] for tab_id in tab_ids], now)
+        flags = np.column_stack([
+            frame.activation_count == 0,
+            (frame.created_at != 0) & (frame.days_since_created > 7),
+            (frame.last_activated != 0) & (frame.days_since_activated > 3)
+        ]).astype(np.int64)
+
+        changed = []
+        for tab_id, record, row in zip(tab_ids, self.classifier.classify_frame(frame).to_records(), flags):
+            previous = self.classifications.get(tab_id)
+            if previous is not None:
+                self.action_counts[previous['action']] -= 1
+                self.health_counts -= self.health_flags[tab_id]
+            self.classifications[tab_id] = record
+            self.health_flags[tab_id] = row
+            self.action_counts[record['action']] += 1
+            self.health_counts += row
+            if record != previous:
+                changed.append(record)
+        return changed
+
+    def _update_duplicates(self, touched_keys, changed):
+        if self.duplicate_mode == 'near':
+            if not changed:
+                return {'changed': [], 'removed': []}
+            # Similarity merges buckets across keys, so recompute them all
+            tabs = list(self.tabs.values())
+            buckets = duplicate_buckets(tabs, 'near', self.similarity)
+            new = {key: entry for key, entry in zip(
+                [key for key, positions in buckets.items() if len(positions) > 1],
+                self.classifier.duplicates_from_buckets(tabs, buckets))}
+        else:
+            new = dict(self.duplicates)
+            for key in touched_keys:
+                new.pop(key, None)
+                members = self._members(self.url_buckets.get(key, ()))
+                if len(members) > 1:
+                    new[key] = self.classifier.duplicates_from_buckets(members, {key: range(len(members))})[0]
+
+        for key, entry in new.items():
+            entry.setdefault('key', key)
+        diff = _diff(self.duplicates, new)
+        self.duplicates = new
+        return diff
+
+    def _update_groups(self, touched_domains, changed):
+        if self.grouping_mode == 'content':
+            if not changed:
+                return {'changed': [], 'removed': []}
+            tabs = list(self.tabs.values())
+            ungrouped = [i for i, tab in enumerate(tabs) if tab.get('groupId', -1) == -1]
+            new = {str(min(t['id'] for t in group['tabs'])): group
+                   for group in self.classifier.content_groups(tabs, ungrouped, self.group_similarity)}
+        else:
+            new = dict(self.groups)
+            for domain in touched_domains:
+                new.pop(domain, None)
+                members = self._members(self.domain_buckets.get(domain, ()))
+                for group in self.classifier.groups_from_buckets(members, {domain: range(len(members))}):
+                    new[domain] = group
+
+        for key, entry in new.items():
+            entry.setdefault('key', key)
+        diff = _diff(self.groups, new)
+        self.groups = new
+        return diff
+
+
+def _to_json(value):
+    """
+    JSON-safe form of session state: dicts with non-string keys, Counters,
+    arrays and datetimes become one-key tagged objects _from_json reverses
+    """
+    if isinstance(value, Counter):
+        return {'__counter__': [[key, count] for key, count in value.items()]}
+    if isinstance(value, dict):
+        if all(isinstance(key, str) for key in value) and not (len(value) == 1 and next(iter(value)) in _JSON_TAGS):
+            return {key: _to_json(item) for key, item in value.items()}
+        return {'__items__': [[_to_json(key), _to_json(item)] for key, item in value.items()]}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return {'__ndarray__': value.tolist()}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    return value
+
+
+def _from_json(obj):
+    if len(obj) == 1:
+        tag, value = next(iter(obj.items()))
+        if tag == '__items__':
+            return {key: item for key, item in value}
+        if tag == '__counter__':
+            return Counter({key: count for key, count in value})
+        if tag == '__ndarray__':
+            return np.array(value, dtype=np.int64)
+        if tag == '__datetime__':
+            return datetime.fromisoformat(value)
+    return obj
+
+
+def _private_directory(path):
+    """
+    Create `path` readable and writable by this user only; False if it
+    exists but belongs to another user, who could plant or read session logs
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        return False
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return True
+
+
+class SessionLog:
+    """
+    Append-only JSON lines file of one session's updates, shared by the
+    workers of a host
+        ['header', {'id', 'email', 'options'}]
+        ['apply', version, now, upserts, removed]   # one per update
+        ['snapshot', AnalysisSession.snapshot()]    # every SNAPSHOT_EVERY versions
+    Workers hold the file lock while they catch up with and append to it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0  # end of the records this worker has applied
+
+    @contextmanager
+    def locked(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND | os.O_NOFOLLOW, 0o600)
+        with os.fdopen(fd, 'a+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield f
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read(self, f):
+        """Records appended since the last read or append"""
+        size = os.fstat(f.fileno()).st_size
+        if size < self.offset:
+            raise SessionConflict('Analysis session log was removed')
+        f.seek(self.offset)
+        data = f.read(size - self.offset)
+        try:
+            if data and not data.endswith(b'\n'):
+                # A worker died while appending
+                raise ValueError('truncated record')
+            records = [json.loads(line, object_hook=_from_json) for line in data.splitlines()]
+        except ValueError as e:
+            raise SessionConflict(f"Unreadable analysis session log: {str(e)}")
+        self.offset = size
+        return records
+
+    def append(self, f, record):
+        f.seek(0, os.SEEK_END)
+        f.write(json.dumps(_to_json(record)).encode('utf-8') + b'\n')
+        f.flush()
+        self.offset = f.tell()
+
+
+class AnalysisSessions:
+    """
+    Least recently used AnalysisSessions of this worker, expiring after
+    `ttl` seconds without a request
+    With a directory, every session is also kept as a SessionLog there, so
+    any worker sharing the directory can load it and continue it.
+    """
+    def __init__(self, max_sessions=MAX_ANALYSIS_SESSIONS, ttl=ANALYSIS_SESSION_TTL,
+                 directory=ANALYSIS_SESSION_DIR):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.directory = directory
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        if self.directory and not _private_directory(self.directory):
+            print(f"Not sharing analysis sessions through {self.directory}: it belongs to another user")
+            self.directory = ''
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _log_path(self, session_id):
+        return os.path.join(self.directory, f"{session_id}.log")
+
+    def create(self, email, model=None, **options):
+        session = AnalysisSession(email, model, **options)
+        if self.directory:
+            session.log = SessionLog(self._log_path(session.id))
+            with session.log.locked() as f:
+                session.log.append(f, ('header', {'id': session.id, 'email': email, 'options': options}))
+        self._sweep()
+        self._remember(session)
+        return session
+
+    def get(self, session_id, email, model=None):
+        """The client's session; raises SessionConflict when the client must resync"""
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and now - session.used_at > self.ttl:
+                del self._sessions[session_id]
+                session = None
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                session.used_at = now
+        if session is None and self.directory:
+            session = self._load(session_id, model)
+            self._remember(session)
+        if session is None or session.email != email:
+            raise SessionConflict('Unknown analysis session')
+        return session
+
+    def _remember(self, session):
+        with self._lock:
+            self._sessions[session.id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def _load(self, session_id, model):
+        """Rebuild a session another worker started from its log"""
+        if not re.fullmatch(r'[0-9a-f]{32}', str(session_id)):
+            raise SessionConflict('Unknown analysis session')
+        path = self._log_path(session_id)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                raise SessionConflict('Unknown analysis session')
+        except OSError:
+            raise SessionConflict('Unknown analysis session')
+
+        log = SessionLog(path)
+        with log.locked() as f:
+            records = log.read(f)
+        if not records or records[0][0] != 'header':
+            raise SessionConflict('Unknown analysis session')
+        header = records[0][1]
+        session = AnalysisSession(header['email'], model, **header['options'])
+        session.id = header['id']
+        # Only the updates after the last snapshot need to be replayed
+        start = max([i for i, record in enumerate(records) if record[0] == 'snapshot'], default=1)
+        for record in records[start:]:
+            session.replay(record)
+        session.log = log
+        return session
+
+    def _sweep(self):
+        """Drop the sessions (and logs) nobody used within the TTL"""
+        now = time.time()
+        with self._lock:
+            for session_id in [key for key, session in self._sessions.items() if now - session.used_at > self.ttl]:
+                del self._sessions[session_id]
+        if not self.directory:
+            return
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith('.log') and now - entry.stat().st_mtime > self.ttl:
+                    os.remove(entry.path)
+            except OSError:
+                pass  # removed by another worker
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from firebase_admin import firestore
+
+# Documents per Firestore batch commit
+DEFAULT_WRITE_BATCH = int(os.environ.get('TABSENSE_ANALYSIS_WRITE_BATCH', 50))
+# Attempts per write before it is dropped (the next analysis rewrites it)
+DEFAULT_WRITE_RETRIES = int(os.environ.get('TABSENSE_ANALYSIS_WRITE_RETRIES', 3))
+RETRY_DELAY_SECONDS = 0.5
+# Hashes of the last write per document, least recently written dropped first
+MAX_WRITTEN_HASHES = 10000
+
+
+def result_hash(fields):
+    """Stable digest of a JSON-serializable analysis result"""
+    encoded = json.dumps(fields, sort_keys=True, separators=(',', ':'), default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+class AnalysisWriter:
+    """
+    Write-behind for TabAnalysis/<email>: requests hand their results to
+    submit() and return without waiting on Firestore.
+    A background thread takes the latest result per document (older queued
+    results for the same document are replaced, not written), skips results
+    whose hash matches the last one written, and commits the rest in
+    batches of up to max_batch documents. A failed batch is retried with
+    backoff up to max_retries times, unless a newer result was queued for
+    the document in the meantime.
+    """
+    def __init__(self, db, collection='TabAnalysis', max_batch=DEFAULT_WRITE_BATCH,
+                 max_retries=DEFAULT_WRITE_RETRIES, retry_delay=RETRY_DELAY_SECONDS):
+        self.db = db
+        self.collection = collection
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._pending = OrderedDict()  # (email, fields) -> (values, merge, attempts)
+        self._written = OrderedDict()  # (email, fields) -> hash of the last committed values
+        self._writing = 0
+        self._stopping = False
+        self._condition = threading.Condition()
+        # Started on first use, after a preloading server has forked
+        self._thread = None
+        self._recent_batches = deque(maxlen=100)
+        self.counters = {'submitted': 0, 'coalesced': 0, 'unchanged': 0, 'written': 0, 'retried': 0, 'failed': 0}
+
+    def submit(self, email, values, merge=False):
+        """
+        Queue `values` (a dict of top-level fields) for TabAnalysis/<email>;
+        a SERVER_TIMESTAMP 'timestamp' is added when it is written
+        """
+        key = (email, tuple(sorted(values)))
+        with self._condition:
+            self.counters['submitted'] += 1
+            if key in self._pending:
+                self.counters['coalesced'] += 1
+                del self._pending[key]
+            self._pending[key] = (values, merge, 0)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='analysis-writer', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batch = []
+                while self._pending and len(batch) < self.max_batch:
+                    batch.append(self._pending.popitem(last=False))
+                self._writing = len(batch)
+
+            failed = self._write(batch)
+
+            with self._condition:
+                self._writing = 0
+                if failed:
+                    self._requeue(failed)
+                self._condition.notify_all()
+            if failed and not self._stopping:
+                time.sleep(self.retry_delay * 2 ** (max(entry[1][2] for entry in failed) - 1))
+
+    def _write(self, batch):
+        """Commit the changed entries of `batch`; returns the entries to retry"""
+        changed = []
+        for key, (values, merge, attempts) in batch:
+            digest = result_hash(values)
+            if self._written.get(key) == digest:
+                self.counters['unchanged'] += 1
+            else:
+                changed.append((key, (values, merge, attempts), digest))
+        if not changed:
+            return []
+
+        start = time.perf_counter()
+        try:
+            write_batch = self.db.batch()
+            for (email, _), (values, merge, _), _ in changed:
+                write_batch.set(self.db.collection(self.collection).document(email),
+                                {**values, 'timestamp': firestore.SERVER_TIMESTAMP}, merge=merge)
+            write_batch.commit()
+        except Exception as e:
+            print(f"Error writing {len(changed)} tab analyses: {str(e)}")
+            return [(key, (values, merge, attempts + 1)) for key, (values, merge, attempts), _ in changed]
+
+        with self._condition:
+            for key, _, digest in changed:
+                self._written.pop(key, None)
+                self._written[key] = digest
+            while len(self._written) > MAX_WRITTEN_HASHES:
+                self._written.popitem(last=False)
+            self.counters['written'] += len(changed)
+            self._recent_batches.append({'documents': len(changed), 'seconds': time.perf_counter() - start})
+        return []
+
+    def _requeue(self, failed):
+        # Caller holds self._condition
+        for key, (values, merge, attempts) in failed:
+            if key in self._pending:
+                continue  # a newer result replaces the failed one
+            if attempts >= self.max_retries:
+                self.counters['failed'] += 1
+                continue
+            self.counters['retried'] += 1
+            self._pending[key] = (values, merge, attempts)
+            self._pending.move_to_end(key, last=False)
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is written or dropped; returns False on timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._writing, timeout)
+
+    def stats(self):
+        with self._condition:
+            batches = list(self._recent_batches)
+            stats = {'pending': len(self._pending), **self.counters}
+        stats['avg_batch_documents'] = sum(b['documents'] for b in batches) / len(batches) if batches else None
+        stats['avg_batch_seconds'] = sum(b['seconds'] for b in batches) / len(batches) if batches else None
+        return stats
+
+    def shutdown(self, timeout=30):
+        """Write what is queued, then stop the thread"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark the fused analyze_tabs pipeline against the multi-pass one,
+content grouping (tab_grouping.py) of 5k topical tabs, and the size and
+encode time of streamed (json_stream.py) /analyze responses
+
+Usage:
+    python benchmark_analyze_tabs.py            # 10k tabs
+    python benchmark_analyze_tabs.py 50000 5    # tabs, repeats
+"""
+
+import json
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from json_stream import iter_gzip, iter_json
+from tab_classifier import TabClassifier, analyze_tabs
+from test_tab_classifier import generate_tabs
+from test_tab_grouping import generate_topic_tabs
+
+
+def multipass_analyze_tabs(tab_data):
+    """The previous analyze_tabs: one pass per result section"""
+    classifier = TabClassifier()
+    classifications = classifier.classify_tabs(tab_data)
+    duplicates = classifier.find_duplicates(tab_data)
+    group_suggestions = classifier.suggest_groups(tab_data, mode='domain')
+
+    # Per-tab datetime.now() like the original health score
+    total_tabs = len(tab_data)
+    never_used = sum(1 for t in tab_data if t.get('activationCount', 0) == 0)
+    old_tabs = sum(1 for t in tab_data if classifier._days_old(t.get('createdAt', 0)) > 7)
+    inactive_tabs = sum(1 for t in tab_data if classifier._days_old(t.get('lastActivated', 0)) > 3)
+    health_score = classifier._health_score(total_tabs, never_used, old_tabs, inactive_tabs)
+
+    return {
+        'health_score': health_score,
+        'total_tabs': total_tabs,
+        'classifications': classifications,
+        'duplicates': duplicates,
+        'group_suggestions': group_suggestions,
+        'summary': {
+            'to_close': len([c for c in classifications if c['action'] == 'close']),
+            'to_archive': len([c for c in classifications if c['action'] == 'archive']),
+            'to_keep': len([c for c in classifications if c['action'] == 'keep']),
+            'to_review': len([c for c in classifications if c['action'] == 'review']),
+            'duplicate_tabs': sum(len(d['close']) for d in duplicates),
+            'grouping_opportunities': len(group_suggestions)
+        }
+    }
+
+
+def generate_session_tabs(rng, n, topics=60, sites=40):
+    """Tabs spread over many small topics with shared filler words"""
+    topic_words = [[f"topic{k}word{i}" for i in range(15)] for k in range(topics)]
+    filler = [f"filler{i}" for i in range(300)]
+    tabs = []
+    for i in range(n):
+        words = topic_words[int(rng.integers(0, topics))]
+        site = f"site{int(rng.integers(0, sites))}.com"
+        tabs.append({
+            'id': i,
+            'url': f"https://{site}/{'/'.join(rng.choice(words, 2))}",
+            'title': ' '.join(list(rng.choice(words, 3)) + list(rng.choice(filler, 3))),
+            'domain': site,
+            'groupId': -1
+        })
+    return tabs
+
+
+def best_of(fn, tabs, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(tabs)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    tabs = generate_tabs(np.random.default_rng(0), n, datetime.now().timestamp() * 1000)
+
+    multipass = best_of(multipass_analyze_tabs, tabs, repeats)
+    # Domain grouping on both sides; content grouping is timed separately
+    fused = best_of(lambda tabs: analyze_tabs(tabs, grouping_mode='domain'), tabs, repeats)
+
+    print(f"{n} tabs, best of {repeats}")
+    print(f"  multi-pass: {multipass * 1000:8.1f} ms")
+    print(f"  fused:      {fused * 1000:8.1f} ms")
+    print(f"  speedup:    {multipass / fused:8.2f}x")
+
+    classifier = TabClassifier()
+    group = lambda tabs: classifier.suggest_groups(tabs, mode='content')
+    session = best_of(group, generate_session_tabs(np.random.default_rng(0), 5000), repeats)
+    # Worst case: a few huge topics share every token (bounded by max_postings)
+    few_topics = best_of(group, generate_topic_tabs(np.random.default_rng(0), 5000), repeats)
+    print("content grouping, 5000 tabs")
+    print(f"  60 topics:  {session * 1000:8.1f} ms")
+    print(f"  4 topics:   {few_topics * 1000:8.1f} ms")
+
+    # Titles and URLs of a browsing session, activity of the classification benchmark tabs
+    response_tabs = [{**tab, **site_tab} for tab, site_tab in
+                     zip(tabs, generate_session_tabs(np.random.default_rng(0), n))]
+    results = analyze_tabs(response_tabs, grouping_mode='domain')
+    encoders = [
+        ('json.dumps', lambda r: json.dumps(r, separators=(',', ':')).encode()),
+        ('streamed', lambda r: b''.join(iter_json(r))),
+        ('streamed+gzip', lambda r: b''.join(iter_gzip(iter_json(r)))),
+    ]
+    print(f"/analyze response, {n} tabs")
+    for name, encode in encoders:
+        seconds = best_of(encode, results, repeats)
+        print(f"  {name + ':':<14} {len(encode(results)) / 1024:8.1f} kB {seconds * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
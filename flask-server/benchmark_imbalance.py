@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Compare the imbalance strategies of TabSensePredictor (imbalance.py) on
+simulated browsing histories: training time, training rows, and accuracy
+on the following days' transitions (the model predicts the future)
+
+Histories follow a per-user Markov chain over a Zipf-popular set of
+sites, with different habits in the morning, afternoon and evening, so
+a few next URLs dominate and most are rare.
+
+Usage:
+    python benchmark_imbalance.py                 # 6 users, 1500-12000 visits
+    python benchmark_imbalance.py 4 20000         # users, visits of the largest
+"""
+
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from imbalance import IMBALANCE_STRATEGIES, SMOTE_CACHE
+from ml_model import TabSensePredictor, history_arrays, time_components, transition_indices
+
+TEST_FRACTION = 0.2
+
+
+def simulate_history(rng, visits, sites=60, days=42):
+    """{timestamp: url} of browsing sessions spread over `days` days"""
+    urls = [f"site{i}.com" for i in range(sites)]
+    popularity = 1 / np.arange(1, sites + 1) ** 1.1
+    # Per time of day, each site leads to a handful of likely next sites
+    habits = []
+    for _ in range(3):
+        matrix = np.zeros((sites, sites))
+        for i in range(sites):
+            successors = rng.choice(sites, size=int(rng.integers(2, 6)), replace=False, p=popularity / popularity.sum())
+            matrix[i, successors] = rng.dirichlet(np.ones(len(successors)) * 0.5)
+        habits.append(0.85 * matrix + 0.15 * popularity / popularity.sum())
+
+    history = {}
+    start = datetime(2024, 3, 1)
+    sessions = max(1, visits // 25)
+    for session_start in np.sort(rng.uniform(0, days * 86400, sessions)):
+        moment = start + timedelta(seconds=float(session_start))
+        period = 0 if moment.hour < 12 else 1 if moment.hour < 18 else 2
+        site = int(rng.choice(sites, p=popularity / popularity.sum()))
+        for _ in range(int(rng.integers(5, 45))):
+            history[moment.strftime("%Y-%m-%d %H:%M:%S")] = urls[site]
+            moment += timedelta(seconds=int(rng.integers(10, 110)))
+            site = int(rng.choice(sites, p=habits[period][site] / habits[period][site].sum()))
+    return history
+
+
+def split_history(history):
+    """Training history, and test (contexts, next URLs) from the last TEST_FRACTION of days"""
+    timestamps = sorted(history)
+    cutoff = timestamps[int(len(timestamps) * (1 - TEST_FRACTION))]
+    train = {ts: url for ts, url in history.items() if ts < cutoff}
+
+    times, urls = history_arrays({ts: url for ts, url in history.items() if ts >= cutoff})
+    current = transition_indices(times)
+    month, day, hour, minute, _ = time_components(times[current])
+    contexts = list(zip(month.tolist(), day.tolist(), hour.tolist(), minute.tolist(), urls[current].tolist()))
+    return train, contexts, urls[current + 1].tolist()
+
+
+def evaluate(strategy, train, contexts, expected):
+    SMOTE_CACHE.clear()  # every fit is on new data in production
+    predictor = TabSensePredictor(imbalance=strategy)
+    start = time.perf_counter()
+    X, y = predictor.prepare_data(train)
+    X_fit, y_fit = predictor.balance(X, predictor.output_encoder.fit_transform(y))
+    predictor.model.fit(X_fit, y_fit)
+    seconds = time.perf_counter() - start
+
+    predicted = [ranked[0][0] if ranked else None for ranked in predictor.predict_batch(contexts, k=1)]
+    hits = np.array([p == e for p, e in zip(predicted, expected)])
+    # Macro recall: rare next URLs count as much as common ones
+    recalls = [hits[[e == url for e in expected]].mean() for url in set(expected)]
+    return {'seconds': seconds, 'rows': len(X_fit), 'transitions': len(X),
+            'accuracy': hits.mean(), 'macro_recall': float(np.mean(recalls))}
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    largest = int(sys.argv[2]) if len(sys.argv) > 2 else 12000
+    sizes = np.geomspace(largest / 8, largest, users).astype(int)
+
+    totals = {strategy: [] for strategy in IMBALANCE_STRATEGIES}
+    for user, visits in enumerate(sizes):
+        train, contexts, expected = split_history(simulate_history(np.random.default_rng(user), visits))
+        for strategy in IMBALANCE_STRATEGIES:
+            totals[strategy].append(evaluate(strategy, train, contexts, expected))
+
+    print(f"{users} users, {sizes[0]}-{sizes[-1]} visits, last {TEST_FRACTION:.0%} held out")
+    print(f"  {'strategy':<13} {'train s':>8} {'rows/transitions':>17} {'accuracy':>9} {'macro recall':>13}")
+    for strategy, results in totals.items():
+        mean = lambda key: np.mean([r[key] for r in results])
+        inflation = np.mean([r['rows'] / r['transitions'] for r in results])
+        print(f"  {strategy:<13} {mean('seconds'):8.2f} {inflation:16.1f}x {mean('accuracy'):9.3f} "
+              f"{mean('macro_recall'):13.3f}")
+
+
+if __name__ == '__main__':
+    main()
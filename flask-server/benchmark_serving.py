@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Load-test a TabSense server: requests/sec and latency with concurrent
+keep-alive clients. With --compare, start the Flask dev server and the
+gunicorn setup (gunicorn.conf.py) for the service one after the other and
+run the same load against both.
+
+Usage:
+    python benchmark_serving.py --url http://localhost:5001          # running server
+    python benchmark_serving.py --compare                            # dev server vs gunicorn
+    python benchmark_serving.py --compare --service prediction --path /health
+"""
+
+import argparse
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from test_tab_classifier import generate_tabs
+from wsgi import DEFAULT_PORTS, SERVICES
+
+DEFAULT_PATHS = {'all': '/analyze', 'prediction': '/health', 'declutter': '/analyze'}
+DEV_SERVERS = {'all': 'server.py', 'prediction': 'app.py', 'declutter': 'app_declutter.py'}
+
+
+def analyze_body(n_tabs):
+    tabs = generate_tabs(np.random.default_rng(0), n_tabs, datetime.now().timestamp() * 1000)
+    return json.dumps({'email': 'loadtest@example.com', 'tabs': tabs})
+
+
+def load(url, path, body, concurrency, seconds):
+    """
+    Hit url+path from `concurrency` threads for `seconds`
+    Returns {'requests', 'errors', 'rps', 'p50_ms', 'p95_ms'}
+    """
+    target = urlsplit(url)
+    deadline = time.perf_counter() + seconds
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client():
+        connection = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+        timings = []
+        failed = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                if body is None:
+                    connection.request('GET', path)
+                else:
+                    connection.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    failed += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+                continue
+            timings.append(time.perf_counter() - start)
+        connection.close()
+        with lock:
+            latencies.extend(timings)
+            errors[0] += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+        'p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else None
+    }
+
+
+def start_server(command, port, env, timeout=120):
+    """Start a server in its own process group and wait for /health"""
+    process = subprocess.Popen(command, env={**os.environ, **env, 'PORT': str(port)},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(command)} exited with {process.returncode}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f"{' '.join(command)} did not become healthy")
+
+
+def stop_server(process):
+    # The dev server's reloader runs the app in a child process
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout=40)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def report(name, result):
+    print(f"  {name:<10} {result['rps']:8.1f} req/s  p50 {result['p50_ms'] or 0:7.1f} ms  "
+          f"p95 {result['p95_ms'] or 0:7.1f} ms  ({result['requests']} ok, {result['errors']} errors)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the TabSense servers')
+    parser.add_argument('--service', choices=list(SERVICES), default='all')
+    parser.add_argument('--url', help='server to test (default: the service port on localhost)')
+    parser.add_argument('--path', help='endpoint (default: /analyze for declutter, /health for prediction)')
+    parser.add_argument('--tabs', type=int, default=200, help='tabs per /analyze request')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--compare', action='store_true', help='start the dev server and gunicorn and test both')
+    args = parser.parse_args()
+
+    path = args.path or DEFAULT_PATHS[args.service]
+    body = analyze_body(args.tabs) if path == '/analyze' else None
+    port = DEFAULT_PORTS[args.service]
+    print(f"{args.service} {path}: {args.concurrency} clients for {args.seconds:g}s")
+
+    if not args.compare:
+        report('server', load(args.url or f"http://127.0.0.1:{port}", path, body, args.concurrency, args.seconds))
+        return
+
+    servers = [
+        ('dev', [sys.executable, DEV_SERVERS[args.service]]),
+        ('gunicorn', [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py']),
+    ]
+    for name, command in servers:
+        process = start_server(command, port, {'TABSENSE_SERVICE': args.service})
+        try:
+            report(name, load(f"http://127.0.0.1:{port}", path, body, args.concurrency, args.seconds))
+        finally:
+            stop_server(process)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Apply the TabActivity retention policy: roll raw tab events older than
+--raw-days (the legacy activity map and /ingest event documents) into
+TabActivity/<email>/daily/<YYYY-MM-DD> summaries and delete summaries
+older than --summary-days (see activity_store.py)
+
+Usage:
+    python compact_activity.py                    # every user in TabActivity
+    python compact_activity.py a@x.com b@y.com    # selected users
+    python compact_activity.py --dry-run
+    python compact_activity.py --every 3600       # keep running, hourly
+
+Safe to run while the servers ingest events: each chunk is summarized and
+deleted in one transaction, and only events past the raw window are read.
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from activity_store import DEFAULT_RAW_DAYS, DEFAULT_SUMMARY_DAYS, ActivityStore
+from firebase_client import get_db
+from tab_classifier import legacy_activity_entries
+
+
+def run_once(db, store, emails, raw_days, summary_days, dry_run=False):
+    emails = emails or [ref.id for ref in db.collection(store.collection).list_documents()]
+    totals = {'compacted': 0, 'expired': 0}
+
+    for email in emails:
+        try:
+            if dry_run:
+                now = datetime.now()
+                before = (now - timedelta(days=raw_days)).strftime('%Y-%m-%d')
+                # iter_events bounds are inclusive: stop the day before the cutoff
+                last_day = (now - timedelta(days=raw_days + 1)).strftime('%Y-%m-%d')
+                legacy = sum(1 for _, event in legacy_activity_entries(store.legacy_activity(email))
+                             if event['timestamp'][:10] < before)
+                result = {'compacted': legacy + sum(1 for _ in store.iter_events(email, until=last_day)),
+                          'expired': 0}
+            else:
+                result = store.apply_retention(email, raw_days=raw_days, summary_days=summary_days)
+        except Exception as e:
+            # One bad user must not stop the sweep
+            print(f"{email}: compaction failed: {str(e)}")
+            continue
+        for key in totals:
+            totals[key] += result[key]
+        if result['compacted'] or result['expired']:
+            print(f"{email}: {result['compacted']} events {'to compact' if dry_run else 'compacted'}, "
+                  f"{result['expired']} daily summaries expired")
+
+    print(f"Done: {totals['compacted']} events, {totals['expired']} summaries across {len(emails)} users")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compact and expire TabActivity logs')
+    parser.add_argument('emails', nargs='*', help='users to compact (default: all)')
+    parser.add_argument('--raw-days', type=int, default=DEFAULT_RAW_DAYS,
+                        help='days of raw events to keep (TABSENSE_ACTIVITY_RAW_DAYS)')
+    parser.add_argument('--summary-days', type=int, default=DEFAULT_SUMMARY_DAYS,
+                        help='days of daily summaries to keep (TABSENSE_ACTIVITY_SUMMARY_DAYS)')
+    parser.add_argument('--dry-run', action='store_true', help='only report what would be compacted')
+    parser.add_argument('--every', type=int, default=0, help='repeat every N seconds (worker mode)')
+    args = parser.parse_args()
+
+    db = get_db()
+    store = ActivityStore(db)
+
+    while True:
+        run_once(db, store, args.emails, args.raw_days, args.summary_days, dry_run=args.dry_run)
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+from flask import Blueprint, current_app, jsonify, request
+
+from tab_classifier import analyze_tabs, load_tab_model
+from duplicate_index import DUPLICATE_MODES
+from tab_grouping import GROUPING_MODES
+from stats_aggregates import summarize_tabs
+from activity_store import MAX_INGEST_TABS, ActivityStore
+from analysis_session import AnalysisSessions, SessionConflict
+from analysis_writer import AnalysisWriter
+from json_stream import json_response
+from firebase_client import verified_email
+
+declutter = Blueprint('declutter', __name__)
+
+# Analyzed once by warm_up() so every stage of analyze_tabs is imported before the first request
+WARM_UP_TABS = [{'id': i, 'url': f'https://example.com/warm-up/{i}', 'title': 'Warm up', 'domain': 'example.com',
+                 'createdAt': 0, 'lastActivated': 0, 'activationCount': 0, 'totalActiveTime': 0,
+                 'isPinned': False, 'groupId': -1} for i in range(3)]
+
+
+class DeclutterServices:
+    """Per-app state of the declutter routes, in app.extensions['declutter']"""
+    def __init__(self, db, stats_store):
+        self.db = db
+        # Per-status tab counters maintained on ingest in TabActivity/<email>/aggregates/tabs
+        self.stats_store = stats_store
+        # Batched tab events from the extension, see /ingest
+        self.activity_store = ActivityStore(db, stats_store)
+        # Trained tab classifier (train_tab_classifier.py), loaded by warm_up();
+        # None keeps the rule-based classification
+        self.tab_model = None
+        self.warm = False
+        # Per-client state of the incremental /analyze/delta protocol
+        self.analysis_sessions = AnalysisSessions()
+        # TabAnalysis/<email> is written behind the response, and only when it changed
+        self.analysis_writer = AnalysisWriter(db)
+
+    def warm_up(self):
+        """Load the tab classifier and the analysis stack once per process"""
+        if not self.warm:
+            self.tab_model = load_tab_model()
+            analyze_tabs(WARM_UP_TABS, model=self.tab_model)
+            self.warm = True
+
+    def shutdown(self):
+        """Write the queued analyses"""
+        self.analysis_writer.shutdown()
+
+
+def init_declutter(app, db, stats_store):
+    app.extensions['declutter'] = DeclutterServices(db, stats_store)
+    app.register_blueprint(declutter)
+
+
+def services():
+    state = current_app.extensions['declutter']
+    state.warm_up()
+    return state
+
+
+@declutter.route('/analyze', methods=['POST'])
+def analyze_tab_data():
+    """
+    Analyze tab data and return declutter suggestions
+    Optional "duplicates": {"mode": "exact" | "canonical" | "near",
+                            "threshold": near-duplicate similarity in (0, 1]}
+    Optional "grouping": {"mode": "content" | "domain",
+                          "threshold": content similarity in (0, 1]}
+    Defaults come from the DUPLICATE_* / GROUPING_* app config.
+    The result is streamed, gzipped if the client accepts it (json_stream.py).
+    """
+    try:
+        data = request.json
+        tabs = data.get('tabs', [])
+        email = data.get('email', '')
+        options, error = _analysis_options(data)
+
+        if not tabs:
+            return jsonify({'error': 'No tabs provided'}), 400
+        if error:
+            return jsonify({'error': error}), 400
+
+        state = services()
+        # Analyze tabs using ML classifier
+        results = analyze_tabs(tabs, model=state.tab_model, **options)
+
+        # Store analysis results for user
+        if email:
+            state.analysis_writer.submit(email, {'last_analysis': results})
+
+        return _analysis_response(results)
+
+    except Exception as e:
+        print(f"Error analyzing tabs: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@declutter.route('/analyze/delta', methods=['POST'])
+def analyze_tab_delta():
+    """
+    Incremental /analyze: the client sends only what changed since its last call
+    Start (or restart) a session with all tabs:
+        {"email", "tabs": [...], optional "duplicates" / "grouping" like /analyze}
+    Then send changes against the last version the server returned:
+        {"email", "session", "version", "upserts": [changed or new tabs], "removed": [tab ids]}
+    Returns health_score, total_tabs and summary for all tabs, and for
+    "classifications", "duplicates" and "group_suggestions" only
+    {"changed": [...], "removed": [tab ids / suggestion keys]}; duplicate and
+    group entries carry the "key" they are removed by.
+    Sessions are shared by the server's workers (see analysis_session.py).
+    409 means the session expired or is at another version: the client must
+    start a new session with all of its tabs.
+    """
+    try:
+        data = request.json or {}
+        email = data.get('email', '')
+        if not email:
+            return jsonify({'error': 'email is required'}), 400
+
+        state = services()
+        if 'tabs' in data:
+            options, error = _analysis_options(data)
+            if error:
+                return jsonify({'error': error}), 400
+            if not isinstance(data['tabs'], list):
+                return jsonify({'error': 'tabs must be a list'}), 400
+            session = state.analysis_sessions.create(email, model=state.tab_model, **options)
+            results = session.update(0, upserts=data['tabs'])
+            return _analysis_response(_store_delta_summary(state, email, results))
+
+        upserts = data.get('upserts', [])
+        removed = data.get('removed', [])
+        if not data.get('session') or not isinstance(data.get('version'), int) \
+                or not isinstance(upserts, list) or not isinstance(removed, list):
+            return jsonify({'error': 'session, version, upserts and removed are required'}), 400
+
+        session = state.analysis_sessions.get(data['session'], email, model=state.tab_model)
+        results = session.update(data['version'], upserts=upserts, removed=removed)
+        return _analysis_response(_store_delta_summary(state, email, results))
+
+    except SessionConflict as e:
+        return jsonify({'error': str(e), 'resync': True}), 409
+    except Exception as e:
+        print(f"Error analyzing tab changes: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def _analysis_response(results):
+    return json_response(results, request.headers.get('Accept-Encoding', ''))
+
+def _store_delta_summary(state, email, results):
+    """Keep TabAnalysis/<email> current with the totals only: the suggestions stay in the session"""
+    state.analysis_writer.submit(email, {
+        'last_summary': {
+            'health_score': results['health_score'],
+            'total_tabs': results['total_tabs'],
+            'summary': results['summary']
+        }
+    }, merge=True)
+    return results
+
+def _analysis_options(data):
+    """analyze_tabs options from a request body; returns (options, error message)"""
+    config = current_app.config
+    duplicate_options = data.get('duplicates') or {}
+    grouping_options = data.get('grouping') or {}
+    options = {
+        'duplicate_mode': duplicate_options.get('mode', config['DUPLICATE_MODE']),
+        'similarity': float(duplicate_options.get('threshold', config['DUPLICATE_SIMILARITY'])),
+        'grouping_mode': grouping_options.get('mode', config['GROUPING_MODE']),
+        'group_similarity': float(grouping_options.get('threshold', config['GROUP_SIMILARITY']))
+    }
+    if options['duplicate_mode'] not in DUPLICATE_MODES or not 0 < options['similarity'] <= 1:
+        return options, (f"duplicates.mode must be one of {', '.join(DUPLICATE_MODES)} "
+                         "and duplicates.threshold in (0, 1]")
+    if options['grouping_mode'] not in GROUPING_MODES or not 0 < options['group_similarity'] <= 1:
+        return options, (f"grouping.mode must be one of {', '.join(GROUPING_MODES)} "
+                         "and grouping.threshold in (0, 1]")
+    return options, None
+
+@declutter.route('/ingest', methods=['POST'])
+def ingest_tab_events():
+    """
+    Store a batch of buffered tab events from the signed-in user's extension
+    Header: Authorization: Bearer <Firebase ID token>
+    Body: {"events": [{"tabId", "action", "timestamp", "tab", optional "actions" / "first"}, ...]}
+    """
+    email = verified_email(request.headers.get('Authorization'))
+    if email is None:
+        return jsonify({'error': 'A valid Firebase ID token is required'}), 401
+
+    try:
+        data = request.json or {}
+        events = data.get('events', []) if isinstance(data, dict) else None
+
+        if not isinstance(events, list) or not events:
+            return jsonify({'error': 'events are required'}), 400
+        if not all(isinstance(e, dict) and {'tabId', 'action', 'timestamp'} <= e.keys() for e in events):
+            return jsonify({'error': 'Each event needs tabId, action and timestamp'}), 400
+        if len({str(e['tabId']) for e in events}) > MAX_INGEST_TABS:
+            return jsonify({'error': f"At most {MAX_INGEST_TABS} tabs per batch"}), 400
+
+        return jsonify(services().activity_store.ingest(email, events))
+
+    except Exception as e:
+        print(f"Error ingesting tab events: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Also served at /stats/<email>/ when the prediction routes are not registered
+@declutter.route('/tabs/stats/<email>/')
+def get_user_stats(email):
+    """Get user's tab statistics"""
+    state = services()
+    try:
+        stats = state.stats_store.tab_summary(email)
+        if stats is not None:
+            return jsonify(stats)
+
+        # Only the open tabs: activity logs stay on the server
+        user_doc_ref = state.db.collection('TabActivity').document(email)
+        user_doc = user_doc_ref.get(field_paths=['tabs'])
+
+        if not user_doc.exists:
+            return jsonify({
+                'totalTabs': 0,
+                'healthScore': 100,
+                'patterns': {}
+            })
+
+        data = user_doc.to_dict()
+        tabs = data.get('tabs', {})
+
+        # No aggregate yet: count every status in a single pass
+        return jsonify(summarize_tabs(tabs))
+
+    except Exception as e:
+        print(f"Error getting stats: {str(e)}")
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,257 @@
+import hashlib
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import numpy as np
+
+# Query parameters that only track where a click came from ('ref' is not one:
+# GitHub and GitLab use ?ref=<branch> to pick the version of a file)
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', 'ref_src', 'ref_url', 'si', 'spm'
+}
+TRACKING_PREFIXES = ('utm_',)
+
+DUPLICATE_MODES = ('exact', 'canonical', 'near')
+DEFAULT_DUPLICATE_MODE = 'canonical'
+DEFAULT_SIMILARITY = 0.8
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+# Stop words that appear in most titles and would inflate similarity
+TITLE_STOP_WORDS = {'the', 'a', 'an', 'and', 'of', 'to', 'in', 'on', 'for', 'with', 'com', 'www', 'html'}
+
+
+@lru_cache(maxsize=65536)
+def canonical_url(url):
+    """
+    Canonical form of a URL for duplicate detection:
+    - http and https are the same page
+    - host is lowercased, 'www.', user info and default ports are dropped
+    - the fragment and tracking parameters (utm_*, fbclid, ...) are dropped,
+      the remaining query parameters are sorted
+    - repeated and trailing slashes are removed from the path
+    Non-web URLs (chrome://, file://, ...) are returned unchanged.
+    Plain string splitting rather than urllib: this runs once per tab.
+    """
+    scheme, sep, rest = url.partition('://')
+    if not sep or scheme.lower() not in ('http', 'https'):
+        return url
+
+    rest = rest.partition('#')[0]
+    rest, _, query = rest.partition('?')
+    host, _, path = rest.partition('/')
+
+    host = host.rpartition('@')[2].lower().rstrip('.')
+    if host.endswith(':80') or host.endswith(':443'):
+        host = host.rpartition(':')[0].rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+
+    if '//' in path:
+        path = re.sub(r'/{2,}', '/', path)
+    path = path.strip('/')
+
+    canonical = f"https://{host}/{path}" if path else f"https://{host}"
+    if query:
+        params = sorted(
+            param for param in query.split('&')
+            if param and not _is_tracking_param(param.partition('=')[0].lower())
+        )
+        if params:
+            canonical += '?' + '&'.join(params)
+    return canonical
+
+
+def _is_tracking_param(key):
+    return key in TRACKING_PARAMS or key.startswith(TRACKING_PREFIXES)
+
+
+def split_canonical(canonical):
+    """(host, path) of a canonical_url result without re-parsing it"""
+    if canonical.startswith('https://'):
+        host, _, rest = canonical[8:].partition('/')
+        return host, '/' + rest.partition('?')[0]
+    parts = urlsplit(canonical)
+    return parts.netloc, parts.path
+
+
+def query_params(canonical):
+    """{key: value} of the query parameters left in a canonical_url result"""
+    query = canonical.partition('#')[0].partition('?')[2]
+    return dict(param.partition('=')[::2] for param in query.split('&') if param)
+
+
+def title_tokens(title):
+    return [w for w in TOKEN_PATTERN.findall((title or '').lower()) if w not in TITLE_STOP_WORDS]
+
+
+def url_tokens(url, title=''):
+    """
+    Token set of a tab: URL path words, the remaining query parameters
+    (whole, so ?v=A and ?v=B differ) and title words
+    """
+    canonical = canonical_url(url)
+    words = TOKEN_PATTERN.findall(split_canonical(canonical)[1].lower())
+    words += [f"{key}={value}" for key, value in query_params(canonical).items()]
+    words += title_tokens(title)
+    return frozenset(words)
+
+
+def same_query_page(a, b):
+    """False if two query_params results give a shared key different values"""
+    return all(b.get(key, value) == value for key, value in a.items())
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class NearDuplicateIndex:
+    """
+    MinHash + LSH index over tab token sets
+    Each tab gets `bands * rows` MinHash values; tabs on the same host that
+    agree on all rows of any band become candidate pairs, which are then
+    verified with exact Jaccard similarity. Work is linear in the number of
+    tabs plus the (small) number of candidates, instead of all pairs.
+    With 8 bands of 4 rows a pair at similarity 0.8 is found with ~98%
+    probability and one at 0.4 with ~19% (then rejected by verification).
+    """
+    MERSENNE_PRIME = (1 << 61) - 1
+
+    def __init__(self, bands=8, rows=4, seed=1):
+        self.bands = bands
+        self.rows = rows
+        rng = np.random.default_rng(seed)
+        num_perm = bands * rows
+        # 32-bit coefficients and token hashes keep a * h + b within uint64
+        self.a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+
+    @staticmethod
+    def _token_hash(token):
+        # Stable across processes, unlike hash()
+        return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=4).digest(), 'big')
+
+    def signatures(self, token_sets):
+        """
+        MinHash signatures of many token sets at once: an (n, bands * rows)
+        uint64 matrix. Each distinct token is hashed once and all tokens are
+        permuted in a single vectorized step; empty sets share one signature.
+        """
+        hash_of = {}
+        flat = []
+        offsets = []
+        for tokens in token_sets:
+            offsets.append(len(flat))
+            for token in tokens or ('',):
+                h = hash_of.get(token)
+                if h is None:
+                    h = hash_of[token] = self._token_hash(token)
+                flat.append(h)
+
+        if not offsets:
+            return np.empty((0, self.bands * self.rows), dtype=np.uint64)
+        hashes = np.array(flat, dtype=np.uint64)
+        permuted = (np.outer(hashes, self.a) + self.b) % np.uint64(self.MERSENNE_PRIME)
+        return np.minimum.reduceat(permuted, np.array(offsets), axis=0)
+
+    def clusters(self, items, threshold=DEFAULT_SIMILARITY, compatible=None):
+        """
+        Group near-duplicate items
+        items: [(group_key, tokens)], where only items with equal group_key
+        (e.g. host) can match
+        compatible: optional (position, position) -> bool vetoing candidate pairs
+        Returns clusters of 2+ item positions, ordered by first position
+        """
+        parent = list(range(len(items)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        if len(items) < 2:
+            return []
+
+        signatures = self.signatures([tokens for _, tokens in items])
+        group_ids = {}
+        groups = np.array([group_ids.setdefault(key, len(group_ids)) for key, _ in items], dtype=np.uint64)
+
+        # Folding a band's rows and the group into one uint64 key; collisions
+        # only add candidates, which are verified anyway
+        mix = np.random.default_rng(0).integers(1, 1 << 63, self.rows + 1, dtype=np.uint64) | np.uint64(1)
+
+        checked = set()
+        for band in range(self.bands):
+            rows = signatures[:, band * self.rows:(band + 1) * self.rows]
+            keys = groups * mix[0]
+            for column in range(self.rows):
+                keys = keys ^ (rows[:, column] * mix[column + 1])
+            _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+            for bucket in np.flatnonzero(counts > 1):
+                members = np.flatnonzero(inverse == bucket).tolist()
+                for i, first in enumerate(members):
+                    for other in members[i + 1:]:
+                        if (first, other) in checked or find(first) == find(other):
+                            continue
+                        checked.add((first, other))
+                        if compatible is not None and not compatible(first, other):
+                            continue
+                        if jaccard(items[first][1], items[other][1]) >= threshold:
+                            parent[find(other)] = find(first)
+
+        clusters = {}
+        for position in range(len(items)):
+            clusters.setdefault(find(position), []).append(position)
+        return sorted((c for c in clusters.values() if len(c) > 1), key=lambda c: c[0])
+
+
+def duplicate_buckets(tab_data, mode=DEFAULT_DUPLICATE_MODE, threshold=DEFAULT_SIMILARITY, url_buckets=None):
+    """
+    {key: [tab position, ...]} buckets of duplicate candidates
+    - exact: identical URLs
+    - canonical: identical canonical_url
+    - near: canonical buckets merged by NearDuplicateIndex over path, query
+      and title tokens; URLs of tabs without title words are never merged
+      (their tokens would come from the URLs alone, which differ), nor are
+      URLs that give a query parameter different values
+    url_buckets: exact-URL buckets already collected by the caller
+    """
+    if mode not in DUPLICATE_MODES:
+        raise ValueError(f"Unknown duplicate mode '{mode}', expected one of {', '.join(DUPLICATE_MODES)}")
+
+    if url_buckets is None:
+        url_buckets = {}
+        for i, tab in enumerate(tab_data):
+            url = tab.get('url', '')
+            if url:
+                url_buckets.setdefault(url, []).append(i)
+    if mode == 'exact':
+        return url_buckets
+
+    buckets = {}
+    for url, positions in url_buckets.items():
+        buckets.setdefault(canonical_url(url), []).extend(positions)
+    if mode == 'canonical':
+        return buckets
+
+    keys = []
+    items = []
+    for key, positions in buckets.items():
+        title = tab_data[positions[0]].get('title', '')
+        if title_tokens(title):
+            keys.append(key)
+            items.append((split_canonical(key)[0], url_tokens(key, title)))
+    params = [query_params(key) for key in keys]
+
+    compatible = lambda first, other: same_query_page(params[first], params[other])
+    for cluster in NearDuplicateIndex().clusters(items, threshold, compatible):
+        target = keys[cluster[0]]
+        for position in cluster[1:]:
+            buckets[target].extend(buckets.pop(keys[position]))
+        buckets[target].sort()
+    return buckets
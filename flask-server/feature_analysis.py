@@ -1,12 +1,10 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import cross_val_score
 from sklearn.preprocessing import LabelEncoder
-from imblearn.over_sampling import SMOTE
-import seaborn as sns
 from datetime import datetime
+from imbalance import smote
 
 class FeatureAnalyzer:
     def __init__(self):
@@ -28,11 +26,7 @@ class FeatureAnalyzer:
         predictor.output_encoder.fit(y)
         y_encoded = predictor.output_encoder.transform(y)
         
-        try:
-            X_resampled, y_resampled = predictor.smote.fit_resample(X, y_encoded)
-        except:
-            X_resampled, y_resampled = X, y_encoded
-        
+        X_resampled, y_resampled = predictor.balance(X, y_encoded)
         predictor.model.fit(X_resampled, y_resampled)
         
         importances = predictor.model.feature_importances_
@@ -48,6 +42,8 @@ class FeatureAnalyzer:
         """
         Create a bar plot of feature importance
         """
+        import matplotlib.pyplot as plt
+        
         plt.figure(figsize=(10, 6))
         plt.bar(importance_df['Feature'], importance_df['Importance'])
         plt.xlabel('Features')
@@ -83,11 +79,7 @@ class FeatureAnalyzer:
             predictor.output_encoder.fit(y)
             y_encoded = predictor.output_encoder.transform(y)
             
-            try:
-                X_resampled, y_resampled = predictor.smote.fit_resample(X, y_encoded)
-            except:
-                X_resampled, y_resampled = X, y_encoded
-            
+            X_resampled, y_resampled = predictor.balance(X, y_encoded)
             predictor.model.fit(X_resampled, y_resampled)
             importances = predictor.model.feature_importances_
             
@@ -118,6 +110,9 @@ class FeatureAnalyzer:
             'with_smote': {}
         }
         
+        # Resampled once (and cached) for all splits
+        X_resampled, y_resampled = smote(X, y_encoded)
+        
         for cv in cv_splits:
             scores_without = cross_val_score(predictor.model, X, y_encoded, cv=min(cv, len(X)))
             results['without_smote'][f'cv_{cv}'] = {
@@ -126,13 +121,13 @@ class FeatureAnalyzer:
             }
             
             try:
-                X_resampled, y_resampled = predictor.smote.fit_resample(X, y_encoded)
                 scores_with = cross_val_score(predictor.model, X_resampled, y_resampled, cv=min(cv, len(X_resampled)))
                 results['with_smote'][f'cv_{cv}'] = {
                     'mean': np.mean(scores_with),
                     'std': np.std(scores_with)
                 }
-            except:
+            except ValueError as e:
+                print(f"Cross-validation with SMOTE failed for cv={cv}: {str(e)}")
                 results['with_smote'][f'cv_{cv}'] = {
                     'mean': 0,
                     'std': 0
@@ -147,6 +142,8 @@ class FeatureAnalyzer:
         if not comparison_results:
             return
         
+        import matplotlib.pyplot as plt
+        
         models = list(comparison_results.keys())
         accuracies = [comparison_results[m]['mean_accuracy'] for m in models]
         stds = [comparison_results[m]['std_accuracy'] for m in models]
@@ -189,11 +186,11 @@ class FeatureAnalyzer:
             y_encoded = predictor.output_encoder.transform(y)
             
             try:
-                X_resampled, y_resampled = predictor.smote.fit_resample(X, y_encoded)
-                predictor.model.fit(X_resampled, y_resampled)
+                X_resampled, y_resampled = predictor.balance(X, y_encoded)
                 scores = cross_val_score(predictor.model, X_resampled, y_resampled, cv=3)
                 accuracy = np.mean(scores)
-            except:
+            except ValueError as e:
+                print(f"Cross-validation failed for the {interval}s interval: {str(e)}")
                 accuracy = 0
             
             results[f'{interval}s'] = {
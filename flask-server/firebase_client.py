@@ -0,0 +1,41 @@
+import os
+
+import firebase_admin
+from firebase_admin import credentials, exceptions, firestore
+
+# Service account key used by every server and CLI in this directory
+CREDENTIALS_PATH = os.environ.get('TABSENSE_FIREBASE_CREDENTIALS', 'serviceAccountKey.json')
+
+
+def get_db(credentials_path=CREDENTIALS_PATH):
+    """
+    The process-wide Firestore client
+    firebase_admin is initialized on the first call; later calls (and every
+    blueprint of the combined server) reuse the same client and its gRPC
+    channel pool, which only connects on the first request.
+    """
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        firebase_admin.initialize_app(credentials.Certificate(credentials_path))
+    return firestore.client()
+
+
+def verified_email(authorization):
+    """
+    Email of the Firebase user whose ID token is in an
+    'Authorization: Bearer <token>' header; None if the header is missing or
+    the token is invalid or expired
+    Write endpoints take the user from here instead of trusting the body.
+    """
+    from firebase_admin import auth
+
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    try:
+        claims = auth.verify_id_token(token.strip())
+    except (ValueError, exceptions.FirebaseError) as e:
+        print(f"Rejected ID token: {str(e)}")
+        return None
+    return claims.get('email') or None
@@ -0,0 +1,37 @@
+"""
+gunicorn settings for the TabSense servers, see wsgi.py
+    TABSENSE_SERVICE          'all' (default), 'prediction' or 'declutter'
+    PORT                      default 5001 (5000 for prediction) like the dev servers
+    TABSENSE_WORKERS          worker processes (default: CPU count)
+    TABSENSE_THREADS          threads per worker (default 4)
+    TABSENSE_WORKER_TIMEOUT   seconds before a stuck worker is restarted (default 120)
+    TABSENSE_GRACEFUL_TIMEOUT seconds workers get to finish requests on shutdown (default 30)
+"""
+
+import multiprocessing
+import os
+
+from wsgi import DEFAULT_PORTS, SERVICES
+
+service = os.environ.get('TABSENSE_SERVICE', 'all')
+if service not in SERVICES:
+    raise ValueError(f"TABSENSE_SERVICE must be one of {', '.join(SERVICES)}")
+
+wsgi_app = f"wsgi:create_app('{service}')"
+bind = f"0.0.0.0:{os.environ.get('PORT', DEFAULT_PORTS[service])}"
+
+# Load Firebase, the ML libraries and model artifacts once, then fork
+preload_app = True
+workers = int(os.environ.get('TABSENSE_WORKERS', multiprocessing.cpu_count()))
+# More than one thread selects the gthread worker; requests mostly wait on Firestore
+threads = int(os.environ.get('TABSENSE_THREADS', 4))
+# Forests may still be fit inside a request when TABSENSE_TRAINING_WORKERS is 0
+timeout = int(os.environ.get('TABSENSE_WORKER_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('TABSENSE_GRACEFUL_TIMEOUT', 30))
+accesslog = '-'
+
+
+def worker_exit(server, worker):
+    from wsgi import shutdown_app
+    if getattr(worker, 'wsgi', None) is not None:
+        shutdown_app(worker.wsgi)
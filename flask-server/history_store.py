@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta
+
+from firebase_admin import firestore
+
+# Firestore allows at most 500 writes per batch
+MAX_BATCH_WRITES = 500
+
+
+def day_of(timestamp):
+    """Bucket id for a 'YYYY-MM-DD HH:MM:SS' history timestamp"""
+    return timestamp[:10]
+
+
+class HistoryStore:
+    """
+    Browsing history sharded into one Firestore document per user per day:
+        Data/<email>/days/<YYYY-MM-DD> = {'day': 'YYYY-MM-DD', 'visits': {timestamp: url}}
+    Readers only fetch the day buckets in the requested range, so reads no
+    longer grow with the user's lifetime and no document approaches the
+    1 MiB limit. Histories still stored in the legacy single Data/<email>
+    document (timestamp -> url) are merged in until they are migrated.
+    With a StatsStore, appends also update the user's history aggregate in
+    the same transaction.
+    """
+    def __init__(self, db, collection='Data', stats_store=None):
+        self.db = db
+        self.collection = collection
+        self.stats_store = stats_store
+        self._aggregated = set()  # users known to have a history aggregate
+
+    def _user_ref(self, email):
+        return self.db.collection(self.collection).document(email)
+
+    def _days_ref(self, email):
+        return self._user_ref(email).collection('days')
+
+    def append(self, email, visits):
+        """Write {timestamp: url} visits into their day buckets"""
+        by_day = {}
+        for timestamp, url in visits.items():
+            by_day.setdefault(day_of(timestamp), {})[timestamp] = url
+
+        if self.stats_store is not None:
+            self._append_with_stats(email, by_day)
+            return
+
+        days = sorted(by_day)
+        for start in range(0, len(days), MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for day in days[start:start + MAX_BATCH_WRITES]:
+                batch.set(self._days_ref(email).document(day),
+                          {'day': day, 'visits': by_day[day]}, merge=True)
+            batch.commit()
+
+    def _append_with_stats(self, email, by_day):
+        # Summarize any history written before aggregation started, once per user
+        if email not in self._aggregated:
+            if not self.stats_store.history_ref(email).get().exists:
+                self.stats_store.rebuild_history(email, self)
+            self._aggregated.add(email)
+
+        @firestore.transactional
+        def write(transaction):
+            stats = self.stats_store.load_history(email, transaction)
+            refs = [self._days_ref(email).document(day) for day in by_day]
+            stored = {snapshot.id: (snapshot.to_dict() or {}).get('visits', {})
+                      for snapshot in self.db.get_all(refs, transaction=transaction) if snapshot.exists}
+
+            # Only visits not already in their bucket count, so client retries are idempotent
+            added = []
+            for ref in refs:
+                existing = stored.get(ref.id, {})
+                new_visits = {ts: url for ts, url in by_day[ref.id].items() if ts not in existing}
+                if new_visits:
+                    transaction.set(ref, {'day': ref.id, 'visits': new_visits}, merge=True)
+                    added.extend(new_visits.values())
+
+            if added:
+                stats.add_visits(added)
+                transaction.set(self.stats_store.history_ref(email), stats.to_dict())
+
+        write(self.db.transaction())
+
+    def iter_buckets(self, email, since=None, until=None):
+        """
+        Yield (day, {timestamp: url}) for the user's day buckets in order
+        since / until: inclusive 'YYYY-MM-DD' bounds
+        """
+        query = self._days_ref(email)
+        if since:
+            query = query.where(filter=firestore.FieldFilter('day', '>=', since))
+        if until:
+            query = query.where(filter=firestore.FieldFilter('day', '<=', until))
+
+        for snapshot in query.order_by('day').stream():
+            bucket = snapshot.to_dict() or {}
+            yield bucket.get('day', snapshot.id), bucket.get('visits', {})
+
+    def has_visits_since(self, email, since):
+        """True if the user has visits on or after the 'YYYY-MM-DD' day `since`"""
+        query = (self._days_ref(email)
+                 .where(filter=firestore.FieldFilter('day', '>=', since))
+                 .select([]).limit(1))
+        if any(True for _ in query.stream()):
+            return True
+        return any(day_of(timestamp) >= since for timestamp in self.legacy_history(email))
+
+    def legacy_history(self, email):
+        """Visits still stored in the unsharded Data/<email> document"""
+        snapshot = self._user_ref(email).get()
+        return (snapshot.to_dict() or {}) if snapshot.exists else {}
+
+    def stream(self, email, since=None, until=None, include_legacy=True):
+        """Yield (timestamp, url) visits bucket by bucket"""
+        legacy_by_day = {}
+        if include_legacy:
+            for timestamp, url in self.legacy_history(email).items():
+                day = day_of(timestamp)
+                if (not since or day >= since) and (not until or day <= until):
+                    legacy_by_day.setdefault(day, {})[timestamp] = url
+
+        for day, visits in self.iter_buckets(email, since, until):
+            # A visit can briefly exist in both layouts while a migration runs
+            legacy = legacy_by_day.pop(day, None)
+            if legacy:
+                visits = {**legacy, **visits}
+            yield from visits.items()
+
+        for day in sorted(legacy_by_day):
+            yield from legacy_by_day[day].items()
+
+    def read(self, email, since=None, until=None, include_legacy=True):
+        """The user's history in the range as a {timestamp: url} dict"""
+        return dict(self.stream(email, since, until, include_legacy))
+
+    def read_recent(self, email, days=None):
+        """History of the last `days` days (everything when days is falsy)"""
+        since = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d") if days else None
+        return self.read(email, since=since)
+
+    def migrate_user(self, email):
+        """
+        Move a user's legacy Data/<email> map into day buckets
+        Migrated fields are deleted one by one, so visits written to the
+        legacy document while the migration runs are left for the next pass.
+        Returns the number of visits moved.
+        """
+        legacy = self.legacy_history(email)
+        if not legacy:
+            return 0
+
+        self.append(email, legacy)
+
+        timestamps = list(legacy)
+        user_ref = self._user_ref(email)
+        for start in range(0, len(timestamps), MAX_BATCH_WRITES):
+            chunk = timestamps[start:start + MAX_BATCH_WRITES]
+            user_ref.update({self.db.field_path(ts): firestore.DELETE_FIELD for ts in chunk})
+
+        return len(timestamps)
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# How TabSensePredictor compensates for rarely visited next URLs:
+# - 'class_weight': weight classes by inverse frequency in the forest, no extra rows
+# - 'oversample': repeat rows of rare classes, at most OVERSAMPLE_CAP times each
+# - 'smote': SMOTE synthesis up to the majority class, cached by data fingerprint
+# - 'none': fit on the transitions as they are
+# benchmark_imbalance.py compares them on simulated histories: 'none' predicts
+# the next URL best and fits fastest, the others trade accuracy for recall
+# of rare URLs
+IMBALANCE_STRATEGIES = ('class_weight', 'oversample', 'smote', 'none')
+DEFAULT_IMBALANCE_STRATEGY = os.environ.get('TABSENSE_IMBALANCE_STRATEGY', 'none')
+OVERSAMPLE_CAP = 4
+SMOTE_NEIGHBORS = 5
+
+
+def data_fingerprint(X, y, *params):
+    """Digest of a training set (and the parameters it is resampled with)"""
+    digest = hashlib.blake2b(digest_size=16)
+    for array in (np.ascontiguousarray(X), np.ascontiguousarray(y)):
+        digest.update(f"{array.dtype}{array.shape}".encode())
+        digest.update(array.tobytes())
+    digest.update(repr(params).encode())
+    return digest.hexdigest()
+
+
+class ResampleCache:
+    """LRU of resampled training sets keyed by data_fingerprint, bounded in bytes"""
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # fingerprint -> (X, y)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def put(self, key, X, y):
+        size = X.nbytes + y.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (X, y)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (old_X, old_y) = self._entries.popitem(last=False)
+                self._bytes -= old_X.nbytes + old_y.nbytes
+
+
+SMOTE_CACHE = ResampleCache()
+
+
+def oversample(X, y, cap=OVERSAMPLE_CAP, random_state=42):
+    """
+    Repeat random rows of each class towards the majority class count,
+    adding at most (cap - 1) times the class's own rows
+    """
+    classes, inverse, counts = np.unique(y, return_inverse=True, return_counts=True)
+    targets = np.minimum(counts.max(), counts * cap)
+    rng = np.random.default_rng(random_state)
+
+    extra = []
+    for label, (count, target) in enumerate(zip(counts, targets)):
+        if target > count:
+            rows = np.flatnonzero(inverse == label)
+            extra.append(rng.choice(rows, target - count, replace=True))
+    if not extra:
+        return X, y
+    rows = np.concatenate([np.arange(len(y))] + extra)
+    return X[rows], y[rows]
+
+
+def smote(X, y, random_state=42, cache=SMOTE_CACHE):
+    """
+    SMOTE every class with at least two rows up to the majority count
+    Classes too small to have a neighbour are left as they are, and
+    k_neighbors shrinks to fit the smallest resampled class, so histories
+    with rare URLs are still resampled. Results are cached by fingerprint:
+    analysis code resamples the same transitions many times.
+    """
+    key = data_fingerprint(X, y, 'smote', random_state)
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        return cached
+
+    classes, counts = np.unique(y, return_counts=True)
+    majority = counts.max()
+    targets = {label: majority for label, count in zip(classes.tolist(), counts) if 2 <= count < majority}
+    if targets:
+        from imblearn.over_sampling import SMOTE
+        k = min(SMOTE_NEIGHBORS, min(counts[np.isin(classes, list(targets))]) - 1)
+        X_resampled, y_resampled = SMOTE(sampling_strategy=targets, k_neighbors=int(k),
+                                         random_state=random_state).fit_resample(X, y)
+    else:
+        X_resampled, y_resampled = X, y
+
+    if cache is not None:
+        cache.put(key, X_resampled, y_resampled)
+    return X_resampled, y_resampled
+
+
+def balance(model, X, y, strategy=DEFAULT_IMBALANCE_STRATEGY, random_state=42):
+    """
+    Apply the imbalance strategy for fitting `model` on (X, y)
+    Returns the (X, y) to fit on; 'class_weight' sets the model's
+    class_weight instead of adding rows.
+    """
+    if strategy not in IMBALANCE_STRATEGIES:
+        raise ValueError(f"Unknown imbalance strategy '{strategy}', "
+                         f"expected one of {', '.join(IMBALANCE_STRATEGIES)}")
+    model.set_params(class_weight='balanced' if strategy == 'class_weight' else None)
+    if strategy == 'oversample':
+        return oversample(X, y, random_state=random_state)
+    if strategy == 'smote':
+        return smote(X, y, random_state=random_state)
+    return X, y
@@ -0,0 +1,66 @@
+"""
+Streamed JSON responses for large /analyze results
+
+The body is serialized piece by piece with the C JSON encoder instead of
+jsonify() building it in memory, and gzip-compressed (level 1) when the
+client accepts it. A shared tab/string table format was tried and dropped:
+once gzipped it came out no smaller than the plain JSON.
+"""
+
+import json
+import zlib
+
+from flask import Response
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _json_pieces(obj, items_per_piece):
+    # json.dumps runs in C; iterencode() would fall back to the pure Python encoder
+    if isinstance(obj, dict):
+        yield '{'
+        for i, (key, value) in enumerate(obj.items()):
+            yield f"{',' if i else ''}{json.dumps(str(key))}:"
+            yield from _json_pieces(value, items_per_piece)
+        yield '}'
+    elif isinstance(obj, list) and len(obj) > items_per_piece:
+        yield '['
+        for start in range(0, len(obj), items_per_piece):
+            piece = json.dumps(obj[start:start + items_per_piece], separators=(',', ':'))
+            yield f"{',' if start else ''}{piece[1:-1]}"
+        yield ']'
+    else:
+        yield json.dumps(obj, separators=(',', ':'))
+
+
+def iter_json(obj, chunk_size=CHUNK_SIZE, items_per_piece=1000):
+    """Serialize obj as JSON in chunks of about chunk_size bytes"""
+    buffer = []
+    size = 0
+    for piece in _json_pieces(obj, items_per_piece):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buffer).encode()
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def iter_gzip(chunks, level=1):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def json_response(obj, accept_encoding=''):
+    """Streamed JSON response, gzipped if the client accepts gzip"""
+    chunks = iter_json(obj)
+    if 'gzip' not in accept_encoding.lower():
+        return Response(chunks, mimetype='application/json')
+    return Response(iter_gzip(chunks), mimetype='application/json',
+                    headers={'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Migrate browsing histories from the single Data/<email> document into
+per-day Data/<email>/days/<YYYY-MM-DD> buckets (see history_store.py)
+
+Usage:
+    python migrate_history.py                  # every user in Data
+    python migrate_history.py a@x.com b@y.com  # selected users
+    python migrate_history.py --dry-run
+
+Safe to re-run: already migrated users have an empty legacy document and
+visits written during a run are picked up by the next one.
+"""
+
+import argparse
+
+from firebase_client import get_db
+from history_store import HistoryStore
+from stats_aggregates import StatsStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shard Data/<email> histories into day buckets')
+    parser.add_argument('emails', nargs='*', help='users to migrate (default: all)')
+    parser.add_argument('--dry-run', action='store_true', help='only report what would be moved')
+    args = parser.parse_args()
+
+    db = get_db()
+    store = HistoryStore(db)
+    stats_store = StatsStore(db)
+
+    emails = args.emails or [ref.id for ref in db.collection('Data').list_documents()]
+    total = 0
+
+    for email in emails:
+        if args.dry_run:
+            moved = len(store.legacy_history(email))
+        else:
+            moved = store.migrate_user(email)
+            if moved:
+                # Bulk moves skip write-time aggregation, so recompute /stats once
+                stats_store.rebuild_history(email, store)
+        total += moved
+        if moved:
+            print(f"{email}: {moved} visits {'to move' if args.dry_run else 'moved'}")
+
+    print(f"Done: {total} visits across {len(emails)} users")
+
+
+if __name__ == '__main__':
+    main()
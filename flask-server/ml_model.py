@@ -1,68 +1,90 @@
-import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from sklearn.model_selection import cross_val_score
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.svm import SVC
-from sklearn.linear_model import PassiveAggressiveClassifier
-from sklearn.preprocessing import LabelEncoder
-from imblearn.over_sampling import SMOTE
 from collections import Counter
+from url_vocabulary import UrlVocabulary
+from imbalance import DEFAULT_IMBALANCE_STRATEGY, balance
 import warnings
 warnings.filterwarnings('ignore')
 
+def history_arrays(user_data):
+    """
+    Parse a timestamp -> URL history once into time-sorted arrays
+    Returns (datetime64[s] array, URL string array)
+    """
+    timestamps = np.sort(np.array(list(user_data.keys()), dtype=str))
+    times = timestamps.astype('datetime64[s]')
+    urls = np.array([user_data[ts] for ts in timestamps], dtype=str)
+    return times, urls
+
+def transition_indices(times, time_window_minutes=2):
+    """
+    Indices i where visit i+1 happened within the time window after visit i
+    """
+    if len(times) < 2:
+        return np.array([], dtype=np.int64)
+    minutes = np.diff(times).astype(np.int64) / 60
+    return np.flatnonzero(minutes <= time_window_minutes)
+
+def time_components(times):
+    """
+    Split datetime64[s] values into month, day, hour, minute and second arrays
+    """
+    months = times.astype('datetime64[M]')
+    days = times.astype('datetime64[D]')
+    seconds_of_day = (times - days).astype(np.int64)
+    
+    month = months.astype(np.int64) % 12 + 1
+    day = (days - months).astype(np.int64) + 1
+    hour = seconds_of_day // 3600
+    minute = seconds_of_day % 3600 // 60
+    second = seconds_of_day % 60
+    return month, day, hour, minute, second
+
 class TabSensePredictor:
-    def __init__(self):
-        self.input_encoder = LabelEncoder()
-        self.output_encoder = LabelEncoder()
+    def __init__(self, vocabulary=None, imbalance=DEFAULT_IMBALANCE_STRATEGY):
+        # One append-only URL index encodes both the current URL feature and the target
+        self.vocabulary = vocabulary if vocabulary is not None else UrlVocabulary()
+        self.input_encoder = self.vocabulary
+        self.output_encoder = self.vocabulary
         self.model = RandomForestClassifier(
             n_estimators=100,
             max_depth=10,
             random_state=42
         )
-        self.smote = SMOTE(random_state=42)
+        # Rare next URLs are compensated for by this strategy, see imbalance.py
+        self.imbalance = imbalance
         
     def prepare_data(self, user_data, time_window_minutes=2):
         """
         Prepare training data from user's browsing history
         time_window_minutes: time interval to consider for next URL prediction
         """
-        input_data = []
-        output_data = []
+        times, urls = history_arrays(user_data)
         
-        sorted_timestamps = sorted(user_data.keys())
+        # Index of every visit that is followed by another one within the window
+        current = transition_indices(times, time_window_minutes)
+        if len(current) == 0:
+            return np.array([]), np.array([])
         
-        for i in range(len(sorted_timestamps) - 1):
-            current_time = datetime.strptime(sorted_timestamps[i], "%Y-%m-%d %H:%M:%S")
-            next_time = datetime.strptime(sorted_timestamps[i + 1], "%Y-%m-%d %H:%M:%S")
-            
-            time_diff = (next_time - current_time).total_seconds() / 60
-            
-            if time_diff <= time_window_minutes:
-                current_url = user_data[sorted_timestamps[i]]
-                next_url = user_data[sorted_timestamps[i + 1]]
-                
-                features = [
-                    current_time.month,
-                    current_time.day,
-                    current_time.hour,
-                    current_time.minute,
-                    current_time.second,
-                    self.encode_url(current_url)
-                ]
-                
-                input_data.append(features)
-                output_data.append(next_url)
-        
-        return np.array(input_data), np.array(output_data)
+        month, day, hour, minute, second = time_components(times[current])
+        
+        # Encode each distinct URL once and scatter the codes back
+        unique_urls, inverse = np.unique(urls[current], return_inverse=True)
+        url_codes = self.vocabulary.add_many(unique_urls)[inverse]
+        
+        input_data = np.column_stack([month, day, hour, minute, second, url_codes])
+        output_data = urls[current + 1]
+        
+        return input_data, output_data
     
     def encode_url(self, url):
-        """Convert URL to numeric encoding"""
-        try:
-            url_hash = hash(url) % 10000
-            return url_hash
-        except:
-            return 0
+        """Convert URL to its stable vocabulary index (0 for unseen URLs)"""
+        return self.vocabulary.encode(url)
+    
+    def balance(self, X, y_encoded):
+        """Training set for self.model with the imbalance strategy applied"""
+        return balance(self.model, X, y_encoded, self.imbalance)
     
     def train(self, user_data):
         """Train the model on user's browsing history"""
@@ -74,21 +96,10 @@ class TabSensePredictor:
         self.output_encoder.fit(y)
         y_encoded = self.output_encoder.transform(y)
         
-        try:
-            X_resampled, y_resampled = self.smote.fit_resample(X, y_encoded)
-        except:
-            X_resampled, y_resampled = X, y_encoded
-        
+        X_resampled, y_resampled = self.balance(X, y_encoded)
         self.model.fit(X_resampled, y_resampled)
         
-        # Use min(3, number of samples) for cross-validation to handle small datasets
-        cv_splits = min(3, len(np.unique(y_resampled)))
-        if cv_splits > 1:
-            score = cross_val_score(self.model, X_resampled, y_resampled, cv=cv_splits)
-            print(f"Model accuracy: {np.mean(score):.2f}")
-        else:
-            print("Not enough data for cross-validation yet")
-        
+        # Accuracy is measured separately, see model_evaluation.py
         return True
     
     def predict(self, month, day, hour, minute, current_url):
@@ -106,9 +117,39 @@ class TabSensePredictor:
             prediction_encoded = self.model.predict(features)[0]
             prediction = self.output_encoder.inverse_transform([prediction_encoded])[0]
             return prediction
-        except:
+        except Exception as e:
+            print(f"Prediction failed: {str(e)}")
             return None
     
+    def predict_batch(self, contexts, k=1):
+        """
+        Rank the next URLs for many (month, day, hour, minute, current_url)
+        contexts with a single predict_proba call
+        Returns one [(url, probability), ...] list of up to k entries per context
+        """
+        if not contexts:
+            return []
+        
+        features = np.array([
+            [month, day, hour, minute, 0, self.encode_url(current_url)]
+            for month, day, hour, minute, current_url in contexts
+        ])
+        
+        try:
+            probabilities = self.model.predict_proba(features)
+        except Exception as e:
+            print(f"Batch prediction failed: {str(e)}")
+            return [[] for _ in contexts]
+        
+        top = np.argsort(-probabilities, axis=1, kind='stable')[:, :k]
+        urls = self.output_encoder.inverse_transform(self.model.classes_[top])
+        top_probabilities = np.take_along_axis(probabilities, top, axis=1)
+        
+        return [
+            list(zip(urls[i].tolist(), top_probabilities[i].tolist()))
+            for i in range(len(contexts))
+        ]
+    
     def get_feature_importance(self):
         """Get feature importance scores"""
         if hasattr(self.model, 'feature_importances_'):
@@ -117,11 +158,115 @@ class TabSensePredictor:
             return dict(zip(feature_names, importances))
         return None
 
-def compare_models(user_data):
+class IncrementalTabSensePredictor:
+    """
+    Count-based next-URL model that can be updated online.
+    Keeps transition counts per (current URL, hour) with a per-URL fallback,
+    plus a checkpoint of the last record consumed so that each update only
+    processes visits added since the previous one.
+    """
+    def __init__(self, time_window_minutes=2):
+        self.time_window_minutes = time_window_minutes
+        self.hourly_transitions = {}  # (current_url, hour) -> Counter(next_url)
+        self.url_transitions = {}     # current_url -> Counter(next_url)
+        self.last_timestamp = None
+        self.last_url = None
+        self.records_seen = 0
+        self.transitions_seen = 0
+    
+    def new_timestamps(self, user_data):
+        """Sorted timestamps of the visits after the checkpoint"""
+        if self.last_timestamp is None:
+            return sorted(user_data)
+        last_timestamp = self.last_timestamp
+        return sorted(ts for ts in user_data if ts > last_timestamp)
+    
+    def is_consistent_with(self, user_data, new_timestamps=None):
+        """
+        True when the history still contains exactly the records consumed so far,
+        i.e. it only grew by appending newer visits
+        Given new_timestamps(user_data) this only compares counts with the checkpoint.
+        """
+        if self.last_timestamp is None:
+            return True
+        if new_timestamps is None:
+            new_timestamps = self.new_timestamps(user_data)
+        return len(user_data) - len(new_timestamps) == self.records_seen
+    
+    def update(self, user_data, new_timestamps=None):
+        """
+        Consume visits newer than the checkpoint.
+        new_timestamps: new_timestamps(user_data), if the caller already has it
+        Returns the number of new transitions learned.
+        """
+        if new_timestamps is None:
+            new_timestamps = self.new_timestamps(user_data)
+        
+        if not new_timestamps:
+            return 0
+        
+        learned = 0
+        previous_ts = self.last_timestamp
+        previous_url = self.last_url
+        previous_time = datetime.strptime(previous_ts, "%Y-%m-%d %H:%M:%S") if previous_ts else None
+        
+        for ts in new_timestamps:
+            current_time = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
+            url = user_data[ts]
+            
+            if previous_time is not None:
+                time_diff = (current_time - previous_time).total_seconds() / 60
+                if time_diff <= self.time_window_minutes:
+                    self._count(previous_url, previous_time.hour, url)
+                    learned += 1
+            
+            previous_time = current_time
+            previous_url = url
+        
+        self.last_timestamp = new_timestamps[-1]
+        self.last_url = previous_url
+        self.records_seen += len(new_timestamps)
+        self.transitions_seen += learned
+        return learned
+    
+    def _count(self, current_url, hour, next_url):
+        self.hourly_transitions.setdefault((current_url, hour), Counter())[next_url] += 1
+        self.url_transitions.setdefault(current_url, Counter())[next_url] += 1
+    
+    def train(self, user_data):
+        """Fit from scratch on the full history"""
+        self.__init__(self.time_window_minutes)
+        self.update(user_data)
+        return self.transitions_seen > 0
+    
+    def predict(self, month, day, hour, minute, current_url):
+        """Predict the next URL based on current context"""
+        counts = self.hourly_transitions.get((current_url, hour)) or self.url_transitions.get(current_url)
+        if not counts:
+            return None
+        return counts.most_common(1)[0][0]
+    
+    def predict_batch(self, contexts, k=1):
+        """Top-k (url, probability) lists for many contexts, see TabSensePredictor.predict_batch"""
+        results = []
+        for month, day, hour, minute, current_url in contexts:
+            counts = self.hourly_transitions.get((current_url, hour)) or self.url_transitions.get(current_url)
+            if not counts:
+                results.append([])
+                continue
+            total = sum(counts.values())
+            results.append([(url, count / total) for url, count in counts.most_common(k)])
+        return results
+
+def compare_models(user_data, imbalance=DEFAULT_IMBALANCE_STRATEGY):
     """
     Compare performance of different ML models
     Returns accuracy scores for Random Forest, SVM, and Passive Aggressive
     """
+    from sklearn.linear_model import PassiveAggressiveClassifier
+    from sklearn.model_selection import cross_val_score
+    from sklearn.svm import SVC
+    
     predictor = TabSensePredictor()
     X, y = predictor.prepare_data(user_data)
     
@@ -131,11 +276,6 @@ def compare_models(user_data):
     predictor.output_encoder.fit(y)
     y_encoded = predictor.output_encoder.transform(y)
     
-    try:
-        X_resampled, y_resampled = predictor.smote.fit_resample(X, y_encoded)
-    except:
-        X_resampled, y_resampled = X, y_encoded
-    
     models = {
         'Random Forest': RandomForestClassifier(n_estimators=100, random_state=42),
         'SVM': SVC(kernel='rbf', random_state=42),
@@ -144,6 +284,8 @@ def compare_models(user_data):
     
     results = {}
     for name, model in models.items():
+        # SMOTE output is cached, so the three models share one resampling
+        X_resampled, y_resampled = balance(model, X, y_encoded, imbalance)
         scores = cross_val_score(model, X_resampled, y_resampled, cv=5)
         results[name] = {
             'mean_accuracy': np.mean(scores),
@@ -153,10 +295,37 @@ def compare_models(user_data):
     
     return results
 
-def predict_next_url(user_data, month, day, hour, minute, current_url):
+def load_predictor(user_data, email, registry, mode='full', scheduler=None):
+    """
+    Return a ready predictor for the user's history from the registry
+    mode: 'full', 'incremental' or 'markov' (top-k TransitionIndex)
+    With a scheduler, 'full' never waits on a fit (see TrainingScheduler.predictor_for)
+    """
+    if scheduler is not None and mode == 'full':
+        return scheduler.predictor_for(email, user_data)
+    if mode == 'incremental':
+        return registry.get_or_update_incremental(email, user_data)
+    if mode == 'markov':
+        return registry.get_or_train(email, user_data, kind='markov')
+    return registry.get_or_train(email, user_data)
+
+def predict_next_url(user_data, month, day, hour, minute, current_url, email=None, registry=None,
+                     mode='full', scheduler=None):
     """
     Main prediction function called by the Flask API
+    When a ModelRegistry and email are given, the trained model is reused
+    until the user's history changes.
+    mode: 'full' refits the forest on the whole history, 'incremental' updates
+    a checkpointed count model with only the newly added visits
+    scheduler: a TrainingScheduler; full fits then happen in the background and
+    this call never waits on one
     """
+    if registry is not None and email:
+        predictor = load_predictor(user_data, email, registry, mode, scheduler)
+        if predictor is None:
+            return None
+        return predictor.predict(month, day, hour, minute, current_url)
+    
     predictor = TabSensePredictor()
     
     if predictor.train(user_data):
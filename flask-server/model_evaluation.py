@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Offline / asynchronous evaluation of TabSensePredictor models
+Cross-validation is kept out of the serving path: it runs on a sample of
+the user's transitions, in a separate process, and its results are
+appended to a metrics store.
+
+Offline usage:
+    python model_evaluation.py user@example.com [more emails] --sample-size 2000
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from model_store import DEFAULT_MODEL_DIR
+
+DEFAULT_EVAL_SAMPLE_RATE = float(os.environ.get('TABSENSE_EVAL_SAMPLE_RATE', 0.0))
+DEFAULT_EVAL_SAMPLE_SIZE = int(os.environ.get('TABSENSE_EVAL_SAMPLE_SIZE', 2000))
+DEFAULT_HISTORY_DAYS = int(os.environ.get('TABSENSE_HISTORY_DAYS', 0))
+DEFAULT_METRICS_DIR = os.environ.get('TABSENSE_METRICS_DIR', os.path.join(DEFAULT_MODEL_DIR, 'metrics'))
+# Evaluations kept per user
+MAX_METRICS_PER_USER = int(os.environ.get('TABSENSE_MAX_METRICS_PER_USER', 100))
+
+
+def evaluate_history(user_data, sample_size=DEFAULT_EVAL_SAMPLE_SIZE, cv=3, seed=42):
+    """
+    Cross-validate a fresh TabSensePredictor on up to sample_size randomly
+    sampled transitions of the user's history
+    Returns a metrics dict, or None when there is not enough data
+    """
+    from sklearn.model_selection import cross_val_score
+    from ml_model import TabSensePredictor
+
+    start = time.perf_counter()
+    predictor = TabSensePredictor()
+    X, y = predictor.prepare_data(user_data)
+    total_samples = len(X)
+
+    if total_samples > sample_size:
+        rows = np.random.default_rng(seed).choice(total_samples, sample_size, replace=False)
+        X, y = X[rows], y[rows]
+
+    if len(X) < 2:
+        return None
+
+    y_encoded = predictor.output_encoder.fit_transform(y)
+
+    X_resampled, y_resampled = predictor.balance(X, y_encoded)
+
+    # Use min(cv, number of classes) folds to handle small datasets
+    cv_splits = min(cv, len(np.unique(y_resampled)))
+    if cv_splits < 2:
+        return None
+
+    scores = cross_val_score(predictor.model, X_resampled, y_resampled, cv=cv_splits)
+    return {
+        'accuracy_mean': float(np.mean(scores)),
+        'accuracy_std': float(np.std(scores)),
+        'folds': int(cv_splits),
+        'samples': int(len(X)),
+        'total_samples': int(total_samples),
+        'seconds': time.perf_counter() - start
+    }
+
+
+class MetricsStore:
+    """
+    Evaluation results as one JSON lines file per user, so reading a user's
+    history never parses anyone else's. New results are appended; once a
+    file holds twice max_entries it is rewritten with the newest max_entries.
+    """
+    def __init__(self, directory=DEFAULT_METRICS_DIR, max_entries=MAX_METRICS_PER_USER):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, email):
+        return os.path.join(self.directory, f"{hashlib.sha1(email.encode('utf-8')).hexdigest()}.jsonl")
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def record(self, email, metrics):
+        entry = {'email': email, 'recorded_at': time.time(), **metrics}
+        path = self._path(email)
+        with self._lock:
+            entries = self._read(path)
+            if len(entries) + 1 < 2 * self.max_entries:
+                with open(path, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+                return entry
+
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                for kept in (entries + [entry])[-self.max_entries:]:
+                    f.write(json.dumps(kept) + '\n')
+            os.replace(tmp_path, path)
+        return entry
+
+    def history(self, email, limit=10):
+        """Most recent evaluations for the user, newest last"""
+        with self._lock:
+            return self._read(self._path(email))[-limit:]
+
+    def latest(self, email):
+        entries = self.history(email, limit=1)
+        return entries[0] if entries else None
+
+
+class AsyncEvaluator:
+    """
+    Runs evaluate_history for a random fraction of freshly trained models in
+    a background process and records the results in a MetricsStore
+    """
+    def __init__(self, metrics_store, sample_rate=DEFAULT_EVAL_SAMPLE_RATE,
+                 sample_size=DEFAULT_EVAL_SAMPLE_SIZE, max_workers=1):
+        self.metrics_store = metrics_store
+        self.sample_rate = sample_rate
+        self.sample_size = sample_size
+        self.max_workers = max_workers
+        # Created on first use, after a preloading server has forked
+        self._executor = None
+
+    def maybe_submit(self, email, user_data):
+        """Queue an evaluation with probability sample_rate; returns True if queued"""
+        if random.random() >= self.sample_rate:
+            return False
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        future = self._executor.submit(evaluate_history, user_data, self.sample_size)
+        future.add_done_callback(lambda f: self._on_done(email, f))
+        return True
+
+    def _on_done(self, email, future):
+        try:
+            metrics = future.result()
+        except Exception as e:
+            print(f"Evaluation for {email} failed: {str(e)}")
+            return
+        if metrics:
+            self.metrics_store.record(email, metrics)
+            print(f"Model accuracy for {email}: {metrics['accuracy_mean']:.2f}")
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate TabSense models offline')
+    parser.add_argument('emails', nargs='+', help='users whose Data history to evaluate')
+    parser.add_argument('--sample-size', type=int, default=DEFAULT_EVAL_SAMPLE_SIZE)
+    parser.add_argument('--cv', type=int, default=3)
+    parser.add_argument('--history-days', type=int, default=DEFAULT_HISTORY_DAYS,
+                        help='days of history to evaluate on, 0 = all (TABSENSE_HISTORY_DAYS)')
+    parser.add_argument('--metrics', default=DEFAULT_METRICS_DIR,
+                        help='metrics directory (TABSENSE_METRICS_DIR, default: <model dir>/metrics)')
+    args = parser.parse_args()
+
+    from firebase_client import get_db
+    from history_store import HistoryStore
+
+    # Day buckets plus whatever is still in the legacy Data/<email> document
+    history_store = HistoryStore(get_db())
+    store = MetricsStore(args.metrics)
+
+    for email in args.emails:
+        metrics = evaluate_history(history_store.read_recent(email, args.history_days), args.sample_size, args.cv)
+        if metrics is None:
+            print(f"{email}: not enough data")
+            continue
+        store.record(email, metrics)
+        print(f"{email}: {metrics['accuracy_mean']:.3f} ± {metrics['accuracy_std']:.3f} "
+              f"({metrics['samples']} samples, {metrics['seconds']:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
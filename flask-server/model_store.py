@@ -0,0 +1,278 @@
+import fcntl
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import joblib
+
+from url_vocabulary import UrlVocabulary
+
+DEFAULT_MODEL_DIR = os.environ.get('TABSENSE_MODEL_DIR', 'model_store')
+DEFAULT_CACHE_BYTES = int(os.environ.get('TABSENSE_MODEL_CACHE_BYTES', 256 * 1024 * 1024))
+
+
+def history_fingerprint(user_data):
+    """
+    Stable fingerprint of a user's browsing history (timestamp -> URL map)
+    """
+    digest = hashlib.sha1()
+    for timestamp, url in sorted(user_data.items()):
+        digest.update(f"{timestamp}\t{url}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def estimate_size(obj):
+    """
+    Approximate in-memory footprint of a model using its pickled size
+    """
+    return len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class ModelRegistry:
+    """
+    Two-tier cache of trained TabSensePredictor models keyed by user email
+    and history fingerprint:
+    - memory: LRU bounded by an approximate byte budget
+    - disk: one joblib artifact per user in model_dir
+    Each user's URL vocabulary is persisted next to the artifacts so that
+    encodings stay stable across retrains, processes and restarts. Fits of
+    the same (kind, email) are deduplicated across threads, and fits that
+    extend a user's vocabulary are serialized across threads and processes.
+    """
+    def __init__(self, model_dir=DEFAULT_MODEL_DIR, max_bytes=DEFAULT_CACHE_BYTES, evaluator=None):
+        self.model_dir = model_dir
+        self.max_bytes = max_bytes
+        # Optional AsyncEvaluator sampling freshly trained models for CV metrics
+        self.evaluator = evaluator
+        self._entries = OrderedDict()  # (kind, email) -> (fingerprint, predictor, size)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}  # (kind, email) -> threading.Lock
+        os.makedirs(self.model_dir, exist_ok=True)
+
+    def _artifact_path(self, email, kind='full', extension='joblib'):
+        name = hashlib.sha1(email.encode('utf-8')).hexdigest()
+        if kind != 'full':
+            name = f"{name}.{kind}"
+        return os.path.join(self.model_dir, f"{name}.{extension}")
+
+    def load_vocabulary(self, email):
+        """The user's persisted URL vocabulary (empty if none yet)"""
+        return UrlVocabulary.load(self._artifact_path(email, 'vocab', 'json'))
+
+    @contextmanager
+    def vocabulary_lock(self, email):
+        """
+        Exclusive lock on the user's vocabulary file: hold it from loading the
+        vocabulary until the extended one is saved, or concurrent fits hand
+        out conflicting codes and the last save wins
+        """
+        with open(self._artifact_path(email, 'vocab', 'lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def save_vocabulary(self, email, vocabulary):
+        try:
+            vocabulary.save(self._artifact_path(email, 'vocab', 'json'))
+        except Exception as e:
+            print(f"Could not persist URL vocabulary for {email}: {str(e)}")
+
+    def _remember(self, key, fingerprint, predictor, size=None, loaded=False):
+        """
+        Cache a predictor; returns the one callers should use
+        loaded: the predictor was just read from disk, so an entry for the
+        same fingerprint cached meanwhile (e.g. by the fit that wrote the
+        artifact) wins over the copy
+        """
+        if self.max_bytes <= 0:
+            return predictor
+        if size is None:
+            size = estimate_size(predictor)
+        if size > self.max_bytes:
+            return predictor
+
+        with self._lock:
+            if loaded:
+                entry = self._entries.get(key)
+                if entry and entry[0] == fingerprint:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+            old = self._entries.pop(key, None)
+            if old:
+                self._total_bytes -= old[2]
+
+            self._entries[key] = (fingerprint, predictor, size)
+            self._total_bytes += size
+
+            # Evict least recently used models until we fit the budget
+            while self._total_bytes > self.max_bytes and self._entries:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+        return predictor
+
+    def get(self, email, fingerprint, kind='full'):
+        """
+        Return the cached predictor for this user if it was trained on the
+        history with the given fingerprint, otherwise None
+        """
+        key = (kind, email)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == fingerprint:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        artifact = self._load_artifact(email, kind)
+        if artifact is None or artifact.get('fingerprint') != fingerprint:
+            return None
+
+        return self._remember(key, fingerprint, artifact['predictor'], loaded=True)
+
+    def get_latest(self, email):
+        """
+        Return (fingerprint, predictor) for the most recently trained model of
+        this user, whatever history it was trained on, or None
+        """
+        key = ('full', email)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                return entry[0], entry[1]
+
+        artifact = self._load_artifact(email)
+        if artifact is None:
+            return None
+
+        fingerprint = artifact['fingerprint']
+        return fingerprint, self._remember(key, fingerprint, artifact['predictor'], loaded=True)
+
+    def _load_artifact(self, email, kind='full'):
+        path = self._artifact_path(email, kind)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            return joblib.load(path)
+        except Exception as e:
+            print(f"Could not load model artifact for {email}: {str(e)}")
+            return None
+
+    def _key_lock(self, key):
+        """Lock serializing fits and updates of one (kind, email)"""
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def put(self, email, fingerprint, predictor, kind='full'):
+        """
+        Store a freshly trained predictor in both tiers
+        Callers that extended the user's vocabulary hold vocabulary_lock
+        """
+        self._remember((kind, email), fingerprint, predictor)
+        self.save_vocabulary(email, predictor.vocabulary)
+        self._persist(email, kind, {
+            'fingerprint': fingerprint,
+            'predictor': predictor
+        })
+
+    def _persist(self, email, kind, artifact):
+        path = self._artifact_path(email, kind)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            joblib.dump(artifact, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Could not persist model artifact for {email}: {str(e)}")
+
+    def get_or_train(self, email, user_data, fingerprint=None, kind='full'):
+        """
+        Return a trained predictor for the user's current history, training
+        only when the history has changed since the last cached fit
+        kind: 'full' for the TabSensePredictor forest, 'markov' for the
+        top-k TransitionIndex
+        """
+        if fingerprint is None:
+            fingerprint = history_fingerprint(user_data)
+        predictor = self.get(email, fingerprint, kind)
+        if predictor is not None:
+            return predictor
+
+        # Concurrent requests for the same user wait for one fit instead of
+        # each training (and overwriting) the same model
+        with self._key_lock((kind, email)):
+            predictor = self.get(email, fingerprint, kind)
+            if predictor is not None:
+                return predictor
+
+            with self.vocabulary_lock(email):
+                if kind == 'markov':
+                    from transition_index import TransitionIndex
+                    predictor = TransitionIndex(vocabulary=self.load_vocabulary(email))
+                else:
+                    from ml_model import TabSensePredictor
+                    predictor = TabSensePredictor(vocabulary=self.load_vocabulary(email))
+                if not predictor.train(user_data):
+                    return None
+
+                self.put(email, fingerprint, predictor, kind)
+
+        if self.evaluator is not None and kind == 'full':
+            self.evaluator.maybe_submit(email, user_data)
+        return predictor
+
+    def get_or_update_incremental(self, email, user_data):
+        """
+        Return the user's incremental predictor after feeding it only the
+        visits recorded since its last checkpoint
+        Updates of different users run concurrently.
+        """
+        with self._key_lock(('incremental', email)):
+            return self._update_incremental(email, user_data)
+
+    def _update_incremental(self, email, user_data):
+        from ml_model import IncrementalTabSensePredictor
+
+        key = ('incremental', email)
+        with self._lock:
+            entry = self._entries.get(key)
+        predictor = entry[1] if entry else None
+
+        if predictor is None:
+            path = self._artifact_path(email, 'incremental')
+            if os.path.exists(path):
+                try:
+                    predictor = joblib.load(path)['predictor']
+                except Exception as e:
+                    print(f"Could not load incremental checkpoint for {email}: {str(e)}")
+
+        # Records were removed or rewritten: the counts can't be unlearned, so refit
+        new_timestamps = predictor.new_timestamps(user_data) if predictor is not None else None
+        if predictor is None or not predictor.is_consistent_with(user_data, new_timestamps):
+            predictor = IncrementalTabSensePredictor()
+            new_timestamps = None
+
+        learned = predictor.update(user_data, new_timestamps)
+        if learned or entry is None:
+            self._remember(key, predictor.last_timestamp, predictor)
+        if learned:
+            self._persist(email, 'incremental', {'predictor': predictor})
+
+        if predictor.transitions_seen == 0:
+            return None
+        return predictor
+
+    def stats(self):
+        """Current memory tier usage"""
+        with self._lock:
+            return {
+                'models': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes
+            }
+
@@ -0,0 +1,237 @@
+from flask import Blueprint, current_app, jsonify, request
+
+from firebase_client import verified_email
+from model_store import ModelRegistry
+from history_store import HistoryStore
+from training_scheduler import TrainingScheduler
+from model_evaluation import AsyncEvaluator, MetricsStore
+
+prediction = Blueprint('prediction', __name__)
+
+
+class PredictionServices:
+    """Per-app state of the prediction routes, in app.extensions['prediction']"""
+    def __init__(self, db, stats_store, config):
+        # Browsing history is sharded into Data/<email>/days/<YYYY-MM-DD> documents and
+        # summarized on ingest into Data/<email>/aggregates/history for /stats
+        self.stats_store = stats_store
+        self.history_store = HistoryStore(db, stats_store=stats_store)
+        # A sampled fraction of fits (EVAL_SAMPLE_RATE) is cross-validated in the background
+        self.metrics_store = MetricsStore()
+        self.model_evaluator = (AsyncEvaluator(self.metrics_store, sample_rate=config['EVAL_SAMPLE_RATE'])
+                                if config['EVAL_SAMPLE_RATE'] > 0 else None)
+        # Trained models are cached per user and only refit when their history changes
+        self.model_registry = ModelRegistry(evaluator=self.model_evaluator)
+        # With TRAINING_WORKERS > 0 forests are fit in a process pool instead of the request
+        self.training_scheduler = (TrainingScheduler(self.model_registry, max_workers=config['TRAINING_WORKERS'])
+                                   if config['TRAINING_WORKERS'] > 0 else None)
+        # scikit-learn / imbalanced-learn are only imported by warm_up()
+        self.ml_model = None
+        self.weekday_for = None
+
+    def warm_up(self):
+        """Import the ML stack once per process: at startup, or on the first request"""
+        if self.ml_model is None:
+            import ml_model
+            from transition_index import weekday_for
+            self.weekday_for = weekday_for
+            self.ml_model = ml_model
+
+    def shutdown(self):
+        """Let queued background training and evaluation finish"""
+        if self.training_scheduler:
+            self.training_scheduler.shutdown()
+        if self.model_evaluator:
+            self.model_evaluator.shutdown()
+
+
+def init_prediction(app, db, stats_store):
+    app.extensions['prediction'] = PredictionServices(db, stats_store, app.config)
+    app.register_blueprint(prediction)
+
+
+def services():
+    state = current_app.extensions['prediction']
+    state.warm_up()
+    return state
+
+
+def _context_error(month, day, hour, minute):
+    """Why a prediction context is invalid, or None"""
+    if any(isinstance(v, bool) or not isinstance(v, int) for v in (month, day, hour, minute)):
+        return 'month, day, hour and minute must be integers'
+    if not 0 <= hour < 24 or not 0 <= minute < 60:
+        return 'hour must be in 0..23 and minute in 0..59'
+    return None
+
+
+@prediction.route('/predict/<int:month>/<int:day>/<int:hour>/<int:minute>/<url>/<email>/')
+def predict(month, day, hour, minute, url, email):
+    """
+    Main prediction endpoint that takes current time and URL,
+    returns predicted next URL based on user's browsing history
+    Query parameters:
+    - backend: 'forest' or 'markov'
+    - k: with the markov backend, return the top k URLs with probabilities as JSON
+    """
+    backend = request.args.get('backend', current_app.config['PREDICT_BACKEND'])
+    k = request.args.get('k', type=int) if backend == 'markov' else None
+    error = _context_error(month, day, hour, minute)
+    if error is None and k is not None and k < 1:
+        error = 'k must be a positive integer'
+    if error:
+        return jsonify({'error': error}), 400
+    state = services()
+
+    try:
+        print(f"Prediction request for {email}")
+        print(f"Current time: {month}/{day} {hour}:{minute}")
+        print(f"Current URL: {url}")
+
+        data = state.history_store.read_recent(email, current_app.config['HISTORY_DAYS'])
+
+        if len(data) < 5:
+            return jsonify({'predictions': []}) if k else "Not enough data to predict."
+
+        if backend == 'markov':
+            index = state.ml_model.load_predictor(data, email, state.model_registry, mode='markov')
+            ranked = index.top_k(url, hour, state.weekday_for(month, day), k=k or 1) if index else []
+            if k:
+                return jsonify({
+                    'predictions': [{'url': u, 'probability': p} for u, p in ranked]
+                })
+            return ranked[0][0] if ranked else "Not enough data to predict."
+
+        prediction = state.ml_model.predict_next_url(data, month, day, hour, minute, url,
+                                                     email=email, registry=state.model_registry,
+                                                     mode=current_app.config['TRAINING_MODE'],
+                                                     scheduler=state.training_scheduler)
+
+        if prediction:
+            print(f"Predicted URL: {prediction}")
+            return prediction
+        else:
+            return "Not enough data to predict."
+
+    except Exception as e:
+        print(f"Error in prediction: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return "Error occurred during prediction"
+
+@prediction.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """
+    Predict next URLs for many contexts in one call
+    Body: {"requests": [{"email", "month", "day", "hour", "minute", "url"}, ...],
+           "k": optional number of ranked URLs per request (default 1),
+           "backend": optional 'forest' or 'markov'}
+    Returns {"results": [[{"url", "probability"}, ...], ...]} in request order
+    """
+    payload = request.json or {}
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Body must be a JSON object'}), 400
+    items = payload.get('requests', [])
+    backend = payload.get('backend', current_app.config['PREDICT_BACKEND'])
+    state = services()
+
+    k = payload.get('k', 1)
+    if isinstance(k, bool) or not isinstance(k, int) or k < 1:
+        return jsonify({'error': 'k must be a positive integer'}), 400
+
+    required = ('email', 'month', 'day', 'hour', 'minute', 'url')
+    if not isinstance(items, list) or any(not isinstance(item, dict) or not all(f in item for f in required)
+                                          for item in items):
+        return jsonify({'error': f"Each request must be an object with {', '.join(required)}"}), 400
+    for item in items:
+        error = _context_error(item['month'], item['day'], item['hour'], item['minute'])
+        if error:
+            return jsonify({'error': error}), 400
+
+    try:
+        positions_by_user = {}
+        for position, item in enumerate(items):
+            positions_by_user.setdefault(item['email'], []).append(position)
+
+        results = [[] for _ in items]
+
+        for email, positions in positions_by_user.items():
+            data = state.history_store.read_recent(email, current_app.config['HISTORY_DAYS'])
+            if len(data) < 5:
+                continue
+
+            mode = 'markov' if backend == 'markov' else current_app.config['TRAINING_MODE']
+            predictor = state.ml_model.load_predictor(data, email, state.model_registry, mode,
+                                                      state.training_scheduler)
+            if predictor is None:
+                continue
+
+            contexts = [
+                (items[p]['month'], items[p]['day'], items[p]['hour'], items[p]['minute'], items[p]['url'])
+                for p in positions
+            ]
+            for position, ranked in zip(positions, predictor.predict_batch(contexts, k)):
+                results[position] = [{'url': url, 'probability': prob} for url, prob in ranked]
+
+        return jsonify({'results': results})
+
+    except Exception as e:
+        print(f"Error in batch prediction: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@prediction.route('/stats/<email>/')
+def get_stats(email):
+    """Get user statistics for the extension popup"""
+    state = services()
+    try:
+        stats = state.stats_store.history_summary(email)
+
+        if stats is None:
+            # Histories written before aggregates existed are summarized once
+            stats = state.stats_store.rebuild_history(email, state.history_store).summary()
+
+        return jsonify(stats)
+
+    except Exception as e:
+        print(f"Error getting stats: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@prediction.route('/visits', methods=['POST'])
+def record_visits():
+    """
+    Ingest browsing history for the signed-in user
+    Header: Authorization: Bearer <Firebase ID token>
+    Body: {"visits": {"YYYY-MM-DD HH:MM:SS": url, ...}}
+    """
+    email = verified_email(request.headers.get('Authorization'))
+    if email is None:
+        return jsonify({'error': 'A valid Firebase ID token is required'}), 401
+
+    try:
+        data = request.json or {}
+        visits = data.get('visits', {}) if isinstance(data, dict) else None
+
+        if not isinstance(visits, dict) or not visits:
+            return jsonify({'error': 'visits are required'}), 400
+
+        services().history_store.append(email, visits)
+        return jsonify({'recorded': len(visits)})
+
+    except Exception as e:
+        print(f"Error recording visits: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@prediction.route('/training/status')
+def training_status():
+    """Background training queue depth and job timings"""
+    state = services()
+    return jsonify({
+        'mode': current_app.config['TRAINING_MODE'],
+        'scheduler': state.training_scheduler.stats() if state.training_scheduler else None,
+        'model_cache': state.model_registry.stats()
+    })
+
+@prediction.route('/metrics/<email>/')
+def model_metrics(email):
+    """Recent offline/sampled cross-validation results for the user's model"""
+    return jsonify({'evaluations': services().metrics_store.history(email)})
@@ -0,0 +1,102 @@
+"""
+TabSense server: one Flask app serving the prediction and declutter
+routes (prediction_api.py, declutter_api.py) from one process with one
+Firestore client
+
+    python server.py          # dev server on port 5001, both services
+    python app.py             # prediction routes only, port 5000
+    python app_declutter.py   # declutter routes only, port 5001
+
+Configuration is read from the defaults below, then TABSENSE_<KEY>
+environment variables (TABSENSE_HISTORY_DAYS=30, TABSENSE_GROUPING_MODE=domain),
+then the `config` passed to create_app().
+"""
+
+import os
+
+from flask import Flask, jsonify
+from flask_cors import CORS
+
+from duplicate_index import DEFAULT_DUPLICATE_MODE, DEFAULT_SIMILARITY
+from tab_grouping import DEFAULT_GROUP_SIMILARITY, DEFAULT_GROUPING_MODE
+from model_evaluation import DEFAULT_EVAL_SAMPLE_RATE
+from training_scheduler import DEFAULT_TRAINING_WORKERS
+from stats_aggregates import StatsStore
+from prediction_api import init_prediction
+from declutter_api import get_user_stats, init_declutter
+
+SERVICES = ('prediction', 'declutter')
+
+DEFAULT_CONFIG = {
+    # Only the last N days of history are read for training (0 = everything)
+    'HISTORY_DAYS': 0,
+    # 'full' refits the forest when history changes, 'incremental' only consumes new visits
+    'TRAINING_MODE': 'full',
+    # 'forest' (TabSensePredictor) or 'markov' (top-k TransitionIndex); overridable per request
+    'PREDICT_BACKEND': 'forest',
+    'TRAINING_WORKERS': DEFAULT_TRAINING_WORKERS,
+    'EVAL_SAMPLE_RATE': DEFAULT_EVAL_SAMPLE_RATE,
+    # /analyze defaults; overridable per request
+    'DUPLICATE_MODE': DEFAULT_DUPLICATE_MODE,
+    'DUPLICATE_SIMILARITY': DEFAULT_SIMILARITY,
+    'GROUPING_MODE': DEFAULT_GROUPING_MODE,
+    'GROUP_SIMILARITY': DEFAULT_GROUP_SIMILARITY,
+    # Import the ML stack and load model artifacts in create_app instead of on
+    # the first request (see wsgi.py for preloading it before workers fork)
+    'WARM_UP': True,
+}
+
+
+def create_app(services=SERVICES, config=None, db=None):
+    """
+    Build the app with the given services' blueprints
+    db defaults to the process-wide Firestore client (firebase_client.py)
+    """
+    services = tuple(services)
+    unknown = set(services) - set(SERVICES)
+    if unknown or not services:
+        raise ValueError(f"services must be a subset of {', '.join(SERVICES)}")
+
+    app = Flask(__name__)
+    CORS(app)
+    app.config.from_mapping(DEFAULT_CONFIG)
+    app.config.from_prefixed_env('TABSENSE')
+    app.config.from_mapping(config or {})
+
+    if db is None:
+        from firebase_client import get_db
+        db = get_db()
+    # Both services count into the same Data/ and TabActivity/ aggregates
+    stats_store = StatsStore(db)
+
+    if 'prediction' in services:
+        init_prediction(app, db, stats_store)
+    if 'declutter' in services:
+        init_declutter(app, db, stats_store)
+        if 'prediction' not in services:
+            # The standalone declutter server has always served tab stats here
+            app.add_url_rule('/stats/<email>/', 'tab_stats', get_user_stats)
+    if app.config['WARM_UP']:
+        for service in services:
+            app.extensions[service].warm_up()
+
+    @app.route('/health')
+    def health_check():
+        """Health check endpoint"""
+        return jsonify({'status': 'healthy', 'service': 'TabSense Server', 'services': list(services)})
+
+    print(f"TabSense server ready ({', '.join(services)})")
+    return app
+
+
+def shutdown_app(app):
+    """Let the services' background work finish before the process exits"""
+    for service in SERVICES:
+        state = app.extensions.get(service)
+        if hasattr(state, 'shutdown'):
+            state.shutdown()
+
+
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 5001))
+    create_app().run(host='0.0.0.0', port=port, debug=True)
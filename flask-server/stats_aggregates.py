@@ -0,0 +1,208 @@
+import hashlib
+import math
+
+from firebase_admin import firestore
+
+
+class HyperLogLog:
+    """
+    Cardinality sketch for the number of unique sites a user visited
+    2^precision one-byte registers (1 KiB at the default precision of 10,
+    about 3% standard error; small counts use linear counting and are
+    effectively exact)
+    """
+    def __init__(self, precision=10, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers else bytearray(self.size)
+
+    @staticmethod
+    def _hash(value):
+        # Stable across processes, unlike hash()
+        return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def add(self, value):
+        h = self._hash(value)
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+
+class SpaceSaving:
+    """
+    Top-N heavy hitters over a stream with a fixed number of counters
+    Counts of items that entered after an eviction may be overestimated by
+    at most the evicted minimum; the most visited sites are reported exactly
+    in practice because they are never evicted.
+    """
+    def __init__(self, capacity=20, counts=None):
+        self.capacity = capacity
+        self.counts = dict(counts or {})
+
+    def add(self, item, count=1):
+        if item in self.counts or len(self.counts) < self.capacity:
+            self.counts[item] = self.counts.get(item, 0) + count
+            return
+        victim = min(self.counts, key=self.counts.get)
+        self.counts[item] = self.counts.pop(victim) + count
+
+    def top(self, n=None):
+        ranked = sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)
+        return ranked[:n] if n else ranked
+
+
+class HistoryStats:
+    """
+    Write-time aggregate of a user's browsing history: total visits, unique
+    sites (HyperLogLog) and the most visited sites (SpaceSaving)
+    """
+    def __init__(self, total=0, hll=None, top=None):
+        self.total = total
+        self.hll = HyperLogLog(registers=hll)
+        self.heavy_hitters = SpaceSaving(counts=top)
+
+    def add_visits(self, urls):
+        for url in urls:
+            self.total += 1
+            self.hll.add(url)
+            self.heavy_hitters.add(url)
+
+    def to_dict(self):
+        return {
+            'total': self.total,
+            'hll': self.hll.to_bytes(),
+            'unique_estimate': self.hll.count(),
+            # Firestore map keys can't contain some URL characters, so store pairs
+            'top': [{'url': url, 'count': count} for url, count in self.heavy_hitters.top()]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        top = {entry['url']: entry['count'] for entry in data.get('top', [])}
+        return cls(data.get('total', 0), data.get('hll'), top)
+
+    def summary(self):
+        """Response body of the prediction server's /stats endpoint"""
+        top = self.heavy_hitters.top(1)
+        return {
+            'totalUrls': self.total,
+            'uniqueSites': self.hll.count(),
+            'mostVisited': top[0][0] if top else None
+        }
+
+
+TAB_COUNTERS = ('totalTabs', 'activeTabs', 'pinnedTabs', 'forgottenTabs', 'unusedTabs')
+
+
+def tab_counters(tab):
+    """0/1 contribution of one tracked tab to each per-status counter"""
+    if not tab:
+        return dict.fromkeys(TAB_COUNTERS, 0)
+    return {
+        'totalTabs': 1,
+        'activeTabs': int(bool(tab.get('isActive'))),
+        'pinnedTabs': int(bool(tab.get('isPinned'))),
+        'forgottenTabs': int(tab.get('status') == 'forgotten'),
+        'unusedTabs': int(tab.get('status') == 'unused'),
+    }
+
+
+def tab_counter_deltas(old_tab, new_tab):
+    """Counter changes caused by a tab going from old_tab to new_tab (None = absent)"""
+    old, new = tab_counters(old_tab), tab_counters(new_tab)
+    return {name: new[name] - old[name] for name in TAB_COUNTERS if new[name] != old[name]}
+
+
+def summarize_tabs(tabs):
+    """All per-status counters in a single pass over a {tab_id: tab} map"""
+    totals = dict.fromkeys(TAB_COUNTERS, 0)
+    for tab in tabs.values():
+        for name, value in tab_counters(tab).items():
+            totals[name] += value
+    return totals
+
+
+class StatsStore:
+    """
+    Aggregate documents read by the /stats endpoints:
+        Data/<email>/aggregates/history         (HistoryStats)
+        TabActivity/<email>/aggregates/tabs     (TAB_COUNTERS)
+    """
+    def __init__(self, db):
+        self.db = db
+
+    def history_ref(self, email):
+        return self.db.collection('Data').document(email).collection('aggregates').document('history')
+
+    def tabs_ref(self, email):
+        return self.db.collection('TabActivity').document(email).collection('aggregates').document('tabs')
+
+    def load_history(self, email, transaction=None):
+        """The user's HistoryStats (empty if none yet), optionally read in a transaction"""
+        snapshot = self.history_ref(email).get(transaction=transaction)
+        return HistoryStats.from_dict(snapshot.to_dict() or {}) if snapshot.exists else HistoryStats()
+
+    def rebuild_history(self, email, history_store):
+        """Recompute the history aggregate from the stored day buckets"""
+        stats = HistoryStats()
+        stats.add_visits(url for _, url in history_store.stream(email))
+        self.history_ref(email).set(stats.to_dict())
+        return stats
+
+    def history_summary(self, email):
+        """/stats response straight from the stored fields (None if no aggregate yet)"""
+        snapshot = self.history_ref(email).get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict()
+        top = data.get('top') or []
+        return {
+            'totalUrls': data.get('total', 0),
+            'uniqueSites': data.get('unique_estimate', 0),
+            'mostVisited': top[0]['url'] if top else None
+        }
+
+    def record_tab_changes(self, email, changes, batch=None):
+        """
+        Apply counter deltas for [(old_tab, new_tab), ...] with server-side
+        increments, optionally as part of an existing write batch
+        """
+        totals = {}
+        for old_tab, new_tab in changes:
+            for name, delta in tab_counter_deltas(old_tab, new_tab).items():
+                totals[name] = totals.get(name, 0) + delta
+
+        if not totals:
+            return totals
+
+        update = {name: firestore.Increment(delta) for name, delta in totals.items()}
+        if batch is not None:
+            batch.set(self.tabs_ref(email), update, merge=True)
+        else:
+            self.tabs_ref(email).set(update, merge=True)
+        return totals
+
+    def rebuild_tabs(self, email, tabs):
+        counters = summarize_tabs(tabs)
+        self.tabs_ref(email).set(counters)
+        return counters
+
+    def tab_summary(self, email):
+        snapshot = self.tabs_ref(email).get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict()
+        return {name: data.get(name, 0) for name in TAB_COUNTERS}
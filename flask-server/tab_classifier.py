@@ -1,82 +1,257 @@
-import pandas as pd
 import numpy as np
+import os
+import time
 from datetime import datetime, timedelta
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import train_test_split
 import joblib
 
+from duplicate_index import DEFAULT_DUPLICATE_MODE, DEFAULT_SIMILARITY, duplicate_buckets
+from tab_grouping import DEFAULT_GROUP_SIMILARITY, DEFAULT_GROUPING_MODE, GROUPING_MODES, ContentGrouper
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+FEATURE_NAMES = [
+    'days_since_created',
+    'days_since_activated',
+    'activation_count',
+    'total_active_time_minutes',
+    'avg_active_time_per_visit',
+    'is_pinned',
+    'has_group',
+    'domain_frequency',
+    'hour_of_day',
+    'day_of_week'
+]
+
+# Trained model artifact (see train_tab_classifier.py); bump the version
+# whenever FEATURE_NAMES or the label scheme change
+TAB_MODEL_VERSION = 1
+DEFAULT_TAB_MODEL_PATH = os.environ.get(
+    'TABSENSE_TAB_MODEL',
+    os.path.join(os.environ.get('TABSENSE_MODEL_DIR', 'model_store'), f'tab_classifier.v{TAB_MODEL_VERSION}.joblib')
+)
+# Below this top-class probability the model defers to the user
+MODEL_REVIEW_THRESHOLD = 0.5
+MODEL_REASONS = {
+    'close': 'Similar tabs were usually closed',
+    'archive': 'Similar tabs were usually archived',
+    'keep': 'Similar tabs were usually kept',
+    'review': 'No clear usage pattern'
+}
+
+# Outcome labels mined from TabActivity logs
+ARCHIVE_IDLE_DAYS = 7
+KEEP_WINDOW_DAYS = 3
+
+# Classification rules in priority order: the first matching rule wins
+# (action, reason, confidence); tabs matching none are sent to 'review'
+CLASSIFICATION_RULES = [
+    ('keep', 'Pinned tab', 1.0),          # pinned tabs are always kept
+    ('close', 'Never used', 0.95),        # never activated and older than a day
+    ('archive', 'Not used in N days', 0.85),  # not used in 7+ days
+    ('close', 'Rarely used', 0.75),       # low activation and older than 3 days
+    ('keep', 'Frequently used', 0.9),     # many activations or long active time
+]
+DEFAULT_RULE = ('review', 'Moderate usage', 0.5)
+ARCHIVE_RULE = 2
+
+RULE_ACTIONS = np.array([r[0] for r in CLASSIFICATION_RULES + [DEFAULT_RULE]], dtype=object)
+RULE_REASONS = np.array([r[1] for r in CLASSIFICATION_RULES + [DEFAULT_RULE]], dtype=object)
+RULE_CONFIDENCE = np.array([r[2] for r in CLASSIFICATION_RULES + [DEFAULT_RULE]])
+
+
+def _epoch_ms(moment):
+    """Milliseconds since the epoch of a naive local datetime, to the microsecond"""
+    return time.mktime(moment.timetuple()) * 1000 + moment.microsecond / 1000
+
+
+class TabFrame:
+    """
+    Columnar view of a list of tab dicts: one NumPy array per field, built
+    in a single pass with one captured "now". The same pass buckets tab
+    positions by URL and by ungrouped domain for duplicates and groupings.
+    Day counts are floor((now - timestamp) / 1 day) like timedelta.days on
+    local datetimes (they differ only when a DST change lies in between)
+    """
+    def __init__(self, tab_data, now=None):
+        self.tabs = tab_data
+        self.now = now or datetime.now()
+        
+        ids = []
+        rows = []
+        self.url_buckets = {}
+        self.domain_buckets = {}
+        self.ungrouped = []
+        for i, tab in enumerate(tab_data):
+            ids.append(tab['id'])
+            group_id = tab.get('groupId', -1)
+            rows.append((
+                tab['createdAt'],
+                tab['lastActivated'],
+                tab.get('activationCount', 0),
+                tab.get('totalActiveTime', 0),
+                bool(tab.get('isPinned', False)),
+                group_id != -1,
+                tab.get('domainFrequency', 1)
+            ))
+            
+            url = tab.get('url', '')
+            if url:
+                self.url_buckets.setdefault(url, []).append(i)
+            if group_id == -1:
+                self.ungrouped.append(i)
+                domain = tab.get('domain', '')
+                if domain:
+                    self.domain_buckets.setdefault(domain, []).append(i)
+        
+        columns = np.array(rows, dtype=np.float64).reshape(len(rows), 7).T
+        self.ids = np.array(ids, dtype=object)
+        self.created_at = columns[0]
+        self.last_activated = columns[1]
+        self.activation_count = columns[2]
+        self.total_active_time = columns[3] / 60000  # minutes
+        self.is_pinned = columns[4].astype(bool)
+        self.has_group = columns[5].astype(bool)
+        self.domain_frequency = columns[6]
+        
+        # Whole microseconds, matching datetime.fromtimestamp rounding
+        now_us = round(_epoch_ms(self.now) * 1000)
+        self.days_since_created = (now_us - np.round(self.created_at * 1000)) // (MS_PER_DAY * 1000)
+        self.days_since_activated = (now_us - np.round(self.last_activated * 1000)) // (MS_PER_DAY * 1000)
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def feature_matrix(self):
+        """Features in TabClassifier.feature_names order"""
+        # Only the ML features need local wall-clock fields
+        last_activated = [datetime.fromtimestamp(ts / 1000) for ts in self.last_activated]
+        hour_of_day = np.array([dt.hour for dt in last_activated], dtype=np.float64)
+        day_of_week = np.array([dt.weekday() for dt in last_activated], dtype=np.float64)
+        
+        if len(self) == 0:
+            return np.array([])
+        
+        return np.column_stack([
+            self.days_since_created,
+            self.days_since_activated,
+            self.activation_count,
+            self.total_active_time,
+            self.total_active_time / np.maximum(self.activation_count, 1),
+            self.is_pinned.astype(np.float64),
+            self.has_group.astype(np.float64),
+            self.domain_frequency,
+            hour_of_day,
+            day_of_week
+        ])
+
+
+def rule_masks(frame):
+    """Boolean mask per CLASSIFICATION_RULES entry"""
+    return [
+        frame.is_pinned,
+        (frame.activation_count == 0) & (frame.days_since_created > 1),
+        frame.days_since_activated > 7,
+        (frame.activation_count < 3) & (frame.days_since_created > 3),
+        (frame.activation_count > 10) | (frame.total_active_time > 30),
+    ]
+
+
+class ClassificationFrame:
+    """
+    Columnar classification result; dicts are only built at the response boundary
+    """
+    def __init__(self, ids, actions, reasons, confidence):
+        self.ids = ids
+        self.actions = actions
+        self.reasons = reasons
+        self.confidence = confidence
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def count(self, action):
+        return int(np.count_nonzero(self.actions == action))
+    
+    def to_records(self):
+        return [
+            {'id': tab_id, 'action': action, 'reason': reason, 'confidence': confidence}
+            for tab_id, action, reason, confidence in zip(
+                self.ids.tolist(), self.actions.tolist(), self.reasons.tolist(), self.confidence.tolist()
+            )
+        ]
+
+
 class TabClassifier:
     """
     ML model to classify tabs for decluttering suggestions
     """
-    def __init__(self):
-        self.model = RandomForestClassifier(
-            n_estimators=100,
-            max_depth=10,
-            random_state=42
-        )
-        self.scaler = StandardScaler()
-        self.feature_names = [
-            'days_since_created',
-            'days_since_activated',
-            'activation_count',
-            'total_active_time_minutes',
-            'avg_active_time_per_visit',
-            'is_pinned',
-            'has_group',
-            'domain_frequency',
-            'hour_of_day',
-            'day_of_week'
-        ]
-        
-    def prepare_features(self, tab_data):
+    def __init__(self, model=None):
+        # Artifact from load_tab_model; None = rule-based classification
+        self.model = model
+        self.feature_names = FEATURE_NAMES
+    
+    def prepare_features(self, tab_data, now=None):
         """
         Convert tab data into ML features
         """
-        features = []
-        now = datetime.now()
+        return TabFrame(tab_data, now).feature_matrix()
+    
+    def classify_frame(self, frame):
+        """
+        Classify a TabFrame with the trained model when one is loaded,
+        falling back to the rules
+        Returns a columnar ClassificationFrame
+        """
+        if self.model is not None and len(frame):
+            try:
+                return self.classify_frame_with_model(frame)
+            except Exception as e:
+                print(f"Tab model failed, using rules: {str(e)}")
+        return self.classify_frame_with_rules(frame)
+    
+    def classify_frame_with_model(self, frame):
+        """
+        Score every tab with one batched predict_proba call
+        """
+        proba = self.model['model'].predict_proba(frame.feature_matrix())
+        best = proba.argmax(axis=1)
         
-        for tab in tab_data:
-            created_at = datetime.fromtimestamp(tab['createdAt'] / 1000)
-            last_activated = datetime.fromtimestamp(tab['lastActivated'] / 1000)
-            
-            # Time-based features
-            days_since_created = (now - created_at).days
-            days_since_activated = (now - last_activated).days
-            
-            # Activity features
-            activation_count = tab.get('activationCount', 0)
-            total_active_time = tab.get('totalActiveTime', 0) / 60000  # Convert to minutes
-            avg_active_time = total_active_time / max(activation_count, 1)
-            
-            # Tab properties
-            is_pinned = 1 if tab.get('isPinned', False) else 0
-            has_group = 1 if tab.get('groupId', -1) != -1 else 0
-            
-            # Domain frequency (would need aggregation across all tabs)
-            domain_frequency = tab.get('domainFrequency', 1)
-            
-            # Time context
-            hour_of_day = last_activated.hour
-            day_of_week = last_activated.weekday()
-            
-            features.append([
-                days_since_created,
-                days_since_activated,
-                activation_count,
-                total_active_time,
-                avg_active_time,
-                is_pinned,
-                has_group,
-                domain_frequency,
-                hour_of_day,
-                day_of_week
-            ])
-            
-        return np.array(features)
+        actions = np.asarray(self.model['model'].classes_, dtype=object)[best]
+        confidence = proba[np.arange(len(best)), best].round(2)
+        actions[confidence < MODEL_REVIEW_THRESHOLD] = 'review'
+        
+        reasons = np.empty(len(frame), dtype=object)
+        for action, reason in MODEL_REASONS.items():
+            reasons[actions == action] = reason
+        
+        # Pinned tabs are always kept, whatever the model says
+        actions[frame.is_pinned] = 'keep'
+        reasons[frame.is_pinned] = 'Pinned tab'
+        confidence[frame.is_pinned] = 1.0
+        
+        return ClassificationFrame(frame.ids, actions, reasons, confidence)
     
-    def classify_tabs(self, tab_data):
+    def classify_frame_with_rules(self, frame):
+        """
+        Apply CLASSIFICATION_RULES to a TabFrame with vectorized masks
+        """
+        # Index of the first matching rule per tab, len(rules) = default 'review'
+        rule = np.select(rule_masks(frame), np.arange(len(CLASSIFICATION_RULES)),
+                         default=len(CLASSIFICATION_RULES))
+        
+        actions = RULE_ACTIONS[rule]
+        reasons = RULE_REASONS[rule]
+        confidence = RULE_CONFIDENCE[rule]
+        
+        # The archive reason carries the number of idle days
+        archive = rule == ARCHIVE_RULE
+        if archive.any():
+            days = frame.days_since_activated[archive].astype(np.int64).astype(str)
+            reasons[archive] = np.char.add(np.char.add('Not used in ', days), ' days').astype(object)
+        
+        return ClassificationFrame(frame.ids, actions, reasons, confidence)
+    
+    def classify_tabs(self, tab_data, now=None):
         """
         Classify tabs into categories:
         - keep: Important, frequently used
@@ -84,97 +259,31 @@ class TabClassifier:
         - review: Needs user review
         - archive: Bookmark and close
         """
-        features = self.prepare_features(tab_data)
-        
-        # Rule-based classification (can be replaced with trained model)
-        classifications = []
-        
-        for i, tab in enumerate(tab_data):
-            feat = features[i]
-            
-            # Pinned tabs are always kept
-            if feat[5] == 1:  # is_pinned
-                classifications.append({
-                    'id': tab['id'],
-                    'action': 'keep',
-                    'reason': 'Pinned tab',
-                    'confidence': 1.0
-                })
-                continue
-            
-            # Never activated and old = close
-            if feat[2] == 0 and feat[0] > 1:  # activation_count == 0 and days_since_created > 1
-                classifications.append({
-                    'id': tab['id'],
-                    'action': 'close',
-                    'reason': 'Never used',
-                    'confidence': 0.95
-                })
-                continue
-            
-            # Not used in 7+ days = archive
-            if feat[1] > 7:  # days_since_activated > 7
-                classifications.append({
-                    'id': tab['id'],
-                    'action': 'archive',
-                    'reason': f'Not used in {int(feat[1])} days',
-                    'confidence': 0.85
-                })
-                continue
-            
-            # Low activation and old = close
-            if feat[2] < 3 and feat[0] > 3:
-                classifications.append({
-                    'id': tab['id'],
-                    'action': 'close',
-                    'reason': 'Rarely used',
-                    'confidence': 0.75
-                })
-                continue
-            
-            # Frequently used = keep
-            if feat[2] > 10 or feat[3] > 30:  # Many activations or long active time
-                classifications.append({
-                    'id': tab['id'],
-                    'action': 'keep',
-                    'reason': 'Frequently used',
-                    'confidence': 0.9
-                })
-                continue
-            
-            # Default = review
-            classifications.append({
-                'id': tab['id'],
-                'action': 'review',
-                'reason': 'Moderate usage',
-                'confidence': 0.5
-            })
-        
-        return classifications
+        return self.classify_frame(TabFrame(tab_data, now)).to_records()
     
-    def find_duplicates(self, tab_data):
+    def find_duplicates(self, tab_data, mode=DEFAULT_DUPLICATE_MODE, threshold=DEFAULT_SIMILARITY):
         """
         Find duplicate tabs by URL
+        mode: 'exact' URLs, 'canonical' URLs (see duplicate_index.canonical_url)
+        or 'near' duplicates with path/title similarity >= threshold
+        """
+        return self.duplicates_from_buckets(tab_data, duplicate_buckets(tab_data, mode, threshold))
+    
+    def duplicates_from_buckets(self, tab_data, buckets):
+        """
+        Duplicate suggestions from {key: [tab position, ...]}
         """
-        url_map = {}
         duplicates = []
-        
-        for tab in tab_data:
-            url = tab.get('url', '')
-            if url:
-                if url not in url_map:
-                    url_map[url] = []
-                url_map[url].append(tab)
-        
-        for url, tabs in url_map.items():
-            if len(tabs) > 1:
+        for positions in buckets.values():
+            if len(positions) > 1:
                 # Keep the most recently activated, suggest closing others
-                sorted_tabs = sorted(tabs, key=lambda t: t.get('lastActivated', 0), reverse=True)
+                sorted_tabs = sorted((tab_data[i] for i in positions),
+                                     key=lambda t: t.get('lastActivated', 0), reverse=True)
                 keep_tab = sorted_tabs[0]
                 close_tabs = sorted_tabs[1:]
                 
                 duplicates.append({
-                    'url': url,
+                    'url': keep_tab.get('url', ''),
                     'keep': {
                         'id': keep_tab['id'],
                         'title': keep_tab.get('title', ''),
@@ -190,33 +299,68 @@ class TabClassifier:
         
         return duplicates
     
-    def suggest_groups(self, tab_data):
+    def suggest_groups(self, tab_data, mode=DEFAULT_GROUPING_MODE, threshold=DEFAULT_GROUP_SIMILARITY):
         """
-        Suggest tab groupings based on domain and usage patterns
+        Suggest tab groupings
+        mode: 'content' clusters tabs by title, path and site similarity
+        (see tab_grouping.py), 'domain' groups tabs of the same domain
         """
+        if mode not in GROUPING_MODES:
+            raise ValueError(f"Unknown grouping mode '{mode}', expected one of {', '.join(GROUPING_MODES)}")
+        
         domain_groups = {}
+        ungrouped = []
+        for i, tab in enumerate(tab_data):
+            if tab.get('groupId', -1) == -1:  # Not already grouped
+                ungrouped.append(i)
+                domain = tab.get('domain', '')
+                if domain:
+                    domain_groups.setdefault(domain, []).append(i)
         
-        for tab in tab_data:
-            domain = tab.get('domain', '')
-            if domain and tab.get('groupId', -1) == -1:  # Not already grouped
-                if domain not in domain_groups:
-                    domain_groups[domain] = []
-                domain_groups[domain].append(tab)
+        if mode == 'content':
+            return self.content_groups(tab_data, ungrouped, threshold)
+        return self.groups_from_buckets(tab_data, domain_groups)
+    
+    def content_groups(self, tab_data, positions, threshold=DEFAULT_GROUP_SIMILARITY):
+        """
+        Grouping suggestions from clustering the ungrouped tab positions
+        """
+        suggestions = []
+        for group in ContentGrouper(threshold).groups(tab_data, positions):
+            suggestions.append({
+                'domain': group['domain'],
+                'name': self._content_group_name(group['domain'], group['terms']),
+                'terms': group['terms'],
+                'tabs': [
+                    {
+                        'id': tab_data[i]['id'],
+                        'title': tab_data[i].get('title', ''),
+                        'url': tab_data[i].get('url', '')
+                    } for i in group['positions']
+                ],
+                'count': len(group['positions'])
+            })
         
+        return sorted(suggestions, key=lambda x: x['count'], reverse=True)
+    
+    def groups_from_buckets(self, tab_data, domain_buckets):
+        """
+        Grouping suggestions from {domain: [ungrouped tab position, ...]}
+        """
         suggestions = []
-        for domain, tabs in domain_groups.items():
-            if len(tabs) >= 3:  # Only suggest grouping for 3+ tabs
+        for domain, positions in domain_buckets.items():
+            if len(positions) >= 3:  # Only suggest grouping for 3+ tabs
                 suggestions.append({
                     'domain': domain,
                     'name': self._generate_group_name(domain),
                     'tabs': [
                         {
-                            'id': t['id'],
-                            'title': t.get('title', ''),
-                            'url': t.get('url', '')
-                        } for t in tabs
+                            'id': tab_data[i]['id'],
+                            'title': tab_data[i].get('title', ''),
+                            'url': tab_data[i].get('url', '')
+                        } for i in positions
                     ],
-                    'count': len(tabs)
+                    'count': len(positions)
                 })
         
         return sorted(suggestions, key=lambda x: x['count'], reverse=True)
@@ -241,19 +385,44 @@ class TabClassifier:
             # Capitalize first letter
             return name.capitalize()
     
-    def calculate_tab_health_score(self, tab_data):
+    def _content_group_name(self, domain, terms):
+        """
+        Group name from the cluster's top terms, prefixed with the site
+        when most of its tabs come from one domain
+        """
+        topic = ' '.join(terms).title()
+        site = self._generate_group_name(domain) if domain else ''
+        if site and topic:
+            return f"{site}: {topic}"
+        return site or topic or 'Related tabs'
+    
+    def calculate_tab_health_score(self, tab_data, now=None):
         """
         Calculate overall tab health score (0-100)
         Lower score = needs decluttering
         """
-        total_tabs = len(tab_data)
-        if total_tabs == 0:
-            return 100
+        now = now or datetime.now()
         
         # Factors that decrease health score
         never_used = sum(1 for t in tab_data if t.get('activationCount', 0) == 0)
-        old_tabs = sum(1 for t in tab_data if self._days_old(t.get('createdAt', 0)) > 7)
-        inactive_tabs = sum(1 for t in tab_data if self._days_old(t.get('lastActivated', 0)) > 3)
+        old_tabs = sum(1 for t in tab_data if self._days_old(t.get('createdAt', 0), now) > 7)
+        inactive_tabs = sum(1 for t in tab_data if self._days_old(t.get('lastActivated', 0), now) > 3)
+        
+        return self._health_score(len(tab_data), never_used, old_tabs, inactive_tabs)
+    
+    def health_score_from_frame(self, frame):
+        """
+        Health score from the TabFrame columns (timestamps of 0 count as new)
+        """
+        never_used = np.count_nonzero(frame.activation_count == 0)
+        old_tabs = np.count_nonzero((frame.created_at != 0) & (frame.days_since_created > 7))
+        inactive_tabs = np.count_nonzero((frame.last_activated != 0) & (frame.days_since_activated > 3))
+        
+        return self._health_score(len(frame), int(never_used), int(old_tabs), int(inactive_tabs))
+    
+    def _health_score(self, total_tabs, never_used, old_tabs, inactive_tabs):
+        if total_tabs == 0:
+            return 100
         
         # Calculate penalties
         never_used_penalty = (never_used / total_tabs) * 30
@@ -266,50 +435,209 @@ class TabClassifier:
         
         return max(0, min(100, score))
     
-    def _days_old(self, timestamp_ms):
+    def _days_old(self, timestamp_ms, now=None):
         """
         Calculate days since timestamp
         """
         if timestamp_ms == 0:
             return 0
         then = datetime.fromtimestamp(timestamp_ms / 1000)
-        now = datetime.now()
-        return (now - then).days
+        return ((now or datetime.now()) - then).days
+
+
+def parse_activity_time(timestamp):
+    """Local naive datetime of a TabActivity ISO timestamp ('...Z')"""
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).astimezone().replace(tzinfo=None)
+
+
+def legacy_activity_entries(activity):
+    """
+    Flatten the legacy TabActivity activity map into [(keys, event)]
+    The extension wrote events with updateDoc({[`activity.${iso}`]: event}),
+    which Firestore splits at the '.' before the milliseconds, so entries are
+    stored nested as {'2024-01-15T10:05:00': {'123Z': event}}; only a
+    document's first event (written with setDoc) is flat. keys is the entry's
+    path in the map and each event's 'timestamp' is joined back from it.
+    Entries without a tabId and an action are not tab events and are left out.
+    """
+    entries = []
+    for key, value in activity.items():
+        if not isinstance(value, dict):
+            continue
+        if 'tabId' in value or 'action' in value:
+            candidates = [((key,), value)]
+        else:
+            candidates = [((key, suffix), event) for suffix, event in value.items()]
+        for keys, event in candidates:
+            if isinstance(event, dict) and event.get('tabId') is not None and event.get('action'):
+                entries.append((keys, {**event, 'timestamp': '.'.join(keys)}))
+    return entries
+
+
+def tab_outcomes(activity):
+    """
+    Labelled examples from TabActivity events: the legacy activity map as
+    stored (see legacy_activity_entries) or a sequence of events with a
+    'timestamp' field (ActivityStore.iter_events)
+    Chrome reuses tab ids across browser sessions, so a tab is its id plus
+    its createdAt; an event without createdAt belongs to the latest tab with
+    its id. The last event of each tab decides what the user did with it:
+    - closed after ARCHIVE_IDLE_DAYS+ idle days: 'archive'
+    - closed otherwise: 'close'
+    - still open and used within KEEP_WINDOW_DAYS of the log's end: 'keep'
+    Open tabs idle for longer have no known outcome yet and are skipped.
+    Returns [(tab snapshot, snapshot time, outcome)]
+    """
+    if isinstance(activity, dict):
+        timed = [(event['timestamp'], event) for _, event in legacy_activity_entries(activity)]
+    else:
+        timed = [(event['timestamp'], event) for event in activity]
+    if not timed:
+        return []
+    
+    last_events = {}
+    created = {}  # tab id -> createdAt of the latest tab with that id
+    for timestamp, event in sorted(timed, key=lambda item: item[0]):
+        tab_id = event.get('tabId', event.get('id'))
+        if 'createdAt' in event:
+            created[tab_id] = event['createdAt']
+        last_events[(tab_id, created.get(tab_id))] = (timestamp, event)
+    end = parse_activity_time(max(timestamp for timestamp, _ in timed))
+    end_ms = _epoch_ms(end)
+    
+    examples = []
+    for timestamp, event in last_events.values():
+        if 'createdAt' not in event or 'lastActivated' not in event:
+            continue
+        if event.get('action') == 'closed':
+            at = parse_activity_time(timestamp)
+            idle_days = (_epoch_ms(at) - event['lastActivated']) / MS_PER_DAY
+            examples.append((event, at, 'archive' if idle_days >= ARCHIVE_IDLE_DAYS else 'close'))
+        elif end_ms - event['lastActivated'] <= KEEP_WINDOW_DAYS * MS_PER_DAY:
+            examples.append((event, end, 'keep'))
+    
+    return examples
+
+
+def outcome_features(examples):
+    """Feature matrix and labels for tab_outcomes examples"""
+    if not examples:
+        return np.empty((0, len(FEATURE_NAMES))), np.array([], dtype=object)
+    # Each snapshot is featurized at its own "now"
+    features = np.vstack([TabFrame([tab], at).feature_matrix() for tab, at, _ in examples])
+    return features, np.array([outcome for _, _, outcome in examples], dtype=object)
+
+
+def train_tab_model(features, outcomes):
+    """
+    Fit the tab classifier and wrap it in a versioned artifact
+    Accuracy is measured on a 20% holdout before refitting on everything
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import train_test_split
+    
+    def new_model():
+        return RandomForestClassifier(
+            n_estimators=100,
+            max_depth=10,
+            class_weight='balanced',
+            random_state=42
+        )
+    
+    holdout_accuracy = None
+    if len(outcomes) >= 10 and len(set(outcomes)) > 1:
+        X_train, X_test, y_train, y_test = train_test_split(
+            features, outcomes, test_size=0.2, random_state=42
+        )
+        holdout_accuracy = float(new_model().fit(X_train, y_train).score(X_test, y_test))
+    
+    model = new_model().fit(features, outcomes)
+    return {
+        'version': TAB_MODEL_VERSION,
+        'feature_names': FEATURE_NAMES,
+        'model': model,
+        'classes': [str(c) for c in model.classes_],
+        'samples': int(len(outcomes)),
+        'holdout_accuracy': holdout_accuracy,
+        'trained_at': datetime.now().isoformat()
+    }
+
+
+def save_tab_model(artifact, path=DEFAULT_TAB_MODEL_PATH):
+    """Write the artifact atomically, uncompressed so workers can memory-map it"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    joblib.dump(artifact, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_tab_model(path=DEFAULT_TAB_MODEL_PATH, mmap_mode='r'):
+    """
+    Load the tab model artifact once per worker, memory-mapping its arrays
+    read-only (scikit-learn copies tree nodes while unpickling, so workers
+    only share the forest when it is loaded before they fork)
+    Returns None (rule-based classification) when there is no usable artifact
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        artifact = joblib.load(path, mmap_mode=mmap_mode)
+    except Exception as e:
+        print(f"Could not load tab model {path}: {str(e)}")
+        return None
+    
+    if artifact.get('version') != TAB_MODEL_VERSION or artifact.get('feature_names') != FEATURE_NAMES:
+        print(f"Ignoring tab model {path}: artifact version {artifact.get('version')}, expected {TAB_MODEL_VERSION}")
+        return None
+    
+    print(f"Loaded tab model {path} ({artifact['samples']} samples, holdout accuracy {artifact['holdout_accuracy']})")
+    return artifact
 
 
-def analyze_tabs(tab_data):
+def analyze_tabs(tab_data, now=None, model=None, duplicate_mode=DEFAULT_DUPLICATE_MODE,
+                 similarity=DEFAULT_SIMILARITY, grouping_mode=DEFAULT_GROUPING_MODE,
+                 group_similarity=DEFAULT_GROUP_SIMILARITY):
     """
     Main function to analyze tabs and provide suggestions
+    The tab list is normalized into a TabFrame once (one sweep, one "now");
+    classifications, duplicates, groupings, health score and summary counts
+    are all derived from its columns and buckets
     """
-    classifier = TabClassifier()
+    classifier = TabClassifier(model)
+    frame = TabFrame(tab_data, now)
     
     # Classify all tabs
-    classifications = classifier.classify_tabs(tab_data)
+    classified = classifier.classify_frame(frame)
     
     # Find duplicates
-    duplicates = classifier.find_duplicates(tab_data)
+    buckets = duplicate_buckets(tab_data, duplicate_mode, similarity, url_buckets=frame.url_buckets)
+    duplicates = classifier.duplicates_from_buckets(tab_data, buckets)
     
     # Suggest groups
-    group_suggestions = classifier.suggest_groups(tab_data)
+    if grouping_mode == 'content':
+        group_suggestions = classifier.content_groups(tab_data, frame.ungrouped, group_similarity)
+    else:
+        group_suggestions = classifier.groups_from_buckets(tab_data, frame.domain_buckets)
     
     # Calculate health score
-    health_score = classifier.calculate_tab_health_score(tab_data)
+    health_score = classifier.health_score_from_frame(frame)
     
     # Compile results
     results = {
         'health_score': health_score,
         'total_tabs': len(tab_data),
-        'classifications': classifications,
+        'classifications': classified.to_records(),
         'duplicates': duplicates,
         'group_suggestions': group_suggestions,
         'summary': {
-            'to_close': len([c for c in classifications if c['action'] == 'close']),
-            'to_archive': len([c for c in classifications if c['action'] == 'archive']),
-            'to_keep': len([c for c in classifications if c['action'] == 'keep']),
-            'to_review': len([c for c in classifications if c['action'] == 'review']),
-            'duplicate_tabs': sum(len(d['close']) for d in duplicates),
+            'to_close': classified.count('close'),
+            'to_archive': classified.count('archive'),
+            'to_keep': classified.count('keep'),
+            'to_review': classified.count('review'),
+            'duplicate_tabs': sum(len(positions) - 1 for positions in buckets.values()),
             'grouping_opportunities': len(group_suggestions)
         }
     }
     
-    return results
\ No newline at end of file
+    return results
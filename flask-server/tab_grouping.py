@@ -0,0 +1,228 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+
+from duplicate_index import canonical_url, split_canonical
+
+GROUPING_MODES = ('content', 'domain')
+DEFAULT_GROUPING_MODE = 'content'
+# Cosine similarity above which two tabs are linked
+DEFAULT_GROUP_SIMILARITY = 0.35
+MIN_GROUP_SIZE = 3
+
+TOKEN_PATTERN = re.compile(r'[a-z][a-z0-9]+')
+URL_STOP_WORDS = {'www', 'com', 'org', 'net', 'html', 'htm', 'php', 'index', 'https', 'http'}
+TWO_PART_TLDS = {'co.uk', 'co.jp', 'co.in', 'com.au', 'com.br'}
+SITE_PREFIX = 'site:'
+
+
+def registrable_domain(host):
+    """Base domain of a host (docs.github.com -> github.com), like extractDomain in the extension"""
+    parts = host.split(':')[0].split('.')
+    if len(parts) > 2:
+        if '.'.join(parts[-2:]) in TWO_PART_TLDS:
+            return '.'.join(parts[-3:])
+        return '.'.join(parts[-2:])
+    return '.'.join(parts)
+
+
+@lru_cache(maxsize=1)
+def stop_words():
+    """scikit-learn's English stop words plus URL noise, imported on first use"""
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+    return ENGLISH_STOP_WORDS | URL_STOP_WORDS
+
+
+def group_tokens(tab):
+    """Title words, URL path words and the registrable domain of a tab"""
+    host, path = split_canonical(canonical_url(tab.get('url', '')))
+    domain = tab.get('domain') or registrable_domain(host)
+    words = TOKEN_PATTERN.findall(f"{tab.get('title', '')} {path}".lower())
+    excluded = stop_words()
+    tokens = [w for w in words if w not in excluded]
+    if domain:
+        tokens.append(SITE_PREFIX + domain)
+    return tokens
+
+
+def split_postings(X, max_postings, seed=0):
+    """
+    Split every column of X found in more than max_postings rows into
+    columns of at most max_postings random rows each
+    Row norms are unchanged; the product of the result with its transpose
+    then has at most max_postings entries per row and column pair, and two
+    rows only score the shared tokens that landed in the same bucket.
+    """
+    from scipy.sparse import csr_matrix
+
+    X = X.tocsc()
+    df = np.diff(X.indptr)
+    if df.max(initial=0) <= max_postings:
+        return X.tocsr()
+    columns = np.repeat(np.arange(X.shape[1]), df)
+    # Rank each entry within its column in random order
+    order = np.lexsort((np.random.default_rng(seed).random(len(columns)), columns))
+    rank = np.empty(len(columns), dtype=np.int64)
+    rank[order] = np.arange(len(columns)) - X.indptr[columns[order]]
+    buckets = (df + max_postings - 1) // max_postings
+    first_bucket = np.cumsum(buckets) - buckets
+    return csr_matrix((X.data, (X.indices, first_bucket[columns] + rank // max_postings)),
+                      shape=(X.shape[0], int(buckets.sum())))
+
+
+class ContentGrouper:
+    """
+    Groups tabs by what they are about rather than by domain equality
+    Tabs become sublinear TF-IDF vectors over title words, URL path words
+    and a site token. One sparse X @ X.T product gives pairwise cosine
+    similarities; each tab keeps its `neighbors` most similar tabs at or
+    above `threshold`, and the connected components of the mutual-neighbor
+    graph are the candidate groups (plain threshold components chain
+    unrelated topics through shared filler words). A token shared by m tabs
+    adds about m^2 entries to that product, so the most widespread tokens
+    are dropped until the total fits `max_pairs`; together with ignoring
+    tokens found in over half of the tabs, this stops ubiquitous words from
+    chaining unrelated tabs. The remaining tokens are split into random
+    buckets of `max_postings` tabs (split_postings) before the product, so
+    a tab is compared with at most max_postings tabs per token: enough to
+    find its neighbors, and the product stays sparse when a few large
+    topics share every word. Members that end up far from their group's
+    centroid are dropped, and fragments of one topic are merged by centroid.
+    Groups are named after the highest-weighted terms of their centroid.
+    """
+    def __init__(self, threshold=DEFAULT_GROUP_SIMILARITY, min_size=MIN_GROUP_SIZE, neighbors=10,
+                 max_pairs=4_000_000, max_postings=128):
+        self.threshold = threshold
+        self.min_size = min_size
+        self.neighbors = neighbors
+        self.max_pairs = max_pairs
+        self.max_postings = max_postings
+
+    def groups(self, tab_data, positions=None):
+        """
+        Cluster tab_data[positions] (default: all tabs)
+        Returns [{'positions': [...], 'domain': dominant domain or '',
+                  'terms': [top terms]}] with min_size+ members each
+        """
+        from scipy.sparse.csgraph import connected_components
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.preprocessing import normalize
+
+        positions = list(range(len(tab_data))) if positions is None else list(positions)
+        if len(positions) < self.min_size:
+            return []
+
+        docs = [group_tokens(tab_data[i]) for i in positions]
+        # Small sessions have no meaningful document frequency cut-off
+        max_df = 0.5 if len(docs) >= 20 else 1.0
+        vectorizer = TfidfVectorizer(analyzer=lambda doc: doc, sublinear_tf=True, min_df=2, max_df=max_df)
+        try:
+            X = vectorizer.fit_transform(docs)
+        except ValueError:
+            # No token is shared by two tabs
+            return []
+        terms = vectorizer.get_feature_names_out()
+        
+        df = X.getnnz(axis=0).astype(np.int64)
+        if (df ** 2).sum() > self.max_pairs:
+            by_df = np.argsort(df, kind='stable')
+            keep = by_df[np.cumsum(df[by_df] ** 2) <= self.max_pairs]
+            X = normalize(X[:, np.sort(keep)])
+            terms = terms[np.sort(keep)]
+
+        X = X.tocsr()
+        buckets = split_postings(X, self.max_postings)
+        similarity = buckets @ buckets.T.tocsr()
+        _, labels = connected_components(self._mutual_neighbors(similarity), directed=False)
+
+        return [self._describe(tab_data, [positions[m] for m in members], centroid, terms)
+                for members, centroid in self._merge_fragments(self._clusters(X, labels))]
+
+    def _clusters(self, X, labels):
+        """
+        (members, centroid) of the components with min_size+ members that
+        are cohesive enough, computed for all components at once
+        """
+        from scipy.sparse import csr_matrix, diags
+
+        sizes = np.bincount(labels)
+        rows = np.flatnonzero(sizes[labels] >= self.min_size)
+        if len(rows) == 0:
+            return []
+        components, component = np.unique(labels[rows], return_inverse=True)
+        averaging = csr_matrix((1.0 / sizes[labels[rows]], (component, rows)),
+                               shape=(len(components), X.shape[0]))
+        centroids = (averaging @ X).tocsr()
+        norms = np.sqrt(np.asarray(centroids.multiply(centroids).sum(axis=1)).ravel())
+        unit = diags(np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)) @ centroids
+        cohesion = np.asarray(X[rows].multiply(unit[component]).sum(axis=1)).ravel()
+
+        kept = cohesion >= self.threshold / 2
+        rows, component = rows[kept], component[kept]
+        order = np.argsort(component, kind='stable')
+        boundaries = np.flatnonzero(np.diff(component[order])) + 1
+        clusters = []
+        for members in np.split(order, boundaries):
+            if len(members) >= self.min_size:
+                clusters.append((rows[members], centroids[component[members[0]]].toarray().ravel()))
+        return clusters
+
+    def _mutual_neighbors(self, similarity):
+        """
+        Links between tabs that are among each other's `neighbors` most
+        similar tabs (and at least `threshold` similar)
+        similarity is symmetric, so a link (i, j) is mutual when its value
+        reaches both row i's and row j's k-th largest value
+        """
+        similarity.data[similarity.data < self.threshold] = 0
+        similarity.eliminate_zeros()
+
+        indptr, indices, data = similarity.indptr, similarity.indices, similarity.data
+        rows = np.repeat(np.arange(similarity.shape[0]), np.diff(indptr))
+        data[rows == indices] = 0
+
+        cutoff = np.full(similarity.shape[0], self.threshold)
+        for row in np.flatnonzero(np.diff(indptr) > self.neighbors):
+            values = data[indptr[row]:indptr[row + 1]]
+            cutoff[row] = max(cutoff[row], np.partition(values, -self.neighbors)[-self.neighbors])
+
+        data[data < np.maximum(cutoff[rows], cutoff[indices])] = 0
+        similarity.eliminate_zeros()
+        return similarity
+
+    def _merge_fragments(self, clusters):
+        """
+        Join clusters whose centroids are at least `threshold` similar;
+        large topics can split when their common tokens were dropped for
+        the max_pairs budget
+        """
+        from scipy.sparse.csgraph import connected_components
+
+        if len(clusters) < 2:
+            return clusters
+        centroids = np.vstack([centroid for _, centroid in clusters])
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+        _, labels = connected_components(centroids @ centroids.T >= max(self.threshold, 0.5), directed=False)
+
+        merged = {}
+        for label, (members, centroid) in zip(labels, clusters):
+            if label in merged:
+                previous, previous_centroid = merged[label]
+                weight = len(previous) + len(members)
+                merged[label] = (np.concatenate([previous, members]),
+                                 (previous_centroid * len(previous) + centroid * len(members)) / weight)
+            else:
+                merged[label] = (members, centroid)
+        return list(merged.values())
+
+    def _describe(self, tab_data, members, centroid, terms):
+        domains = [tab_data[i].get('domain', '') for i in members]
+        dominant = max(set(domains), key=domains.count)
+        top_terms = [terms[j] for j in np.argsort(-centroid)[:6]
+                     if centroid[j] > 0 and not terms[j].startswith(SITE_PREFIX)][:2]
+        return {
+            'positions': sorted(members),
+            'domain': dominant if dominant and domains.count(dominant) >= 0.6 * len(domains) else '',
+            'terms': top_terms
+        }
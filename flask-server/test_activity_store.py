@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Tests for the batched tab activity ingest and its retention
+
+The ActivityStore tests need the Firestore emulator, e.g.:
+    firebase emulators:start --only firestore
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m pytest test_activity_store.py
+"""
+
+import os
+import uuid
+from datetime import datetime
+
+import pytest
+
+from activity_store import (MAX_EVENTS_PER_DOC, ActivityStore, coalesce_events, event_record,
+                            summarize_events)
+from stats_aggregates import StatsStore, summarize_tabs
+
+emulator = pytest.mark.skipif(
+    not os.environ.get('FIRESTORE_EMULATOR_HOST'),
+    reason='FIRESTORE_EMULATOR_HOST is not set'
+)
+
+def tab_event(tab_id, action, second, **tab):
+    return {'tabId': tab_id, 'action': action, 'timestamp': f'2024-01-15T10:00:{second:02d}.000Z',
+            'tab': {'id': tab_id, 'status': 'normal', **tab}}
+
+def test_coalesce_events_per_tab():
+    events = [
+        tab_event(1, 'created', 0),
+        tab_event(2, 'created', 1),
+        tab_event(1, 'activated', 2, isActive=True),
+        tab_event(1, 'activated', 4, isActive=True),
+        tab_event(2, 'closed', 3),
+    ]
+    records = {r['tabId']: r for r in coalesce_events(events)}
+
+    assert records[1]['actions'] == {'created': 1, 'activated': 2}
+    assert records[1]['first'] == events[0]['timestamp'] and records[1]['timestamp'] == events[3]['timestamp']
+    assert records[1]['tab']['isActive'] and records[1]['action'] == 'activated'
+    assert records[2]['action'] == 'closed'
+
+    # Already coalesced client batches merge the same way
+    again = coalesce_events([{**records[1], 'timestamp': records[1]['timestamp']}, tab_event(1, 'updated', 5)])
+    assert again[0]['actions'] == {'created': 1, 'activated': 2, 'updated': 1}
+
+def test_summarize_events_keeps_last_event_per_tab():
+    events = [event_record(r) for r in coalesce_events([tab_event(1, 'created', 0, createdAt=1),
+                                                        tab_event(1, 'activated', 2, createdAt=1)])]
+    legacy = {'tabId': 2, 'action': 'closed', 'timestamp': '2024-01-15T10:00:05.000Z', 'url': 'https://a.com/'}
+    daily = summarize_events({'day': '2024-01-15'}, events + [legacy])
+    # Folding more events into the stored summary adds to it
+    daily = summarize_events(daily, [{**legacy, 'tabId': 1, 'timestamp': '2024-01-15T10:00:01.000Z'}])
+
+    assert daily['events'] == 3
+    assert daily['actions'] == {'created': 1, 'activated': 1, 'closed': 2}
+    assert daily['tabs']['1']['actions'] == {'created': 1, 'activated': 1, 'closed': 1}
+    assert daily['tabs']['1']['event']['action'] == 'activated' and daily['tabs']['1']['event']['createdAt'] == 1
+    assert daily['tabs']['1']['first'] == '2024-01-15T10:00:00.000Z'
+    # Only the fields needed to featurize the tab are kept
+    assert 'url' not in daily['tabs']['2']['event'] and daily['tabs']['2']['last'] == legacy['timestamp']
+
+@pytest.fixture
+def store():
+    from google.cloud import firestore
+    db = firestore.Client(project='tabsense-test')
+    collection = f'TabActivity-{uuid.uuid4().hex}'
+    stats_store = StatsStore(db)
+    stats_store.tabs_ref = lambda email: db.collection(collection).document(email).collection('aggregates').document('tabs')
+    return ActivityStore(db, stats_store, collection=collection)
+
+@emulator
+def test_ingest_partitions_events_and_counts_tabs(store):
+    events = [tab_event(i, 'created', i % 60, isPinned=i % 5 == 0) for i in range(MAX_EVENTS_PER_DOC + 10)]
+    events += [tab_event(3, 'closed', 59)]
+    assert store.ingest('user@example.com', events) == {'events': MAX_EVENTS_PER_DOC + 10, 'documents': 2}
+
+    tabs = store.user_ref('user@example.com').get().to_dict()['tabs']
+    assert '3' not in tabs and len(tabs) == MAX_EVENTS_PER_DOC + 9
+    assert store.stats_store.tab_summary('user@example.com') == summarize_tabs(tabs)
+    assert len(list(store.iter_events('user@example.com', since='2024-01-15'))) == MAX_EVENTS_PER_DOC + 10
+
+@emulator
+def test_first_ingest_counts_existing_tabs(store):
+    store.user_ref('user@example.com').set({'tabs': {'7': {'id': 7, 'status': 'forgotten'}}})
+    store.ingest('user@example.com', [tab_event(8, 'created', 0)])
+    assert store.stats_store.tab_summary('user@example.com')['totalTabs'] == 2
+
+@emulator
+def test_retention_compacts_old_events(store):
+    email = 'user@example.com'
+    store.ingest(email, [tab_event(i, 'created', i) for i in range(5)])
+    store.ingest(email, [{**tab_event(9, 'created', 0), 'timestamp': '2024-03-01T10:00:00.000Z'}])
+    # The old extension wrote updateDoc({[`activity.${iso}`]: event}): the
+    # path splits at the millisecond dot, nesting entries under the seconds
+    for iso, event in [('2024-01-14T09:00:00.000Z', {'tabId': 7, 'action': 'created', 'createdAt': 1}),
+                       ('2024-01-14T09:00:00.250Z', {'tabId': 7, 'action': 'closed', 'createdAt': 1,
+                                                     'lastActivated': 1}),
+                       ('2024-01-14T09:00:00.500Z', {'tabId': 8})]:
+        store.user_ref(email).update({f'activity.{iso}': {**event, 'timestamp': iso}})
+
+    now = datetime(2024, 3, 2)
+    assert store.apply_retention(email, raw_days=30, now=now) == {'compacted': 7, 'expired': 0}
+    # Re-running finds nothing left to compact
+    assert store.apply_retention(email, raw_days=30, now=now) == {'compacted': 0, 'expired': 0}
+
+    # The entry that isn't a tab event is kept rather than deleted unsummarized
+    assert store.legacy_activity(email) == {'2024-01-14T09:00:00': {
+        '500Z': {'tabId': 8, 'timestamp': '2024-01-14T09:00:00.500Z'}}}
+    assert [e['tabId'] for e in store.iter_events(email)] == [9]
+    days = {s.id: s.to_dict() for s in store.daily_ref(email).stream()}
+    assert days['2024-01-15']['events'] == 5 and days['2024-01-14']['events'] == 2
+    assert days['2024-01-14']['tabs']['7']['actions'] == {'created': 1, 'closed': 1}
+    assert days['2024-01-14']['tabs']['7']['event']['action'] == 'closed'
+    assert len(list(store.iter_summarized_events(email))) == 6
+    # Open-tab state is untouched
+    assert len(store.user_ref(email).get(field_paths=['tabs']).to_dict()['tabs']) == 6
+
+    assert store.apply_retention(email, summary_days=30, now=now)['expired'] == 2
+
+if __name__ == "__main__":
+    test_coalesce_events_per_tab()
+    test_summarize_events_keeps_last_event_per_tab()
+    print("Activity store tests passed")
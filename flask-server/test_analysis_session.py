@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Tests for incremental analysis sessions (/analyze/delta)
+"""
+
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+import pytest
+
+import analysis_session
+from analysis_session import AnalysisSession, AnalysisSessions, SessionConflict, SessionLog
+from server import create_app, shutdown_app
+from tab_classifier import analyze_tabs
+from test_tab_classifier import generate_tabs
+
+NOW = datetime(2024, 6, 1, 12, 0)
+NOW_MS = NOW.timestamp() * 1000
+
+def apply_delta(state, delta):
+    """Client side of the protocol: fold a delta response into the full analysis"""
+    for field, key in (('classifications', 'id'), ('duplicates', 'key'), ('group_suggestions', 'key')):
+        entries = state.setdefault(field, {})
+        for removed in delta[field]['removed']:
+            del entries[removed]
+        for entry in delta[field]['changed']:
+            entries[entry[key]] = entry
+    for field in ('health_score', 'total_tabs', 'summary'):
+        state[field] = delta[field]
+    return state
+
+def assert_matches_full_analysis(state, tabs, **options):
+    full = analyze_tabs(tabs, now=NOW, **options)
+    assert state['total_tabs'] == full['total_tabs']
+    assert state['health_score'] == pytest.approx(full['health_score'])
+    assert state['summary'] == full['summary']
+    assert state['classifications'] == {record['id']: record for record in full['classifications']}
+
+    def without_keys(entries):
+        return sorted((str({k: v for k, v in entry.items() if k != 'key'}) for entry in entries))
+    assert without_keys(state['duplicates'].values()) == without_keys(full['duplicates'])
+    assert without_keys(state['group_suggestions'].values()) == without_keys(full['group_suggestions'])
+
+def churn(rng, tabs, next_id):
+    """Randomly change, open and close a few tabs; returns (tabs, upserts, removed ids)"""
+    by_id = {tab['id']: tab for tab in tabs}
+    removed = [int(i) for i in rng.choice(list(by_id), size=3, replace=False)]
+    for tab_id in removed:
+        del by_id[tab_id]
+    upserts = []
+    for tab_id in rng.choice(list(by_id), size=4, replace=False):
+        tab = dict(by_id[int(tab_id)], lastActivated=NOW_MS - rng.uniform(0, 5) * 86400000,
+                   activationCount=int(rng.integers(0, 20)))
+        if rng.random() < 0.5:
+            tab['url'] = f"https://site{int(rng.integers(0, 8))}.com/page{int(rng.integers(0, 4))}"
+            tab['domain'] = tab['url'].split('/')[2]
+        by_id[tab['id']] = tab
+        upserts.append(tab)
+    for tab in generate_tabs(rng, 3, NOW_MS):
+        tab['id'] = next_id
+        next_id += 1
+        by_id[tab['id']] = tab
+        upserts.append(tab)
+    return list(by_id.values()), upserts, removed, next_id
+
+@pytest.mark.parametrize('options', [
+    {'duplicate_mode': 'exact', 'grouping_mode': 'domain'},
+    {'duplicate_mode': 'canonical', 'grouping_mode': 'domain'},
+    {'duplicate_mode': 'near', 'grouping_mode': 'content'},
+])
+def test_deltas_match_full_analysis(options):
+    rng = np.random.default_rng(3)
+    tabs = generate_tabs(rng, 60, NOW_MS)
+    session = AnalysisSession('user@example.com', **options)
+    state = apply_delta({}, session.update(0, upserts=tabs, now=NOW))
+    assert_matches_full_analysis(state, tabs, **options)
+
+    next_id = len(tabs)
+    for version in range(1, 6):
+        tabs, upserts, removed, next_id = churn(rng, tabs, next_id)
+        delta = session.update(version, upserts=upserts, removed=removed, now=NOW)
+        assert delta['version'] == version + 1
+        state = apply_delta(state, delta)
+        assert_matches_full_analysis(state, tabs, **options)
+
+def test_delta_returns_only_changes():
+    rng = np.random.default_rng(5)
+    tabs = generate_tabs(rng, 100, NOW_MS)
+    session = AnalysisSession('user@example.com', duplicate_mode='exact', grouping_mode='domain')
+    first = session.update(0, upserts=tabs, now=NOW)
+    assert len(first['classifications']['changed']) == 100
+
+    unchanged = session.update(1, upserts=[tabs[0]], now=NOW)
+    assert unchanged['classifications'] == {'changed': [], 'removed': []}
+    assert unchanged['duplicates'] == unchanged['group_suggestions'] == {'changed': [], 'removed': []}
+    assert unchanged['summary'] == first['summary']
+
+    closed = session.update(2, removed=[tabs[1]['id']], now=NOW)
+    assert closed['classifications']['removed'] == [tabs[1]['id']]
+    assert closed['total_tabs'] == 99
+
+def test_stale_or_unknown_sessions_conflict():
+    sessions = AnalysisSessions(max_sessions=2, ttl=3600, directory='')
+    session = sessions.create('a@example.com')
+    session.update(0, upserts=generate_tabs(np.random.default_rng(0), 5, NOW_MS), now=NOW)
+
+    with pytest.raises(SessionConflict):
+        session.update(0, upserts=[])
+    with pytest.raises(SessionConflict):
+        sessions.get(session.id, 'b@example.com')
+    assert sessions.get(session.id, 'a@example.com') is session
+
+    sessions.create('b@example.com')
+    sessions.create('c@example.com')
+    assert len(sessions) == 2
+    with pytest.raises(SessionConflict):
+        sessions.get(session.id, 'a@example.com')
+
+def test_workers_share_sessions():
+    """Deltas alternate between workers sharing a session directory, like gunicorn's"""
+    rng = np.random.default_rng(7)
+    tabs = generate_tabs(rng, 40, NOW_MS)
+    options = {'duplicate_mode': 'canonical', 'grouping_mode': 'domain'}
+    with tempfile.TemporaryDirectory() as directory, \
+            mock.patch.object(analysis_session, 'SNAPSHOT_EVERY', 3):
+        workers = [AnalysisSessions(directory=directory) for _ in range(3)]
+        session = workers[0].create('user@example.com', **options)
+        state = apply_delta({}, session.update(0, upserts=tabs, now=NOW))
+
+        next_id = len(tabs)
+        for version in range(1, 9):
+            tabs, upserts, removed, next_id = churn(rng, tabs, next_id)
+            # Worker 2 first sees the session after several snapshots
+            worker = workers[version % 2 if version < 6 else 2]
+            delta = worker.get(session.id, 'user@example.com').update(
+                version, upserts=upserts, removed=removed, now=NOW)
+            state = apply_delta(state, delta)
+            assert_matches_full_analysis(state, tabs, **options)
+
+        # Every worker catches up before checking the version
+        with pytest.raises(SessionConflict):
+            workers[0].get(session.id, 'user@example.com').update(8, upserts=[], now=NOW)
+        with pytest.raises(SessionConflict):
+            workers[1].get(session.id, 'other@example.com')
+
+def test_create_sweeps_expired_sessions():
+    with tempfile.TemporaryDirectory() as directory:
+        sessions = AnalysisSessions(ttl=60, directory=directory)
+        old = sessions.create('a@example.com')
+        old.used_at -= 120
+        os.utime(os.path.join(directory, f"{old.id}.log"), (time.time() - 120,) * 2)
+
+        new = sessions.create('b@example.com')
+        assert len(sessions) == 1
+        assert os.listdir(directory) == [f"{new.id}.log"]
+        with pytest.raises(SessionConflict):
+            AnalysisSessions(ttl=60, directory=directory).get(old.id, 'a@example.com')
+
+def test_session_log_is_private_json():
+    with tempfile.TemporaryDirectory() as parent:
+        directory = os.path.join(parent, 'sessions')
+        os.mkdir(directory, 0o755)
+        sessions = AnalysisSessions(directory=directory)
+        assert sessions.directory == directory and os.stat(directory).st_mode & 0o777 == 0o700
+
+        tabs = generate_tabs(np.random.default_rng(3), 20, NOW_MS)
+        session = sessions.create('user@example.com', duplicate_mode='near', grouping_mode='content')
+        session.update(0, upserts=tabs, now=NOW)
+        path = os.path.join(directory, f"{session.id}.log")
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+        assert [record[0] for record in records] == ['header', 'apply']
+
+        # Snapshots round-trip the state exactly
+        log = SessionLog(path)
+        with log.locked() as f:
+            log.append(f, ('snapshot', session.snapshot()))
+        with SessionLog(path).locked() as f:
+            restored = SessionLog(path).read(f)[-1][1]
+        assert restored.keys() == session.snapshot().keys()
+        for name, value in session.snapshot().items():
+            assert type(restored[name]) is type(value)
+            assert str(restored[name]) == str(value)
+
+        # A directory that isn't a private one of ours is not shared
+        os.symlink(directory, os.path.join(parent, 'link'))
+        assert AnalysisSessions(directory=os.path.join(parent, 'link')).directory == ''
+
+def test_delta_route_resyncs_on_conflict():
+    db = mock.MagicMock()
+    app = create_app(['declutter'], db=db)
+    client = app.test_client()
+    tabs = generate_tabs(np.random.default_rng(1), 30, datetime.now().timestamp() * 1000)
+
+    started = client.post('/analyze/delta', json={'email': 'user@example.com', 'tabs': tabs}).get_json()
+    assert started['version'] == 1 and started['total_tabs'] == 30
+    # Only the totals are written back, merged into the analysis document
+    assert app.extensions['declutter'].analysis_writer.flush(timeout=10)
+    stored, = db.batch.return_value.set.call_args_list
+    assert set(stored.args[1]['last_summary']) == {'health_score', 'total_tabs', 'summary'}
+    assert stored.kwargs == {'merge': True}
+
+    delta = client.post('/analyze/delta', json={'email': 'user@example.com', 'session': started['session'],
+                                                'version': 1, 'upserts': [], 'removed': [tabs[0]['id']]})
+    assert delta.status_code == 200 and delta.get_json()['total_tabs'] == 29
+
+    stale = client.post('/analyze/delta', json={'email': 'user@example.com', 'session': started['session'],
+                                                'version': 1, 'upserts': [], 'removed': []})
+    assert stale.status_code == 409 and stale.get_json()['resync']
+    missing = client.post('/analyze/delta', json={'email': 'user@example.com', 'session': 'gone', 'version': 3})
+    assert missing.status_code == 409
+    shutdown_app(app)
+
+if __name__ == "__main__":
+    for options in ({'duplicate_mode': 'exact', 'grouping_mode': 'domain'},
+                    {'duplicate_mode': 'near', 'grouping_mode': 'content'}):
+        test_deltas_match_full_analysis(options)
+    test_delta_returns_only_changes()
+    test_stale_or_unknown_sessions_conflict()
+    test_workers_share_sessions()
+    test_create_sweeps_expired_sessions()
+    test_session_log_is_private_json()
+    test_delta_route_resyncs_on_conflict()
+    print("Analysis session tests passed")
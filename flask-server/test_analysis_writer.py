@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests for the TabAnalysis write-behind queue (no Firestore needed)
+"""
+
+import threading
+from unittest import mock
+
+from analysis_writer import AnalysisWriter
+
+def written(db):
+    """{email: values} of every document set in a committed batch"""
+    return [(call.args[0], call.args[1]) for call in db.batch.return_value.set.call_args_list]
+
+def test_unchanged_results_are_not_rewritten():
+    db = mock.MagicMock()
+    writer = AnalysisWriter(db)
+    writer.submit('a@example.com', {'last_analysis': {'health_score': 80, 'tabs': [1, 2]}})
+    assert writer.flush(timeout=10)
+    writer.submit('a@example.com', {'last_analysis': {'tabs': [1, 2], 'health_score': 80}})
+    assert writer.flush(timeout=10)
+    writer.submit('a@example.com', {'last_analysis': {'health_score': 75, 'tabs': [1]}})
+    assert writer.flush(timeout=10)
+
+    assert db.batch.return_value.commit.call_count == 2
+    stats = writer.stats()
+    assert stats['written'] == 2 and stats['unchanged'] == 1
+    writer.shutdown()
+
+def test_queued_results_coalesce_and_batch():
+    db = mock.MagicMock()
+    committing, release = threading.Event(), threading.Event()
+    commits = []
+    def commit():
+        committing.set()
+        release.wait(10)
+        commits.append(len(db.batch.return_value.set.call_args_list))
+    db.batch.return_value.commit.side_effect = commit
+
+    writer = AnalysisWriter(db, max_batch=3)
+    writer.submit('blocker@example.com', {'last_analysis': 0})
+    assert committing.wait(10)
+    # Queued while the first commit is in flight: the older result per user is dropped
+    for version in range(5):
+        for user in ('a', 'b', 'c', 'd'):
+            writer.submit(f'{user}@example.com', {'last_analysis': version})
+    release.set()
+    assert writer.flush(timeout=10)
+
+    values = [args[1]['last_analysis'] for args in written(db)]
+    assert values == [0, 4, 4, 4, 4]
+    # 1 blocker, then 4 latest results in batches of at most 3
+    assert commits == [1, 4, 5]
+    assert writer.stats()['coalesced'] == 16
+    writer.shutdown()
+
+def test_failed_writes_are_retried_then_dropped():
+    db = mock.MagicMock()
+    db.batch.return_value.commit.side_effect = [RuntimeError('unavailable'), None]
+    writer = AnalysisWriter(db, retry_delay=0)
+    writer.submit('a@example.com', {'last_summary': {'total_tabs': 3}}, merge=True)
+    assert writer.flush(timeout=10)
+    assert db.batch.return_value.commit.call_count == 2
+    assert written(db)[-1][1]['last_summary'] == {'total_tabs': 3}
+    assert db.batch.return_value.set.call_args.kwargs == {'merge': True}
+
+    db.batch.return_value.commit.side_effect = RuntimeError('unavailable')
+    writer.submit('a@example.com', {'last_summary': {'total_tabs': 4}}, merge=True)
+    assert writer.flush(timeout=10)
+    stats = writer.stats()
+    assert stats['retried'] == 1 + 2 and stats['failed'] == 1 and stats['written'] == 1
+    writer.shutdown()
+
+if __name__ == "__main__":
+    test_unchanged_results_are_not_rewritten()
+    test_queued_results_coalesce_and_batch()
+    test_failed_writes_are_retried_then_dropped()
+    print("Analysis writer tests passed")
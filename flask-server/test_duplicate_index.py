@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for canonical URLs and the MinHash near-duplicate index
+"""
+
+import numpy as np
+
+from duplicate_index import NearDuplicateIndex, canonical_url, duplicate_buckets, jaccard
+
+def test_canonical_url():
+    same = [
+        'https://example.com/docs/intro',
+        'http://www.example.com/docs/intro/',
+        'https://EXAMPLE.com:443/docs//intro#setup',
+        'https://example.com/docs/intro?utm_source=news&utm_medium=email',
+        'https://example.com/docs/intro?fbclid=abc',
+    ]
+    assert {canonical_url(url) for url in same} == {'https://example.com/docs/intro'}
+    assert canonical_url('https://example.com/s?b=2&a=1') == canonical_url('https://example.com/s?a=1&b=2')
+    assert canonical_url('https://example.com/s?q=1') != canonical_url('https://example.com/s?q=2')
+    assert canonical_url('https://example.com:8080/') != canonical_url('https://example.com/')
+    assert canonical_url('chrome://newtab/') == 'chrome://newtab/'
+    # ?ref=<branch> picks a different version of a file
+    assert canonical_url('https://github.com/a/b/blob/x.py?ref=main') != \
+        canonical_url('https://github.com/a/b/blob/x.py?ref=dev')
+
+def test_near_duplicates_match_brute_force():
+    rng = np.random.default_rng(14)
+    words = [f"w{i}" for i in range(200)]
+    items = []
+    for _ in range(300):
+        tokens = set(rng.choice(words, 8, replace=False))
+        items.append((f"site{rng.integers(0, 3)}.com", frozenset(tokens)))
+        if rng.random() < 0.3:
+            # A variant sharing 8 of 9 tokens (similarity ~0.89)
+            items.append((items[-1][0], frozenset(tokens | {'extra'})))
+
+    found = NearDuplicateIndex().clusters(items, threshold=0.8)
+    found_pairs = {(a, b) for cluster in found for a in cluster for b in cluster if a < b}
+
+    expected = {(a, b) for a in range(len(items)) for b in range(a + 1, len(items))
+                if items[a][0] == items[b][0] and jaccard(items[a][1], items[b][1]) >= 0.8}
+    # LSH may miss a few true pairs; every clustered item has a verified match
+    assert expected and len(found_pairs & expected) >= 0.95 * len(expected)
+    matched = {i for pair in expected for i in pair}
+    assert all(i in matched for cluster in found for i in cluster)
+
+def test_duplicate_modes():
+    tabs = [
+        {'url': 'https://github.com/foo/bar/issues/12', 'title': 'Fix parser crash · Issue #12 · foo/bar'},
+        {'url': 'https://www.github.com/foo/bar/issues/12/?utm_source=mail', 'title': 'Fix parser crash · Issue #12'},
+        {'url': 'https://github.com/foo/bar/issues/12/comments', 'title': 'Fix parser crash · Issue #12 · foo/bar'},
+        {'url': 'https://github.com/foo/bar/issues/13', 'title': 'Add export · Issue #13 · foo/bar'},
+        {'url': 'https://github.com/foo/bar/issues/12', 'title': 'Fix parser crash · Issue #12 · foo/bar'},
+    ]
+    sizes = lambda buckets: sorted(len(p) for p in buckets.values())
+    assert sizes(duplicate_buckets(tabs, 'exact')) == [1, 1, 1, 2]
+    assert sizes(duplicate_buckets(tabs, 'canonical')) == [1, 1, 3]
+    assert sizes(duplicate_buckets(tabs, 'near')) == [1, 4]
+
+def test_near_mode_keeps_different_query_pages_apart():
+    title = 'Product details and specifications for the item you are viewing on our store'
+    tabs = [
+        {'url': 'https://youtube.com/watch?v=A', 'title': ''},
+        {'url': 'https://youtube.com/watch?v=B', 'title': ''},
+        {'url': 'https://shop.example.com/item?id=1', 'title': title},
+        {'url': 'https://shop.example.com/item?id=2', 'title': title},
+        {'url': 'https://shop.example.com/item?id=2&utm_source=mail', 'title': title},
+    ]
+    assert sorted(map(sorted, duplicate_buckets(tabs, 'near').values())) == [[0], [1], [2], [3, 4]]
+
+if __name__ == "__main__":
+    test_canonical_url()
+    test_near_duplicates_match_brute_force()
+    test_duplicate_modes()
+    test_near_mode_keeps_different_query_pages_apart()
+    print("Duplicate index tests passed")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Firestore emulator test for the sharded HistoryStore and its migration
+
+Start the emulator first, e.g.:
+    firebase emulators:start --only firestore
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m pytest test_history_store.py
+"""
+
+import os
+import uuid
+
+import pytest
+
+from history_store import HistoryStore
+from stats_aggregates import StatsStore
+from test_model import generate_sample_data
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get('FIRESTORE_EMULATOR_HOST'),
+    reason='FIRESTORE_EMULATOR_HOST is not set'
+)
+
+@pytest.fixture
+def store():
+    from google.cloud import firestore
+    db = firestore.Client(project='tabsense-test')
+    return HistoryStore(db, collection=f'Data-{uuid.uuid4().hex}')
+
+def test_append_and_range_reads(store):
+    history = generate_sample_data()
+    store.append('user@example.com', history)
+
+    assert store.read('user@example.com') == history
+
+    days = sorted({ts[:10] for ts in history})
+    since, until = days[2], days[4]
+    expected = {ts: url for ts, url in history.items() if since <= ts[:10] <= until}
+    assert store.read('user@example.com', since=since, until=until) == expected
+    assert [day for day, _ in store.iter_buckets('user@example.com')] == days
+
+def test_migration_moves_legacy_document(store):
+    history = generate_sample_data()
+    store._user_ref('user@example.com').set(history)
+
+    # Readers see the legacy document before migration...
+    assert store.read('user@example.com') == history
+
+    assert store.migrate_user('user@example.com') == len(history)
+    assert store.legacy_history('user@example.com') == {}
+    # ...and the same history from the day buckets afterwards
+    assert store.read('user@example.com') == history
+    assert store.migrate_user('user@example.com') == 0
+
+def test_append_maintains_stats_aggregate(store):
+    from collections import Counter
+    stats_store = StatsStore(store.db)
+    # Point the aggregates at the test's private collection
+    stats_store.history_ref = lambda email: store._user_ref(email).collection('aggregates').document('history')
+    store.stats_store = stats_store
+
+    history = generate_sample_data()
+    timestamps = sorted(history)
+    store._user_ref('user@example.com').set({ts: history[ts] for ts in timestamps[:50]})
+    for ts in timestamps[50:]:
+        store.append('user@example.com', {ts: history[ts]})
+    # A retried post only counts the visits that weren't stored yet
+    extra = {'2099-01-01 00:00:00': 'github.com'}
+    store.append('user@example.com', {**{ts: history[ts] for ts in timestamps[-20:]}, **extra})
+    history.update(extra)
+
+    counts = Counter(history.values())
+    assert stats_store.history_summary('user@example.com') == {
+        'totalUrls': len(history),
+        'uniqueSites': len(counts),
+        'mostVisited': counts.most_common(1)[0][0]
+    }
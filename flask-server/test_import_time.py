@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Import-time budget for the serving path
+
+Importing the server must not pull in the ML or plotting stack: scikit-learn,
+SciPy and imbalanced-learn are loaded by the services' warm_up(), pandas and
+matplotlib only by the offline tooling (feature_analysis.py).
+TABSENSE_IMPORT_BUDGET_MS overrides the budget on slow machines.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMPORT_BUDGET_MS = float(os.environ.get('TABSENSE_IMPORT_BUDGET_MS', 1000))
+DEFERRED = ('sklearn', 'scipy', 'imblearn', 'pandas', 'matplotlib', 'seaborn')
+
+def run_python(*args):
+    result = subprocess.run([sys.executable, *args], cwd=HERE, capture_output=True, text=True, check=True)
+    return result.stdout, result.stderr
+
+def import_times(module):
+    """{module: cumulative microseconds} from python -X importtime"""
+    _, report = run_python('-X', 'importtime', '-c', f'import {module}')
+    times = {}
+    for line in report.splitlines():
+        if line.startswith('import time:') and not line.endswith('package'):
+            _, cumulative, name = line[len('import time:'):].split('|')
+            times[name.strip()] = int(cumulative)
+    return times
+
+def test_server_import_stays_within_budget():
+    times = import_times('server')
+    loaded = {name.split('.')[0] for name in times}
+    assert not loaded & set(DEFERRED), f"serving imports {sorted(loaded & set(DEFERRED))}"
+    assert times['server'] / 1000 < IMPORT_BUDGET_MS, \
+        f"import server took {times['server'] / 1000:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)"
+
+def test_warm_up_loads_ml_stack_once():
+    out, _ = run_python('-c', '''
+import json, sys
+from unittest import mock
+from server import create_app
+loaded = lambda: [m for m in %r if m in sys.modules]
+app = create_app(db=mock.MagicMock(), config={'WARM_UP': False})
+cold = loaded()
+for service in ('prediction', 'declutter'):
+    app.extensions[service].warm_up()
+print(json.dumps({'cold': cold, 'warm': loaded()}))
+''' % (DEFERRED,))
+    modules = json.loads(out.strip().splitlines()[-1])
+    assert modules['cold'] == []
+    assert {'sklearn', 'scipy'} <= set(modules['warm'])
+    # imblearn is only imported when the 'smote' imbalance strategy resamples
+    assert 'imblearn' not in modules['warm']
+    assert not {'matplotlib', 'seaborn'} & set(modules['warm'])
+
+if __name__ == "__main__":
+    test_server_import_stays_within_budget()
+    test_warm_up_loads_ml_stack_once()
+    print("Import time tests passed")
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Tests for streamed /analyze responses (no Firestore needed)
+"""
+
+import gzip
+import json
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+
+from json_stream import iter_json
+from server import create_app, shutdown_app
+from tab_classifier import analyze_tabs
+from test_tab_classifier import generate_tabs
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+def test_iter_json_matches_json_dumps():
+    tabs = generate_tabs(np.random.default_rng(2), 300, NOW.timestamp() * 1000)
+    for options in ({'grouping_mode': 'domain'}, {'grouping_mode': 'content', 'duplicate_mode': 'near'}):
+        results = analyze_tabs(tabs, now=NOW, **options)
+        assert results['duplicates'] and results['group_suggestions']
+        chunks = list(iter_json(results, chunk_size=100, items_per_piece=7))
+        assert len(chunks) > 1
+        assert json.loads(b''.join(chunks)) == json.loads(json.dumps(results))
+
+def test_analyze_streams_gzipped_json():
+    app = create_app(['declutter'], db=mock.MagicMock())
+    client = app.test_client()
+    tabs = generate_tabs(np.random.default_rng(4), 200, datetime.now().timestamp() * 1000)
+
+    plain = client.post('/analyze', json={'tabs': tabs})
+    assert 'Content-Encoding' not in plain.headers and plain.is_streamed
+    response = client.post('/analyze', json={'tabs': tabs}, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip' and response.is_streamed
+    gzipped = json.loads(gzip.decompress(response.data))
+    assert gzipped['total_tabs'] == plain.get_json()['total_tabs'] == 200
+    assert gzipped['summary'] == plain.get_json()['summary']
+    assert [c['id'] for c in gzipped['classifications']] == [c['id'] for c in plain.get_json()['classifications']]
+    shutdown_app(app)
+
+if __name__ == "__main__":
+    test_iter_json_matches_json_dumps()
+    test_analyze_streams_gzipped_json()
+    print("Streamed response tests passed")
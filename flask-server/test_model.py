@@ -4,10 +4,21 @@ Test script for TabSense ML model
 Run this to verify the ML components work correctly
 """
 
+import tempfile
+import threading
 import numpy as np
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
-from ml_model import TabSensePredictor, compare_models, analyze_browsing_patterns
+from unittest import mock
+from ml_model import (TabSensePredictor, IncrementalTabSensePredictor, compare_models,
+                      analyze_browsing_patterns)
+from model_store import ModelRegistry, history_fingerprint
+from url_vocabulary import UrlVocabulary
+from training_scheduler import TrainingScheduler
+from transition_index import TransitionIndex
+from model_evaluation import AsyncEvaluator, MetricsStore, evaluate_history
 from feature_analysis import FeatureAnalyzer, generate_feature_report
+from imbalance import ResampleCache, balance, oversample, smote
 
 def generate_sample_data():
     """Generate sample browsing data for testing"""
@@ -154,5 +165,285 @@ def test_prediction():
     print("All tests completed!")
     print("=" * 60)
 
+def test_model_registry():
+    """Cached models are reused until the history changes"""
+    sample_data = generate_sample_data()
+    
+    with tempfile.TemporaryDirectory() as model_dir:
+        registry = ModelRegistry(model_dir=model_dir)
+        
+        first = registry.get_or_train("user@example.com", sample_data)
+        assert first is not None
+        assert registry.get_or_train("user@example.com", sample_data) is first
+        
+        # A fresh registry picks the model up from the disk tier
+        reloaded = ModelRegistry(model_dir=model_dir)
+        assert reloaded.get("user@example.com", history_fingerprint(sample_data)) is not None
+        
+        # New history invalidates the cached model
+        changed = dict(sample_data)
+        changed["2099-01-01 00:00:00"] = "github.com"
+        assert registry.get("user@example.com", history_fingerprint(changed)) is None
+
+def test_model_registry_concurrent_fits():
+    """Concurrent requests share one fit per kind and agree on URL codes"""
+    sample_data = generate_sample_data()
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        registry = ModelRegistry(model_dir=model_dir)
+        fits = []
+        train = TabSensePredictor.train
+        def counting_train(self, user_data):
+            fits.append(self)
+            return train(self, user_data)
+
+        results = {}
+        def request(i, kind):
+            results[i] = registry.get_or_train("user@example.com", sample_data, kind=kind)
+
+        with mock.patch.object(TabSensePredictor, 'train', counting_train):
+            threads = [threading.Thread(target=request, args=(i, 'full' if i % 2 else 'markov'))
+                       for i in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert len(fits) == 1
+        assert len({id(results[i]) for i in (1, 3, 5)}) == 1
+        assert len({id(results[i]) for i in (0, 2, 4)}) == 1
+        saved = registry.load_vocabulary("user@example.com")
+        assert results[1].vocabulary.index == results[0].vocabulary.index == saved.index
+
+        # A fit stored while a reader loads the artifact wins over the loaded copy
+        reader = ModelRegistry(model_dir=model_dir)
+        load = reader._load_artifact
+        def load_during_put(email, kind='full'):
+            reader.put(email, history_fingerprint(sample_data), results[1], kind)
+            return load(email, kind)
+        with mock.patch.object(reader, '_load_artifact', load_during_put):
+            assert reader.get("user@example.com", history_fingerprint(sample_data)) is results[1]
+        assert reader.stats()['models'] == 1
+
+def test_incremental_predictor():
+    """Incremental updates match a full refit and only consume new visits"""
+    sample_data = generate_sample_data()
+    timestamps = sorted(sample_data)
+    split = len(timestamps) // 2
+    
+    online = IncrementalTabSensePredictor()
+    online.update({ts: sample_data[ts] for ts in timestamps[:split]})
+    online.update(sample_data)
+    
+    batch = IncrementalTabSensePredictor()
+    batch.train(sample_data)
+    
+    assert online.transitions_seen == batch.transitions_seen
+    assert online.hourly_transitions == batch.hourly_transitions
+    assert online.update(sample_data) == 0
+    assert online.predict(1, 1, 8, 30, "gmail.com") == "calendar.google.com"
+    
+    # Only growth by newer visits keeps the checkpoint usable
+    newer = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+    assert online.is_consistent_with({**sample_data, newer: "github.com"})
+    assert not online.is_consistent_with({ts: sample_data[ts] for ts in timestamps[1:]})
+    rewritten = {ts: sample_data[ts] for ts in timestamps[1:]}
+    rewritten[newer] = "github.com"
+    assert not online.is_consistent_with(rewritten)
+
+def test_incremental_updates_lock_per_user():
+    """One user's incremental update does not wait on another user's"""
+    sample_data = generate_sample_data()
+    with tempfile.TemporaryDirectory() as model_dir:
+        registry = ModelRegistry(model_dir=model_dir)
+        results = {}
+        other = threading.Thread(target=lambda: results.update(
+            b=registry.get_or_update_incremental('b@example.com', sample_data)))
+        with registry._key_lock(('incremental', 'a@example.com')):
+            other.start()
+            other.join(timeout=30)
+            assert not other.is_alive()
+        assert results['b'].transitions_seen > 0
+
+def test_url_vocabulary():
+    """URL indices are append-only and survive a save/load round trip"""
+    vocabulary = UrlVocabulary(["github.com", "gmail.com"])
+    codes = vocabulary.transform(["gmail.com", "github.com", "gmail.com"])
+    assert list(codes) == [2, 1, 2]
+    assert vocabulary.encode("unseen.com") == UrlVocabulary.UNKNOWN
+    
+    vocabulary.fit(["slack.com", "github.com"])
+    assert vocabulary.encode("github.com") == 1
+    assert list(vocabulary.inverse_transform([3, 1])) == ["slack.com", "github.com"]
+    assert list(vocabulary.classes_[codes]) == ["gmail.com", "github.com", "gmail.com"]
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = f"{tmp_dir}/vocab.json"
+        vocabulary.save(path)
+        reloaded = UrlVocabulary.load(path)
+    assert reloaded.index == vocabulary.index
+
+def test_training_scheduler():
+    """Background jobs are deduplicated per user and land in the registry"""
+    sample_data = generate_sample_data()
+    
+    with tempfile.TemporaryDirectory() as model_dir:
+        registry = ModelRegistry(model_dir=model_dir)
+        scheduler = TrainingScheduler(registry, max_workers=1)
+        try:
+            # First call is served by the fallback while the forest trains
+            scheduler.predict("user@example.com", sample_data, 1, 1, 8, 30, "gmail.com")
+            assert scheduler.submit("user@example.com", sample_data) == "running"
+        finally:
+            scheduler.shutdown(wait=True)
+        
+        stats = scheduler.stats()
+        assert stats["completed"] == 1 and stats["deduplicated"] == 1
+        assert stats["queue_depth"] == 0
+        assert registry.get("user@example.com", history_fingerprint(sample_data)) is not None
+
+def test_training_scheduler_replaces_broken_pool():
+    """A pool whose worker died is replaced instead of leaving the user stuck as running"""
+    sample_data = generate_sample_data()
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        scheduler = TrainingScheduler(ModelRegistry(model_dir=model_dir), max_workers=1)
+        broken = mock.MagicMock()
+        broken.submit.side_effect = BrokenProcessPool("A child process terminated abruptly")
+        scheduler._executor = broken
+        try:
+            assert scheduler.submit("user@example.com", sample_data) == "started"
+        finally:
+            scheduler.shutdown(wait=True)
+
+        broken.shutdown.assert_called_once()
+        stats = scheduler.stats()
+        assert stats["completed"] == 1 and stats["queue_depth"] == 0
+
+def test_transition_index():
+    """Top-k probabilities match brute-force transition counts"""
+    from collections import Counter
+    from test_prepare_data import generate_dense_data
+    
+    sample_data = generate_dense_data(3000)
+    index = TransitionIndex()
+    assert index.train(sample_data)
+    
+    timestamps = sorted(sample_data)
+    expected = Counter()
+    for current, following in zip(timestamps, timestamps[1:]):
+        current_time = datetime.strptime(current, "%Y-%m-%d %H:%M:%S")
+        following_time = datetime.strptime(following, "%Y-%m-%d %H:%M:%S")
+        if (following_time - current_time).total_seconds() <= 120 and sample_data[current] == "site1.com":
+            expected[sample_data[following]] += 1
+    
+    ranked = index.top_k("site1.com", hour=0, weekday=None, k=50)
+    assert ranked == [] or abs(sum(p for _, p in ranked) - 1.0) < 1e-9
+    
+    # The URL-level table holds the plain first-order counts
+    next_ids, counts = index._lookup(2, index.vocabulary.encode("site1.com"))
+    url_level = {index.vocabulary.decode(int(i)): int(c) for i, c in zip(next_ids, counts)}
+    assert url_level == dict(expected)
+    assert list(counts) == sorted(counts, reverse=True)
+    assert index.top_k("never-seen.com", hour=10) == []
+    # Out-of-range contexts would alias another URL's keys
+    for hour, weekday in ((24, None), (-1, None), (3, 7)):
+        try:
+            index.top_k("site1.com", hour=hour, weekday=weekday)
+            assert False, "out-of-range context accepted"
+        except ValueError:
+            pass
+
+def test_predict_batch():
+    """Batched top-1 matches one-at-a-time predictions"""
+    from test_prepare_data import generate_dense_data
+    
+    sample_data = generate_dense_data(2000)
+    predictor = TabSensePredictor()
+    assert predictor.train(sample_data)
+    
+    contexts = [(1, day, hour, 15, f"site{day}.com") for day in range(1, 8) for hour in (9, 21)]
+    contexts.append((1, 1, 9, 0, "never-seen.com"))
+    ranked = predictor.predict_batch(contexts, k=3)
+    
+    assert len(ranked) == len(contexts)
+    for context, candidates in zip(contexts, ranked):
+        assert len(candidates) == 3
+        assert candidates[0][0] == predictor.predict(*context)
+        assert candidates[0][1] >= candidates[1][1] >= candidates[2][1]
+
+def test_async_evaluation():
+    """Sampled CV runs off the training path and lands in the metrics store"""
+    from test_prepare_data import generate_dense_data
+    
+    sample_data = generate_dense_data(2000)
+    metrics = evaluate_history(sample_data, sample_size=500)
+    assert metrics["samples"] == 500 and metrics["folds"] == 3
+    assert 0.0 <= metrics["accuracy_mean"] <= 1.0
+    
+    with tempfile.TemporaryDirectory() as model_dir:
+        store = MetricsStore(f"{model_dir}/metrics")
+        evaluator = AsyncEvaluator(store, sample_rate=1.0, sample_size=500)
+        registry = ModelRegistry(model_dir=model_dir, evaluator=evaluator)
+        try:
+            assert registry.get_or_train("user@example.com", sample_data) is not None
+        finally:
+            evaluator.shutdown(wait=True)
+        assert store.latest("user@example.com")["samples"] == 500
+
+        # Each user's file stays bounded and holds only that user's results
+        bounded = MetricsStore(f"{model_dir}/bounded", max_entries=3)
+        for i in range(10):
+            bounded.record("user@example.com", {"run": i})
+        bounded.record("other@example.com", {"run": 0})
+        runs = [e["run"] for e in bounded.history("user@example.com")]
+        assert len(runs) >= 3 and runs == list(range(10 - len(runs), 10))
+        assert len(bounded._read(bounded._path("user@example.com"))) <= 6
+        assert [e["run"] for e in bounded.history("other@example.com")] == [0]
+
+def test_imbalance_strategies():
+    """Imbalance strategies handle rare URLs without failing"""
+    rng = np.random.default_rng(0)
+    # One dominant next URL, a few regular ones and some seen only once or twice
+    y = np.array([0] * 200 + [1] * 30 + [2] * 6 + [3] * 2 + [4])
+    X = rng.normal(size=(len(y), 6))
+
+    X_over, y_over = oversample(X, y, cap=4)
+    assert np.bincount(y_over).tolist() == [200, 120, 24, 8, 4]
+    assert len(X_over) == len(y_over)
+
+    # The old SMOTE call raised on classes with fewer than 6 rows and silently fell back
+    cache = ResampleCache()
+    X_smote, y_smote = smote(X, y, cache=cache)
+    assert np.bincount(y_smote).tolist() == [200, 200, 200, 200, 1]
+    assert smote(X, y, cache=cache)[0] is X_smote
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    predictor = TabSensePredictor(imbalance='class_weight')
+    X_fit, y_fit = predictor.balance(X, y)
+    assert X_fit is X and predictor.model.class_weight == 'balanced'
+    predictor.imbalance = 'none'
+    predictor.balance(X, y)
+    assert predictor.model.class_weight is None
+
+    try:
+        balance(predictor.model, X, y, 'undersample')
+        assert False, "unknown strategy accepted"
+    except ValueError:
+        pass
+
+    assert TabSensePredictor(imbalance='smote').train(generate_sample_data())
+
 if __name__ == "__main__":
-    test_prediction()
\ No newline at end of file
+    test_prediction()
+    test_model_registry()
+    test_model_registry_concurrent_fits()
+    test_incremental_predictor()
+    test_incremental_updates_lock_per_user()
+    test_url_vocabulary()
+    test_training_scheduler()
+    test_training_scheduler_replaces_broken_pool()
+    test_transition_index()
+    test_predict_batch()
+    test_async_evaluation()
+    test_imbalance_strategies()
\ No newline at end of file
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Equivalence test for the vectorized TabSensePredictor.prepare_data
+Compares it against the original per-pair strptime loop
+"""
+
+import numpy as np
+from datetime import datetime, timedelta
+from ml_model import TabSensePredictor
+from test_model import generate_sample_data
+
+def legacy_prepare_data(predictor, user_data, time_window_minutes=2):
+    """Original loop-based implementation of prepare_data"""
+    input_data = []
+    output_data = []
+
+    sorted_timestamps = sorted(user_data.keys())
+
+    for i in range(len(sorted_timestamps) - 1):
+        current_time = datetime.strptime(sorted_timestamps[i], "%Y-%m-%d %H:%M:%S")
+        next_time = datetime.strptime(sorted_timestamps[i + 1], "%Y-%m-%d %H:%M:%S")
+
+        time_diff = (next_time - current_time).total_seconds() / 60
+
+        if time_diff <= time_window_minutes:
+            current_url = user_data[sorted_timestamps[i]]
+            next_url = user_data[sorted_timestamps[i + 1]]
+
+            features = [
+                current_time.month,
+                current_time.day,
+                current_time.hour,
+                current_time.minute,
+                current_time.second,
+                predictor.encode_url(current_url)
+            ]
+
+            input_data.append(features)
+            output_data.append(next_url)
+
+    return np.array(input_data), np.array(output_data)
+
+def generate_dense_data(n_visits=5000, seed=0):
+    """Random history with bursts of visits across month and year boundaries"""
+    rng = np.random.default_rng(seed)
+    urls = [f"site{i}.com" for i in range(50)]
+    current = datetime(2023, 12, 30, 23, 0, 0)
+    data = {}
+    for _ in range(n_visits):
+        current += timedelta(seconds=int(rng.choice([5, 30, 90, 119, 120, 121, 600, 86400])))
+        data[current.strftime("%Y-%m-%d %H:%M:%S")] = str(rng.choice(urls))
+    return data
+
+def assert_equivalent(user_data, time_window_minutes=2):
+    predictor = TabSensePredictor()
+    # prepare_data grows the URL vocabulary, so run it before the legacy loop encodes URLs
+    X_new, y_new = predictor.prepare_data(user_data, time_window_minutes)
+    X_old, y_old = legacy_prepare_data(predictor, user_data, time_window_minutes)
+
+    assert X_new.shape == X_old.shape
+    assert np.array_equal(X_new, X_old)
+    assert np.array_equal(y_new, y_old)
+
+def test_prepare_data_matches_legacy():
+    assert_equivalent(generate_sample_data())
+    assert_equivalent(generate_dense_data())
+    for window in [0.5, 1, 2, 5, 10]:
+        assert_equivalent(generate_dense_data(1000, seed=int(window * 10)), window)
+
+def test_prepare_data_small_histories():
+    assert_equivalent({})
+    assert_equivalent({"2024-01-01 10:00:00": "a.com"})
+    assert_equivalent({"2024-01-01 10:00:00": "a.com", "2024-01-01 11:00:00": "b.com"})
+
+if __name__ == "__main__":
+    test_prepare_data_matches_legacy()
+    test_prepare_data_small_histories()
+    print("prepare_data matches the legacy implementation")
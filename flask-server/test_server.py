@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests for the combined server's app factory (no Firestore needed)
+"""
+
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+
+from server import create_app, shutdown_app
+from test_tab_classifier import generate_tabs
+
+def routes(app):
+    return {rule.rule: rule.endpoint for rule in app.url_map.iter_rules()}
+
+def test_combined_app_serves_both_services_on_one_client():
+    db = mock.MagicMock()
+    app = create_app(db=db)
+    served = routes(app)
+
+    assert served['/predict/batch'] == 'prediction.predict_batch'
+    assert served['/analyze'] == 'declutter.analyze_tab_data'
+    # History stats keep /stats/, tab stats move next to the other tab routes
+    assert served['/stats/<email>/'] == 'prediction.get_stats'
+    assert served['/tabs/stats/<email>/'] == 'declutter.get_user_stats'
+    assert app.extensions['prediction'].history_store.db is app.extensions['declutter'].db is db
+    assert app.extensions['prediction'].stats_store is app.extensions['declutter'].stats_store
+
+    health = app.test_client().get('/health').get_json()
+    assert health['services'] == ['prediction', 'declutter']
+
+def test_single_service_apps():
+    prediction = routes(create_app(['prediction'], db=mock.MagicMock()))
+    assert '/analyze' not in prediction and '/predict/batch' in prediction
+
+    declutter = routes(create_app(['declutter'], db=mock.MagicMock()))
+    assert '/predict/batch' not in declutter
+    assert declutter['/stats/<email>/'] == 'tab_stats'
+
+def test_route_config_from_env_and_overrides(monkeypatch):
+    monkeypatch.setenv('TABSENSE_HISTORY_DAYS', '30')
+    monkeypatch.setenv('TABSENSE_GROUPING_MODE', 'domain')
+    app = create_app(config={'PREDICT_BACKEND': 'markov'}, db=mock.MagicMock())
+    assert app.config['HISTORY_DAYS'] == 30
+    assert app.config['GROUPING_MODE'] == 'domain'
+    assert app.config['PREDICT_BACKEND'] == 'markov'
+
+    # Request options are still validated against the configured defaults
+    client = app.test_client()
+    response = client.post('/analyze', json={'tabs': [{'id': 1}], 'grouping': {'mode': 'topic'}})
+    assert response.status_code == 400
+    tabs = generate_tabs(np.random.default_rng(0), 20, datetime.now().timestamp() * 1000)
+    response = client.post('/analyze', json={'tabs': tabs})
+    assert response.status_code == 200 and response.get_json()['total_tabs'] == 20
+    shutdown_app(app)
+
+def test_predict_batch_rejects_bad_input():
+    client = create_app(['prediction'], db=mock.MagicMock()).test_client()
+    item = {'email': 'a@b.c', 'month': 6, 'day': 1, 'hour': 12, 'minute': 0, 'url': 'https://a.com'}
+    for body in ({'requests': [item], 'k': 'x'}, {'requests': [item], 'k': None},
+                 {'requests': [item], 'k': 0}, {'requests': ['a@b.c']}, [item]):
+        assert client.post('/predict/batch', json=body).status_code == 400
+    assert client.post('/predict/batch', json={'requests': [{**item, 'hour': 24}]}).status_code == 400
+    assert client.get('/predict/6/1/24/0/a.com/a@b.c/').status_code == 400
+    assert client.get('/predict/6/1/12/0/a.com/a@b.c/?backend=markov&k=0').status_code == 400
+
+def test_writes_take_the_user_from_the_id_token():
+    app = create_app(db=mock.MagicMock())
+    client = app.test_client()
+    history_store = app.extensions['prediction'].history_store = mock.MagicMock()
+    activity_store = app.extensions['declutter'].activity_store = mock.MagicMock()
+    activity_store.ingest.return_value = {'events': 1, 'documents': 1}
+    visits = {'email': 'victim@example.com', 'visits': {'2024-06-01 12:00:00': 'a.com'}}
+    events = {'email': 'victim@example.com',
+              'events': [{'tabId': 1, 'action': 'created', 'timestamp': '2024-06-01T12:00:00.000Z'}]}
+
+    assert client.post('/visits', json=visits).status_code == 401
+    assert client.post('/ingest', json=events, headers={'Authorization': 'Bearer forged'}).status_code == 401
+    assert not history_store.append.called and not activity_store.ingest.called
+
+    with mock.patch('firebase_admin.auth.verify_id_token', return_value={'email': 'user@example.com'}) as verify:
+        headers = {'Authorization': 'Bearer token'}
+        assert client.post('/visits', json=visits, headers=headers).status_code == 200
+        assert client.post('/ingest', json=events, headers=headers).status_code == 200
+    verify.assert_called_with('token')
+    assert history_store.append.call_args.args[0] == 'user@example.com'
+    assert activity_store.ingest.call_args.args[0] == 'user@example.com'
+    shutdown_app(app)
+
+if __name__ == "__main__":
+    test_combined_app_serves_both_services_on_one_client()
+    test_single_service_apps()
+    test_predict_batch_rejects_bad_input()
+    test_writes_take_the_user_from_the_id_token()
+    print("Server tests passed")
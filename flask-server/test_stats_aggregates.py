@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Tests for the write-time /stats aggregates
+"""
+
+from collections import Counter
+
+import numpy as np
+
+from stats_aggregates import (HistoryStats, HyperLogLog, SpaceSaving, summarize_tabs,
+                              tab_counter_deltas)
+from test_model import generate_sample_data
+
+def test_history_stats_match_full_recount():
+    history = generate_sample_data()
+    stats = HistoryStats()
+    # Ingest in several small appends, round-tripping through the stored form
+    urls = list(history.values())
+    for start in range(0, len(urls), 7):
+        stats = HistoryStats.from_dict(stats.to_dict())
+        stats.add_visits(urls[start:start + 7])
+
+    counts = Counter(urls)
+    assert stats.summary() == {
+        'totalUrls': len(urls),
+        'uniqueSites': len(counts),
+        'mostVisited': counts.most_common(1)[0][0]
+    }
+
+def test_hyperloglog_error_is_small():
+    for n in [10, 1000, 50000]:
+        hll = HyperLogLog()
+        for i in range(n):
+            hll.add(f"site{i}.com")
+        assert abs(hll.count() - n) <= max(1, 0.1 * n)
+
+def test_space_saving_keeps_heavy_hitters():
+    rng = np.random.default_rng(0)
+    stream = [f"site{int(i)}.com" for i in rng.zipf(1.5, 20000) if i < 5000]
+    sketch = SpaceSaving(capacity=20)
+    for url in stream:
+        sketch.add(url)
+    exact = Counter(stream).most_common(3)
+    assert [url for url, _ in sketch.top(3)] == [url for url, _ in exact]
+
+def test_tab_counter_deltas_track_summary():
+    tabs = {}
+    totals = Counter()
+    events = [
+        (1, {'isActive': True, 'status': 'normal'}),
+        (2, {'isPinned': True, 'status': 'pinned'}),
+        (3, {'status': 'unused'}),
+        (1, {'isActive': False, 'status': 'forgotten'}),
+        (3, None),
+    ]
+    for tab_id, new_tab in events:
+        totals.update(tab_counter_deltas(tabs.get(tab_id), new_tab))
+        if new_tab is None:
+            tabs.pop(tab_id)
+        else:
+            tabs[tab_id] = new_tab
+
+    summary = summarize_tabs(tabs)
+    assert {name: totals[name] for name in summary} == summary
+    assert summary['totalTabs'] == 2 and summary['forgottenTabs'] == 1
+
+if __name__ == "__main__":
+    test_history_stats_match_full_recount()
+    test_hyperloglog_error_is_small()
+    test_space_saving_keeps_heavy_hitters()
+    test_tab_counter_deltas_track_summary()
+    print("Stats aggregate tests passed")
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Property test for the vectorized TabClassifier.classify_tabs
+Random tab sets are classified by both the mask rules and the original
+per-row if-chain and must produce identical records
+"""
+
+import numpy as np
+from datetime import datetime, timezone
+from tab_classifier import (TabClassifier, analyze_tabs, legacy_activity_entries, load_tab_model,
+                            outcome_features, save_tab_model, tab_outcomes, train_tab_model)
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+def legacy_classify_tabs(features, tab_data):
+    """Original row-by-row rule chain of classify_tabs"""
+    classifications = []
+    for i, tab in enumerate(tab_data):
+        feat = features[i]
+        if feat[5] == 1:
+            action, reason, confidence = 'keep', 'Pinned tab', 1.0
+        elif feat[2] == 0 and feat[0] > 1:
+            action, reason, confidence = 'close', 'Never used', 0.95
+        elif feat[1] > 7:
+            action, reason, confidence = 'archive', f'Not used in {int(feat[1])} days', 0.85
+        elif feat[2] < 3 and feat[0] > 3:
+            action, reason, confidence = 'close', 'Rarely used', 0.75
+        elif feat[2] > 10 or feat[3] > 30:
+            action, reason, confidence = 'keep', 'Frequently used', 0.9
+        else:
+            action, reason, confidence = 'review', 'Moderate usage', 0.5
+        classifications.append({'id': tab['id'], 'action': action, 'reason': reason, 'confidence': confidence})
+    return classifications
+
+def generate_tabs(rng, n, now_ms):
+    """Random tabs clustered around the rule thresholds"""
+    tabs = []
+    for i in range(n):
+        created_age = rng.choice([rng.uniform(0, 2), rng.uniform(0, 10), rng.uniform(0, 60)]) * DAY_MS
+        activated_age = rng.uniform(0, 1) * created_age
+        tab = {
+            'id': i,
+            'createdAt': now_ms - created_age,
+            'lastActivated': now_ms - activated_age,
+            'activationCount': int(rng.choice([0, 1, 2, 3, 10, 11, rng.integers(0, 50)])),
+            'totalActiveTime': float(rng.uniform(0, 60 * 60000)),
+            'domainFrequency': int(rng.integers(1, 5)),
+        }
+        if rng.random() < 0.1:
+            tab['isPinned'] = True
+        if rng.random() < 0.3:
+            tab['groupId'] = int(rng.integers(-1, 4))
+        # Tabs missing the optional counters use the defaults
+        if rng.random() < 0.1:
+            del tab['activationCount'], tab['totalActiveTime']
+        # Small URL/domain pools so duplicates and groupings occur
+        if rng.random() < 0.9:
+            site = int(rng.integers(0, 8))
+            tab['domain'] = f'site{site}.com'
+            tab['url'] = f'https://site{site}.com/page{int(rng.integers(0, 4))}'
+            tab['title'] = f'Page {i}'
+        tabs.append(tab)
+    return tabs
+
+def test_classify_tabs_matches_legacy_rules():
+    classifier = TabClassifier()
+    rng = np.random.default_rng(11)
+    now = datetime(2024, 1, 15, 12, 0, 0)
+    now_ms = now.timestamp() * 1000
+
+    for trial in range(50):
+        tabs = generate_tabs(rng, int(rng.integers(0, 200)), now_ms)
+        features = classifier.prepare_features(tabs, now=now)
+        expected = legacy_classify_tabs(features, tabs)
+        assert classifier.classify_tabs(tabs, now=now) == expected
+
+def test_prepare_features_matches_datetime_arithmetic():
+    classifier = TabClassifier()
+    rng = np.random.default_rng(3)
+    now = datetime(2024, 1, 15, 12, 0, 0)
+    tabs = generate_tabs(rng, 100, now.timestamp() * 1000)
+
+    features = classifier.prepare_features(tabs, now=now)
+    for row, tab in zip(features, tabs):
+        created_at = datetime.fromtimestamp(tab['createdAt'] / 1000)
+        last_activated = datetime.fromtimestamp(tab['lastActivated'] / 1000)
+        assert row[0] == (now - created_at).days
+        assert row[1] == (now - last_activated).days
+        assert row[8] == last_activated.hour and row[9] == last_activated.weekday()
+
+def test_fused_analysis_matches_separate_passes():
+    classifier = TabClassifier()
+    rng = np.random.default_rng(12)
+    now = datetime(2024, 1, 15, 12, 0, 0)
+
+    for trial in range(20):
+        tabs = generate_tabs(rng, int(rng.integers(0, 120)), now.timestamp() * 1000)
+        classifications = classifier.classify_tabs(tabs, now=now)
+        duplicates = classifier.find_duplicates(tabs)
+        groups = classifier.suggest_groups(tabs)
+
+        results = analyze_tabs(tabs, now=now)
+        assert results['classifications'] == classifications
+        assert results['duplicates'] == duplicates
+        assert results['group_suggestions'] == groups
+        assert results['health_score'] == classifier.calculate_tab_health_score(tabs, now=now)
+        assert results['summary'] == {
+            'to_close': len([c for c in classifications if c['action'] == 'close']),
+            'to_archive': len([c for c in classifications if c['action'] == 'archive']),
+            'to_keep': len([c for c in classifications if c['action'] == 'keep']),
+            'to_review': len([c for c in classifications if c['action'] == 'review']),
+            'duplicate_tabs': sum(len(d['close']) for d in duplicates),
+            'grouping_opportunities': len(groups)
+        }
+
+def generate_activity(rng, n, end_ms):
+    """TabActivity log where rarely used tabs get closed and busy ones stay open"""
+    activity = {}
+    for tab_id in range(n):
+        busy = rng.random() < 0.5
+        tab = {
+            'id': tab_id,
+            'createdAt': end_ms - rng.uniform(1, 20) * DAY_MS,
+            'activationCount': int(rng.integers(12, 40) if busy else rng.integers(0, 3)),
+            'totalActiveTime': float(rng.uniform(30, 90) if busy else rng.uniform(0, 2)) * 60000,
+        }
+        tab['lastActivated'] = end_ms - rng.uniform(0, 1 if busy else 15) * DAY_MS
+        event_ms = end_ms - rng.uniform(0, 0.5) * DAY_MS
+        timestamp = datetime.fromtimestamp(event_ms / 1000, timezone.utc).isoformat().replace('+00:00', 'Z')
+        activity[timestamp] = {'tabId': tab_id, 'action': 'activated' if busy else 'closed',
+                               'timestamp': timestamp, **tab}
+    return activity
+
+def test_tab_outcomes_separate_reused_tab_ids():
+    """Chrome reuses tab ids across sessions: each tab keeps its own outcome"""
+    end = datetime(2024, 1, 15, 12, 0, 0, tzinfo=timezone.utc)
+    end_ms = end.timestamp() * 1000
+
+    def event(days_ago, action, created_days_ago, **fields):
+        timestamp = datetime.fromtimestamp(end_ms / 1000 - days_ago * 86400, timezone.utc)
+        timestamp = timestamp.isoformat().replace('+00:00', 'Z')
+        return timestamp, {'tabId': 7, 'action': action, 'timestamp': timestamp, **fields,
+                           'createdAt': end_ms - created_days_ago * DAY_MS}
+
+    activity = dict([
+        # Last session: opened, used once, closed 10 idle days later
+        event(20, 'created', 21, lastActivated=end_ms - 20 * DAY_MS, activationCount=1),
+        event(10, 'closed', 21, lastActivated=end_ms - 20 * DAY_MS, activationCount=1),
+        # This session: a new tab with the same id, in use
+        event(2, 'created', 2, lastActivated=end_ms - 2 * DAY_MS, activationCount=1),
+        event(0.1, 'activated', 2, lastActivated=end_ms - 0.1 * DAY_MS, activationCount=9),
+    ])
+    examples = tab_outcomes(activity)
+    assert sorted(outcome for _, _, outcome in examples) == ['archive', 'keep']
+    kept, = [tab for tab, _, outcome in examples if outcome == 'keep']
+    assert kept['activationCount'] == 9
+
+def test_tab_outcomes_read_nested_legacy_activity():
+    """updateDoc nested each legacy entry under its timestamp's seconds"""
+    end_ms = datetime(2024, 1, 15, 12, 0, 0, tzinfo=timezone.utc).timestamp() * 1000
+    def event(tab_id, action, **fields):
+        return {'tabId': tab_id, 'action': action, 'createdAt': end_ms - 21 * DAY_MS, **fields}
+
+    activity = {
+        # The document's first event, written flat by setDoc
+        '2023-12-25T12:00:00.000Z': event(1, 'created', lastActivated=end_ms - 21 * DAY_MS),
+        '2024-01-05T12:00:00': {
+            '000Z': event(1, 'closed', lastActivated=end_ms - 21 * DAY_MS),
+            '250Z': event(2, 'created', lastActivated=end_ms - 11 * DAY_MS),
+        },
+        '2024-01-15T11:59:59': {
+            '999Z': event(2, 'activated', lastActivated=end_ms - 1000, activationCount=4),
+            '998Z': {'status': 'normal'},
+        },
+    }
+    entries = legacy_activity_entries(activity)
+    assert len(entries) == 4
+    assert (('2024-01-05T12:00:00', '250Z'), '2024-01-05T12:00:00.250Z') in \
+        [(keys, e['timestamp']) for keys, e in entries]
+
+    examples = tab_outcomes(activity)
+    assert sorted((tab['tabId'], outcome) for tab, _, outcome in examples) == [(1, 'archive'), (2, 'keep')]
+    assert [tab['activationCount'] for tab, _, outcome in examples if outcome == 'keep'] == [4]
+
+def test_trained_tab_model_roundtrip(tmp_path):
+    rng = np.random.default_rng(13)
+    now = datetime(2024, 1, 15, 12, 0, 0)
+    examples = tab_outcomes(generate_activity(rng, 300, now.timestamp() * 1000))
+    outcomes = {outcome for _, _, outcome in examples}
+    assert outcomes == {'keep', 'close', 'archive'}
+
+    path = save_tab_model(train_tab_model(*outcome_features(examples)), str(tmp_path / 'tab_model.joblib'))
+    artifact = load_tab_model(path)
+    assert artifact is not None and artifact['holdout_accuracy'] > 0.8
+
+    tabs = generate_tabs(rng, 200, now.timestamp() * 1000)
+    classifications = TabClassifier(artifact).classify_tabs(tabs, now=now)
+    assert len(classifications) == len(tabs)
+    for tab, result in zip(tabs, classifications):
+        assert result['action'] in {'keep', 'close', 'archive', 'review'} and 0 <= result['confidence'] <= 1
+        if tab.get('isPinned'):
+            assert result['action'] == 'keep'
+
+    # Unusable artifacts fall back to the rules
+    assert load_tab_model(str(tmp_path / 'missing.joblib')) is None
+    broken = TabClassifier({'model': None})
+    assert broken.classify_tabs(tabs, now=now) == TabClassifier().classify_tabs(tabs, now=now)
+
+if __name__ == "__main__":
+    test_classify_tabs_matches_legacy_rules()
+    test_prepare_features_matches_datetime_arithmetic()
+    test_fused_analysis_matches_separate_passes()
+    test_tab_outcomes_separate_reused_tab_ids()
+    test_tab_outcomes_read_nested_legacy_activity()
+    import pathlib, tempfile
+    test_trained_tab_model_roundtrip(pathlib.Path(tempfile.mkdtemp()))
+    print("Tab classifier tests passed")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests for content-aware tab grouping
+"""
+
+from collections import Counter
+
+import numpy as np
+
+from tab_classifier import TabClassifier
+from tab_grouping import ContentGrouper, registrable_domain
+
+TOPICS = {
+    'kubernetes': ['kubernetes', 'pod', 'deployment', 'helm', 'kubectl', 'cluster', 'ingress'],
+    'recipes': ['pasta', 'recipe', 'tomato', 'garlic', 'basil', 'sauce', 'cooking'],
+    'flights': ['flight', 'lisbon', 'airline', 'booking', 'airport', 'baggage', 'fares'],
+    'pytorch': ['pytorch', 'tensor', 'cuda', 'autograd', 'optimizer', 'gradient', 'training'],
+}
+SITES = ['github.com', 'stackoverflow.com', 'medium.com', 'reddit.com', 'youtube.com', 'google.com']
+FILLER = ['guide', 'how', 'best', 'new', 'help', 'page', 'home', 'latest', 'update', 'review']
+
+def generate_topic_tabs(rng, n):
+    tabs = []
+    for i in range(n):
+        topic = list(TOPICS)[i % len(TOPICS)]
+        words = list(rng.choice(TOPICS[topic], 3, replace=False)) + list(rng.choice(FILLER, 2))
+        site = SITES[int(rng.integers(0, len(SITES)))]
+        tabs.append({
+            'id': i,
+            'url': f"https://{site}/{'/'.join(rng.choice(TOPICS[topic], 2))}/{i}",
+            'title': ' '.join(words).title(),
+            'domain': site,
+            'groupId': -1,
+            'topic': topic,
+        })
+    return tabs
+
+def test_groups_follow_topics_across_domains():
+    tabs = generate_topic_tabs(np.random.default_rng(15), 400)
+    groups = TabClassifier().suggest_groups(tabs)
+
+    assert len(groups) == len(TOPICS)
+    for group in groups:
+        topics = Counter(tabs[t['id']]['topic'] for t in group['tabs'])
+        topic, count = topics.most_common(1)[0]
+        assert count == group['count']
+        # Named after the topic's words, not a domain
+        assert set(group['terms']) <= set(TOPICS[topic]) and group['terms']
+        assert group['domain'] == ''
+
+def test_single_site_group_is_named_after_site():
+    tabs = [{'id': i, 'url': f'https://github.com/org/helm-charts/pull/{i}', 'domain': 'github.com',
+             'title': f'Helm chart release pipeline #{i}'} for i in range(5)]
+    tabs += [{'id': 5, 'url': 'https://example.org/', 'title': 'Unrelated'}]
+    groups = ContentGrouper().groups(tabs)
+    assert [g['positions'] for g in groups] == [[0, 1, 2, 3, 4]]
+    assert TabClassifier()._content_group_name(groups[0]['domain'], groups[0]['terms']).startswith('GitHub: ')
+
+def test_grouped_tabs_are_excluded():
+    tabs = generate_topic_tabs(np.random.default_rng(16), 40)
+    for tab in tabs[:20]:
+        tab['groupId'] = 7
+    grouped = {t['id'] for group in TabClassifier().suggest_groups(tabs) for t in group['tabs']}
+    assert grouped and not grouped & set(range(20))
+
+def test_registrable_domain():
+    assert registrable_domain('docs.github.com') == 'github.com'
+    assert registrable_domain('news.bbc.co.uk') == 'bbc.co.uk'
+    assert registrable_domain('localhost:8080') == 'localhost'
+
+if __name__ == "__main__":
+    test_groups_follow_topics_across_domains()
+    test_single_site_group_is_named_after_site()
+    test_grouped_tabs_are_excluded()
+    test_registrable_domain()
+    print("Tab grouping tests passed")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Tests for the bulk training CLI (no Firestore needed)
+"""
+
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from model_store import ModelRegistry, history_fingerprint
+from test_model import generate_sample_data
+from train_models import TrainingCheckpoint, make_pool, run, train_history
+
+HISTORIES = {}
+FAILURES = set()
+
+def fake_train_user(email, model_dir, history_days, kind, since):
+    """train_user with HISTORIES instead of Firestore"""
+    if email in FAILURES:
+        FAILURES.discard(email)
+        raise RuntimeError('Firestore unavailable')
+    return train_history(ModelRegistry(model_dir=model_dir, max_bytes=0), email, HISTORIES.get(email, {}), kind)
+
+def allocate(mb):
+    return len(bytearray(mb * 1024 * 1024))
+
+def test_train_history_skips_unchanged_models():
+    history = generate_sample_data()
+    with tempfile.TemporaryDirectory() as model_dir:
+        registry = ModelRegistry(model_dir=model_dir, max_bytes=0)
+        assert train_history(registry, 'a@example.com', history)['status'] == 'trained'
+        assert train_history(registry, 'a@example.com', history)['status'] == 'unchanged'
+        assert train_history(registry, 'b@example.com', {'2024-01-01 00:00:00': 'x.com'})['status'] == 'no_data'
+
+        # The servers' registry picks the artifact up
+        assert ModelRegistry(model_dir=model_dir).get('a@example.com', history_fingerprint(history)) is not None
+
+def test_run_records_checkpoint_and_resumes():
+    HISTORIES.clear()
+    HISTORIES.update({f'user{i}@example.com': generate_sample_data() for i in range(4)})
+    FAILURES.add('user2@example.com')
+    emails = sorted(HISTORIES) + ['new@example.com']
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        path = f"{model_dir}/checkpoint.jsonl"
+        options = dict(model_dir=model_dir, workers=2, worker=fake_train_user,
+                       pool_factory=lambda: ThreadPoolExecutor(2))
+
+        checkpoint = TrainingCheckpoint(path)
+        assert run(iter(emails), checkpoint, **options) == {'trained': 3, 'failed': 1, 'no_data': 1}
+        checkpoint.close()
+        with open(path) as f:
+            assert sorted(json.loads(line)['email'] for line in f) == sorted(emails)
+
+        # Only the failed user is retried
+        checkpoint = TrainingCheckpoint(path, resume=True)
+        assert run(iter(emails), checkpoint, **options) == {'resumed': 4, 'trained': 1}
+        checkpoint.close()
+
+        # A new run refits nothing: every stored model matches its history
+        checkpoint = TrainingCheckpoint(path)
+        assert run(iter(emails), checkpoint, **options) == {'unchanged': 4, 'no_data': 1}
+        checkpoint.close()
+
+def test_worker_memory_limit():
+    pool = make_pool(1, max_memory_mb=1024)
+    try:
+        assert pool.submit(allocate, 16).result() == 16 * 1024 * 1024
+        with pytest.raises(MemoryError):
+            pool.submit(allocate, 2048).result()
+    finally:
+        pool.shutdown()
+
+if __name__ == "__main__":
+    test_train_history_skips_unchanged_models()
+    test_run_records_checkpoint_and_resumes()
+    test_worker_memory_limit()
+    print("Training CLI tests passed")
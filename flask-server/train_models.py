@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+tabsense-train: pre-train next-URL models for every user in Data/ instead
+of on their first /predict request
+
+Users are enumerated from the Data collection and handed to a process
+pool; each worker streams one user's history from Firestore, fits the
+model and writes it into the model store (model_store.py), where the
+servers pick it up. Only the user list lives in the parent process.
+
+Usage:
+    python train_models.py                        # every user, all CPUs
+    python train_models.py a@x.com b@y.com        # selected users
+    python train_models.py --since 2024-06-01     # users with visits since then
+    python train_models.py --resume               # continue an interrupted run
+    python train_models.py --workers 4 --max-memory-mb 1024
+
+Every finished user is appended to the checkpoint file (default
+<model dir>/train_checkpoint.jsonl); --resume skips users recorded there
+except failed ones. Users whose stored model already matches their
+history are not refit. Use the same --history-days as the servers'
+TABSENSE_HISTORY_DAYS, or their history fingerprints will not match.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from model_store import DEFAULT_MODEL_DIR, ModelRegistry, history_fingerprint
+
+DEFAULT_TRAIN_MEMORY_MB = int(os.environ.get('TABSENSE_TRAIN_MEMORY_MB', 1024))
+DEFAULT_HISTORY_DAYS = int(os.environ.get('TABSENSE_HISTORY_DAYS', 0))
+# Workers are replaced after this many users so fragmentation can't accumulate
+TASKS_PER_WORKER = 50
+# /predict answers "Not enough data" below this many visits
+MIN_VISITS = 5
+
+
+def train_history(registry, email, user_data, kind='full'):
+    """
+    Fit and store the user's model unless the stored one was trained on
+    the same history
+    Returns {'email', 'status': 'trained' | 'unchanged' | 'no_data', 'visits', 'seconds'}
+    """
+    start = time.perf_counter()
+    result = {'email': email, 'visits': len(user_data)}
+    if len(user_data) < MIN_VISITS:
+        result['status'] = 'no_data'
+    else:
+        fingerprint = history_fingerprint(user_data)
+        if registry.get(email, fingerprint, kind) is not None:
+            result['status'] = 'unchanged'
+        elif registry.get_or_train(email, user_data, fingerprint=fingerprint, kind=kind) is not None:
+            result['status'] = 'trained'
+        else:
+            result['status'] = 'no_data'
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def limit_memory(max_memory_mb):
+    """Worker initializer: allocations past the limit raise MemoryError"""
+    if max_memory_mb > 0:
+        limit = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def train_user(email, model_dir, history_days=DEFAULT_HISTORY_DAYS, kind='full', since=None):
+    """Worker process entry point: read one user's history and train it"""
+    from firebase_client import get_db
+    from history_store import HistoryStore
+
+    start = time.perf_counter()
+    try:
+        store = HistoryStore(get_db())
+        if since and not store.has_visits_since(email, since):
+            result = {'email': email, 'status': 'no_new_data'}
+        else:
+            # The model store only keeps artifacts on disk here
+            registry = ModelRegistry(model_dir=model_dir, max_bytes=0)
+            result = train_history(registry, email, store.read_recent(email, history_days), kind)
+    except MemoryError:
+        result = {'email': email, 'status': 'failed', 'error': 'memory limit exceeded'}
+    except Exception as e:
+        result = {'email': email, 'status': 'failed', 'error': str(e)}
+    result['seconds'] = time.perf_counter() - start
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+class TrainingCheckpoint:
+    """Append-only JSON lines of finished users, flushed as they finish"""
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done = {}
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line of an interrupted run
+                    self.done[record['email']] = record
+        self._file = open(path, 'a' if resume else 'w')
+
+    def should_train(self, email):
+        record = self.done.get(email)
+        return record is None or record['status'] == 'failed'
+
+    def record(self, result):
+        self.done[result['email']] = result
+        self._file.write(json.dumps(result) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def make_pool(workers, max_memory_mb):
+    # spawn: workers don't inherit the parent's gRPC/Firebase threads
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=limit_memory, initargs=(max_memory_mb,),
+                               max_tasks_per_child=TASKS_PER_WORKER)
+
+
+def run(emails, checkpoint, model_dir=DEFAULT_MODEL_DIR, history_days=DEFAULT_HISTORY_DAYS, kind='full',
+        since=None, workers=None, max_memory_mb=DEFAULT_TRAIN_MEMORY_MB, worker=train_user, pool_factory=None):
+    """
+    Train every email in the iterable (consumed lazily, at most two users per
+    worker in flight) and record the results in the checkpoint
+    Returns {status: count}
+    """
+    workers = workers or os.cpu_count()
+    pool_factory = pool_factory or (lambda: make_pool(workers, max_memory_mb))
+    totals = {}
+    pool = pool_factory()
+    in_flight = {}
+
+    def submit(email):
+        nonlocal pool
+        try:
+            future = pool.submit(worker, email, model_dir, history_days, kind, since)
+        except BrokenProcessPool:
+            # A worker was killed (e.g. by the OOM killer): its users are recorded
+            # as failed, later users go to a new pool
+            pool.shutdown(wait=False, cancel_futures=True)
+            pool = pool_factory()
+            future = pool.submit(worker, email, model_dir, history_days, kind, since)
+        in_flight[future] = email
+
+    def finish(future):
+        email = in_flight.pop(future)
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            result = {'email': email, 'status': 'failed', 'error': 'worker process died'}
+        except Exception as e:
+            result = {'email': email, 'status': 'failed', 'error': str(e)}
+        checkpoint.record(result)
+        totals[result['status']] = totals.get(result['status'], 0) + 1
+        if result['status'] == 'failed':
+            print(f"{email}: training failed: {result.get('error')}")
+        elif result['status'] == 'trained':
+            print(f"{email}: trained on {result['visits']} visits in {result['seconds']:.1f}s")
+
+    try:
+        for email in emails:
+            if not checkpoint.should_train(email):
+                totals['resumed'] = totals.get('resumed', 0) + 1
+                continue
+            while len(in_flight) >= 2 * workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future)
+            submit(email)
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                finish(future)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tabsense-train', description='Pre-train TabSense next-URL models')
+    parser.add_argument('emails', nargs='*', help='users to train (default: every user in Data)')
+    parser.add_argument('--since', help="only users with visits on or after this day (YYYY-MM-DD)")
+    parser.add_argument('--resume', action='store_true', help='skip users the checkpoint records as done')
+    parser.add_argument('--checkpoint', help='checkpoint file (default: <model dir>/train_checkpoint.jsonl)')
+    parser.add_argument('--model-dir', default=DEFAULT_MODEL_DIR, help='model store (TABSENSE_MODEL_DIR)')
+    parser.add_argument('--history-days', type=int, default=DEFAULT_HISTORY_DAYS,
+                        help='days of history to train on, 0 = all (TABSENSE_HISTORY_DAYS)')
+    parser.add_argument('--kind', choices=['full', 'markov'], default='full',
+                        help="'full' TabSensePredictor forest or 'markov' TransitionIndex")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--max-memory-mb', type=int, default=DEFAULT_TRAIN_MEMORY_MB,
+                        help='address space limit per worker, 0 = none (TABSENSE_TRAIN_MEMORY_MB)')
+    args = parser.parse_args()
+
+    os.makedirs(args.model_dir, exist_ok=True)
+    checkpoint = TrainingCheckpoint(args.checkpoint or os.path.join(args.model_dir, 'train_checkpoint.jsonl'),
+                                    resume=args.resume)
+    if args.emails:
+        emails = args.emails
+    else:
+        from firebase_client import get_db
+        # Users whose history only lives in day buckets have no Data/<email> fields,
+        # so list document references rather than stream snapshots
+        emails = (ref.id for ref in get_db().collection('Data').list_documents(page_size=500))
+
+    start = time.perf_counter()
+    try:
+        totals = run(emails, checkpoint, model_dir=args.model_dir, history_days=args.history_days,
+                     kind=args.kind, since=args.since, workers=args.workers, max_memory_mb=args.max_memory_mb)
+    finally:
+        checkpoint.close()
+    summary = ', '.join(f"{count} {status}" for status, count in sorted(totals.items()))
+    print(f"Done in {time.perf_counter() - start:.1f}s: {summary or 'no users'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Train the declutter tab classifier from historical TabActivity outcomes
+(was each tab closed, archived or kept?) and write a versioned joblib
+artifact that app_declutter.py loads at startup (see tab_classifier.py)
+
+Usage:
+    python train_tab_classifier.py                   # every user in TabActivity
+    python train_tab_classifier.py a@x.com b@y.com   # selected users
+    python train_tab_classifier.py --output model_store/tab_classifier.v1.joblib
+    python train_tab_classifier.py --since 2024-01-01
+"""
+
+import argparse
+from collections import Counter
+
+from activity_store import ActivityStore
+from firebase_client import get_db
+from tab_classifier import (DEFAULT_TAB_MODEL_PATH, legacy_activity_entries, outcome_features,
+                            save_tab_model, tab_outcomes, train_tab_model)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the tab classifier from TabActivity logs')
+    parser.add_argument('emails', nargs='*', help='users to learn from (default: all)')
+    parser.add_argument('--output', default=DEFAULT_TAB_MODEL_PATH, help='artifact path')
+    parser.add_argument('--min-samples', type=int, default=100,
+                        help='refuse to write an artifact trained on fewer outcomes')
+    parser.add_argument('--since', help="only learn from activity on or after this 'YYYY-MM-DD'")
+    args = parser.parse_args()
+
+    db = get_db()
+
+    activity_store = ActivityStore(db)
+    emails = args.emails or [ref.id for ref in db.collection('TabActivity').list_documents()]
+
+    examples = []
+    for email in emails:
+        # Compacted daily summaries, recent /ingest events and anything not yet
+        # compacted from the legacy activity map
+        events = list(activity_store.iter_summarized_events(email, since=args.since))
+        events.extend(activity_store.iter_events(email, since=args.since))
+        events.extend(event for _, event in legacy_activity_entries(activity_store.legacy_activity(email))
+                      if not args.since or event['timestamp'][:10] >= args.since)
+        examples.extend(tab_outcomes(events))
+
+    counts = Counter(outcome for _, _, outcome in examples)
+    print(f"Collected {len(examples)} outcomes: {dict(counts)}")
+    if len(examples) < args.min_samples or len(counts) < 2:
+        print("Not enough labelled outcomes to train a model")
+        return
+
+    features, outcomes = outcome_features(examples)
+    artifact = train_tab_model(features, outcomes)
+    path = save_tab_model(artifact, args.output)
+    print(f"Wrote {path} (holdout accuracy {artifact['holdout_accuracy']})")
+
+
+if __name__ == '__main__':
+    main()
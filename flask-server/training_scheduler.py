@@ -0,0 +1,169 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from model_store import ModelRegistry, history_fingerprint
+
+DEFAULT_TRAINING_WORKERS = int(os.environ.get('TABSENSE_TRAINING_WORKERS', 0))
+
+
+def train_user_model(model_dir, email, user_data, fingerprint):
+    """
+    Worker process entry point: fit the user's model and write it to the
+    registry's disk tier. Returns the time spent training in seconds.
+    """
+    start = time.perf_counter()
+    registry = ModelRegistry(model_dir=model_dir, max_bytes=0)
+    trained = registry.get_or_train(email, user_data, fingerprint=fingerprint) is not None
+    return {'trained': trained, 'train_seconds': time.perf_counter() - start}
+
+
+class TrainingScheduler:
+    """
+    Trains user models in a process pool, off the request thread.
+    - at most one job per user runs at a time
+    - a job for a history that is already being trained is dropped
+    - while a user's job runs, newer submissions replace each other so only
+      the latest history is trained next
+    """
+    def __init__(self, registry, max_workers=DEFAULT_TRAINING_WORKERS or None, history_size=100):
+        self.registry = registry
+        self.max_workers = max_workers
+        # Created on first use: a server preloaded by gunicorn forks its
+        # workers after import, and they must not share one pool's queues
+        self._executor = None
+        # Re-entrant: a job that finishes instantly runs its callback inside _start
+        self._lock = threading.RLock()
+        self._running = {}  # email -> (fingerprint, submitted_at)
+        self._pending = {}  # email -> (user_data, fingerprint, submitted_at)
+        self._recent_jobs = deque(maxlen=history_size)
+        self.counters = {'submitted': 0, 'deduplicated': 0, 'coalesced': 0, 'completed': 0, 'failed': 0}
+
+    def submit(self, email, user_data, fingerprint=None):
+        """
+        Queue a training job for the user's current history.
+        Returns 'running', 'queued' or 'started'.
+        """
+        if fingerprint is None:
+            fingerprint = history_fingerprint(user_data)
+
+        with self._lock:
+            self.counters['submitted'] += 1
+            running = self._running.get(email)
+            pending = self._pending.get(email)
+
+            if (running and running[0] == fingerprint) or (pending and pending[1] == fingerprint):
+                self.counters['deduplicated'] += 1
+                return 'running' if running and running[0] == fingerprint else 'queued'
+
+            if running:
+                if pending:
+                    self.counters['coalesced'] += 1
+                self._pending[email] = (user_data, fingerprint, time.time())
+                return 'queued'
+
+            self._start(email, user_data, fingerprint, time.time())
+            return 'started'
+
+    def _start(self, email, user_data, fingerprint, submitted_at):
+        # Caller holds self._lock
+        args = (train_user_model, self.registry.model_dir, email, user_data, fingerprint)
+        try:
+            future = self._pool().submit(*args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory): replace the pool once
+            print("Training pool is broken, starting a new one")
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            future = self._pool().submit(*args)
+        # Only a submitted job marks the user as running, or later jobs would queue forever
+        self._running[email] = (fingerprint, submitted_at)
+        future.add_done_callback(lambda f: self._on_done(email, user_data, fingerprint, submitted_at, f))
+
+    def _on_done(self, email, user_data, fingerprint, submitted_at, future):
+        total_seconds = time.time() - submitted_at
+        job = {'email': email, 'total_seconds': total_seconds}
+
+        try:
+            result = future.result()
+            job.update(result)
+            job['queued_seconds'] = max(0.0, total_seconds - result['train_seconds'])
+            # Pull the fresh artifact from disk into the memory tier
+            if result['trained']:
+                self.registry.get(email, fingerprint)
+                if self.registry.evaluator is not None:
+                    self.registry.evaluator.maybe_submit(email, user_data)
+            outcome = 'completed'
+        except Exception as e:
+            print(f"Training job for {email} failed: {str(e)}")
+            job['error'] = str(e)
+            outcome = 'failed'
+
+        with self._lock:
+            self.counters[outcome] += 1
+            self._recent_jobs.append(job)
+            del self._running[email]
+
+            pending = self._pending.pop(email, None)
+            if pending:
+                try:
+                    self._start(email, *pending)
+                except Exception as e:
+                    print(f"Could not start training for {email}: {str(e)}")
+
+    def predictor_for(self, email, user_data):
+        """
+        Return a predictor without waiting on a fit: the last ready model
+        (queueing a retrain if it is stale), or the incremental count model
+        until the first background fit finishes
+        """
+        fingerprint = history_fingerprint(user_data)
+        latest = self.registry.get_latest(email)
+
+        if latest is None or latest[0] != fingerprint:
+            self.submit(email, user_data, fingerprint=fingerprint)
+
+        if latest is not None:
+            return latest[1]
+        return self.registry.get_or_update_incremental(email, user_data)
+
+    def predict(self, email, user_data, month, day, hour, minute, current_url):
+        """Predict the next URL with predictor_for()"""
+        predictor = self.predictor_for(email, user_data)
+        if predictor is None:
+            return None
+        return predictor.predict(month, day, hour, minute, current_url)
+
+    def stats(self):
+        """Queue depth, counters and timing of recent jobs"""
+        with self._lock:
+            jobs = list(self._recent_jobs)
+            stats = {
+                'running': len(self._running),
+                'pending': len(self._pending),
+                'queue_depth': len(self._running) + len(self._pending),
+                **self.counters
+            }
+
+        timed = [j for j in jobs if 'train_seconds' in j]
+        stats['recent_jobs'] = jobs[-10:]
+        stats['avg_train_seconds'] = sum(j['train_seconds'] for j in timed) / len(timed) if timed else None
+        stats['avg_queued_seconds'] = sum(j['queued_seconds'] for j in timed) / len(timed) if timed else None
+        return stats
+
+    def _pool(self):
+        if self._executor is None:
+            # spawn keeps forked workers from inheriting the server's gRPC/Firebase threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
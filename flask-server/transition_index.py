@@ -0,0 +1,131 @@
+from datetime import datetime
+
+import numpy as np
+
+from ml_model import history_arrays, transition_indices, time_components
+from url_vocabulary import UrlVocabulary
+
+HOURS = 24
+WEEKDAYS = 7
+
+
+def weekday_for(month, day, year=None):
+    """Weekday (Monday=0) of month/day in the given or current year, None if invalid"""
+    try:
+        return datetime(year or datetime.now().year, month, day).weekday()
+    except ValueError:
+        return None
+
+
+def _check_context(hour, weekday=None):
+    # Out-of-range values would pack into another URL's context keys
+    if not 0 <= hour < HOURS:
+        raise ValueError(f"hour must be in 0..{HOURS - 1}, got {hour}")
+    if weekday is not None and not 0 <= weekday < WEEKDAYS:
+        raise ValueError(f"weekday must be in 0..{WEEKDAYS - 1}, got {weekday}")
+
+
+class TransitionIndex:
+    """
+    First-order Markov next-URL model for top-k prediction.
+    Transition counts are kept at three levels, from most to least specific:
+      0: (current URL, hour of day, weekday)
+      1: (current URL, hour of day)
+      2: (current URL)
+    Each level is stored as sorted group keys with offsets into flat arrays of
+    next-URL ids and counts (ordered by count, descending), so a top-k lookup
+    is one binary search plus a slice.
+    """
+    LEVELS = 3
+
+    def __init__(self, vocabulary=None):
+        self.vocabulary = vocabulary if vocabulary is not None else UrlVocabulary()
+        self.levels = []
+
+    def train(self, user_data, time_window_minutes=2):
+        """Build the index from the same transitions TabSensePredictor trains on"""
+        times, urls = history_arrays(user_data)
+        current = transition_indices(times, time_window_minutes)
+        if len(current) == 0:
+            return False
+
+        _, _, hour, _, _ = time_components(times[current])
+        # 1970-01-01 was a Thursday
+        weekday = (times[current].astype('datetime64[D]').astype(np.int64) + 3) % WEEKDAYS
+        _check_context(hour.min(), weekday.min())
+        _check_context(hour.max(), weekday.max())
+
+        src = self.vocabulary.add_many(urls[current])
+        dst = self.vocabulary.add_many(urls[current + 1])
+
+        self.levels = [
+            self._build_level((src * HOURS + hour) * WEEKDAYS + weekday, dst),
+            self._build_level(src * HOURS + hour, dst),
+            self._build_level(src, dst),
+        ]
+        return True
+
+    @staticmethod
+    def _build_level(keys, dst):
+        # Count each (key, next URL) pair
+        pairs, counts = np.unique(np.column_stack([keys, dst]), axis=0, return_counts=True)
+        # Group by key with the most frequent next URLs first
+        order = np.lexsort((-counts, pairs[:, 0]))
+        pairs, counts = pairs[order], counts[order]
+
+        group_keys, offsets = np.unique(pairs[:, 0], return_index=True)
+        return {
+            'keys': group_keys,
+            'offsets': np.append(offsets, len(pairs)).astype(np.int64),
+            'next': pairs[:, 1].astype(np.int32),
+            'counts': counts.astype(np.int32),
+        }
+
+    def _lookup(self, level, key):
+        table = self.levels[level]
+        pos = np.searchsorted(table['keys'], key)
+        if pos == len(table['keys']) or table['keys'][pos] != key:
+            return None
+        start, end = table['offsets'][pos], table['offsets'][pos + 1]
+        return table['next'][start:end], table['counts'][start:end]
+
+    def top_k(self, current_url, hour, weekday=None, k=5):
+        """
+        Most likely next URLs as [(url, probability)], using the most specific
+        level that has seen this context
+        """
+        _check_context(hour, weekday)
+        if not self.levels:
+            return []
+        src = self.vocabulary.encode(current_url)
+        if src == UrlVocabulary.UNKNOWN:
+            return []
+
+        candidates = []
+        if weekday is not None:
+            candidates.append((0, (src * HOURS + hour) * WEEKDAYS + weekday))
+        candidates.append((1, src * HOURS + hour))
+        candidates.append((2, src))
+
+        for level, key in candidates:
+            found = self._lookup(level, key)
+            if found is not None:
+                next_ids, counts = found
+                total = counts.sum()
+                return [
+                    (self.vocabulary.decode(int(idx)), float(count) / total)
+                    for idx, count in zip(next_ids[:k], counts[:k])
+                ]
+        return []
+
+    def predict(self, month, day, hour, minute, current_url):
+        """Top-1 prediction with the TabSensePredictor.predict signature"""
+        ranked = self.top_k(current_url, hour, weekday_for(month, day), k=1)
+        return ranked[0][0] if ranked else None
+
+    def predict_batch(self, contexts, k=1):
+        """Top-k (url, probability) lists for many contexts, see TabSensePredictor.predict_batch"""
+        return [
+            self.top_k(current_url, hour, weekday_for(month, day), k)
+            for month, day, hour, minute, current_url in contexts
+        ]
@@ -0,0 +1,96 @@
+import json
+import os
+
+import numpy as np
+
+
+class UrlVocabulary:
+    """
+    Append-only URL -> integer index shared by the input features and the
+    output labels of TabSensePredictor.
+    Indices never change once assigned, so encodings are stable across
+    processes, restarts and retrains. Index 0 is reserved for unknown URLs.
+    Exposes the LabelEncoder methods used by the training code
+    (fit / transform / inverse_transform / classes_).
+    """
+    UNKNOWN = 0
+
+    def __init__(self, urls=None):
+        self.index = {}
+        self.urls = ['']
+        if urls:
+            self.add_many(urls)
+
+    def __len__(self):
+        return len(self.urls) - 1
+
+    def __contains__(self, url):
+        return url in self.index
+
+    def add(self, url):
+        """Return the index of url, assigning the next free one if it is new"""
+        idx = self.index.get(url)
+        if idx is None:
+            idx = len(self.urls)
+            self.index[url] = idx
+            self.urls.append(url)
+        return idx
+
+    def add_many(self, urls):
+        """Vector form of add()"""
+        return np.array([self.add(url) for url in urls], dtype=np.int64)
+
+    def encode(self, url):
+        """Index of url without growing the vocabulary (UNKNOWN if unseen)"""
+        return self.index.get(url, self.UNKNOWN)
+
+    def decode(self, idx):
+        return self.urls[idx] if 0 < idx < len(self.urls) else None
+
+    # LabelEncoder compatible API
+
+    @property
+    def classes_(self):
+        """URL of each code, so classes_[code] decodes it; classes_[UNKNOWN] is ''"""
+        return np.asarray(self.urls, dtype=object)
+
+    def fit(self, y):
+        for url in np.unique(np.asarray(y)):
+            self.add(url)
+        return self
+
+    def transform(self, y):
+        unique, inverse = np.unique(np.asarray(y), return_inverse=True)
+        try:
+            codes = np.array([self.index[url] for url in unique], dtype=np.int64)
+        except KeyError as e:
+            raise ValueError(f"y contains previously unseen labels: {e}")
+        return codes[inverse]
+
+    def fit_transform(self, y):
+        return self.fit(y).transform(y)
+
+    def inverse_transform(self, codes):
+        return np.asarray(self.urls, dtype=object)[np.asarray(codes, dtype=np.int64)]
+
+    # Persistence
+
+    def to_dict(self):
+        return {'urls': self.urls[1:]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('urls', []))
+
+    def save(self, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
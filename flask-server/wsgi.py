@@ -0,0 +1,31 @@
+"""
+Production entry point (configured in gunicorn.conf.py):
+    gunicorn -c gunicorn.conf.py                               # all routes, port 5001
+    TABSENSE_SERVICE=prediction gunicorn -c gunicorn.conf.py   # prediction only, port 5000
+    TABSENSE_SERVICE=declutter gunicorn -c gunicorn.conf.py    # declutter only, port 5001
+
+With preload_app the gunicorn master calls create_app() once: Firebase is
+initialized, scikit-learn / imbalanced-learn are imported and the tab
+classifier artifact is loaded before the workers fork, so every worker
+starts warm and shares those pages copy-on-write.
+Nothing may open a connection or a process pool at import time: the
+Firestore client connects on its first request and the training and
+evaluation pools are created on first use, inside each worker.
+"""
+
+import server
+
+SERVICES = {'all': server.SERVICES, 'prediction': ('prediction',), 'declutter': ('declutter',)}
+DEFAULT_PORTS = {'all': 5001, 'prediction': 5000, 'declutter': 5001}
+
+
+def create_app(service='all'):
+    """Build the app for TABSENSE_SERVICE, warm even if TABSENSE_WARM_UP is off"""
+    if service not in SERVICES:
+        raise ValueError(f"service must be one of {', '.join(SERVICES)}")
+    return server.create_app(SERVICES[service], config={'WARM_UP': True})
+
+
+def shutdown_app(app):
+    """Release the app's background workers (gunicorn worker_exit hook)"""
+    server.shutdown_app(app)
@@ -67,7 +67,7 @@ echo ""
 echo "3. Start the Flask server:"
 echo "   cd flask-server"
 echo "   source venv/bin/activate"
-echo "   python app.py"
+echo "   python server.py"
 echo ""
 echo "4. Use TabSense:"
 echo "   - Click the extension icon"